@@ -0,0 +1,170 @@
+"""Benchmark offline handler Telegram dengan SheetsStorage di atas worksheet palsu.
+
+Contoh:
+    python -m bench.bench_handlers --members 1000 10000 100000 --films 100 10000 --latency 20
+"""
+import os
+import sys
+import json
+import time
+import random
+import asyncio
+import logging
+import argparse
+from collections import defaultdict
+
+os.environ.setdefault("BOT_TOKEN", "123456:BENCH")
+
+import main
+from bench.fake_sheets import FakeSheetsStorage, fake_members, fake_films
+from bench.stub_telegram import StubTelegramRequest, message_update, callback_update
+
+# (nama skenario, bobot)
+SCENARIOS = [
+    ("start", 10),
+    ("start_deeplink", 15),
+    ("status", 15),
+    ("gratis", 25),
+    ("vip_episode", 15),
+    ("button_free", 10),
+    ("button_status", 5),
+    ("new_user", 5),
+]
+
+def percentile(values, q):
+    ordered = sorted(values)
+    return ordered[int(round(q * (len(ordered) - 1)))]
+
+def make_update(scenario, update_id, members, films, rng):
+    """Update mentah sintetis untuk satu skenario"""
+    user_id = 1000000 + rng.randrange(members)
+    film_code = f"F{rng.randrange(films)}"
+    if scenario == "start":
+        return message_update(update_id, user_id, "/start")
+    if scenario == "start_deeplink":
+        return message_update(update_id, user_id, f"/start {main.encode_film_code(film_code, 'P1')}")
+    if scenario == "status":
+        return message_update(update_id, user_id, "/status")
+    if scenario == "gratis":
+        return message_update(update_id, user_id, f"/gratis {film_code}")
+    if scenario == "vip_episode":
+        return message_update(update_id, user_id, f"/vip_episode {film_code}")
+    if scenario == "button_free":
+        return callback_update(update_id, user_id, f"free_{film_code}")
+    if scenario == "button_status":
+        return callback_update(update_id, user_id, "status")
+    # new_user: id di luar rentang member yang ada
+    return message_update(update_id, 5000000 + update_id, "/start")
+
+async def run_case(members, films, updates, latency, seed):
+    """Jalankan satu kombinasi ukuran member/film, return hasil per skenario"""
+    rng = random.Random(seed)
+    storage = FakeSheetsStorage(
+        fake_members(members), fake_films(films), latency=latency,
+        flush_interval=main.SHEETS_FLUSH_INTERVAL,
+        flush_max_cells=main.SHEETS_FLUSH_MAX_CELLS,
+        member_record_ttl=main.MEMBER_RECORD_TTL,
+        film_cache_ttl=main.FILM_CACHE_TTL,
+        reads_per_minute=main.SHEETS_READS_PER_MINUTE,
+        writes_per_minute=main.SHEETS_WRITES_PER_MINUTE,
+        user_max_wait=main.SHEETS_USER_MAX_WAIT,
+        background_max_wait=main.SHEETS_BACKGROUND_MAX_WAIT
+    )
+    await storage.start()
+    main.storage = storage
+
+    application = main.initialize_bot(StubTelegramRequest())
+    await application.initialize()
+    await application.start()
+    main.application = application
+
+    # Update pertama membayar pemuatan index member + katalog film
+    started = time.perf_counter()
+    await storage.ensure_member_index()
+    await storage.get_film("F0")
+    cold = {'seconds': time.perf_counter() - started, 'calls': storage.sheet_calls()}
+
+    results = defaultdict(list)  # skenario -> [(detik, panggilan sheets)]
+    names = [name for name, _ in SCENARIOS]
+    weights = [weight for _, weight in SCENARIOS]
+    for update_id in range(1, updates + 1):
+        scenario = rng.choices(names, weights)[0]
+        data = make_update(scenario, update_id, members, films, rng)
+        calls_before = storage.sheet_calls()
+        started = time.perf_counter()
+        await main.process_raw_update(data)
+        results[scenario].append((time.perf_counter() - started, storage.sheet_calls() - calls_before))
+
+    # Penulisan write-behind dihitung terpisah (bukan di jalur update)
+    calls_before = storage.sheet_calls()
+    await storage.flush()
+    flush_calls = storage.sheet_calls() - calls_before
+
+    await application.stop()
+    await application.shutdown()
+    await storage.stop()
+    storage.executor.shutdown(wait=False)
+    main.application = None
+    main.storage = None
+    return cold, results, flush_calls
+
+def summarize(results):
+    """p50/p99 (ms) dan rata-rata panggilan Sheets per skenario + total"""
+    rows = {}
+    everything = []
+    for scenario, samples in sorted(results.items()):
+        everything.extend(samples)
+        rows[scenario] = _row(samples)
+    rows["ALL"] = _row(everything)
+    return rows
+
+def _row(samples):
+    latencies = [seconds for seconds, _ in samples]
+    calls = [count for _, count in samples]
+    return {
+        'count': len(samples),
+        'p50_ms': percentile(latencies, 0.50) * 1000,
+        'p99_ms': percentile(latencies, 0.99) * 1000,
+        'calls_per_update': sum(calls) / len(calls),
+        'max_calls': max(calls)
+    }
+
+async def run(args):
+    report = []
+    for members in args.members:
+        for films in args.films:
+            cold, results, flush_calls = await run_case(
+                members, films, args.updates, args.latency / 1000, args.seed
+            )
+            rows = summarize(results)
+            report.append({
+                'members': members, 'films': films, 'cold_seconds': cold['seconds'],
+                'cold_calls': cold['calls'], 'flush_calls': flush_calls, 'scenarios': rows
+            })
+
+            print(f"\n== {members} member, {films} film, latency {args.latency}ms/call ==")
+            print(f"cold load: {cold['seconds'] * 1000:.1f} ms, {cold['calls']} panggilan; "
+                  f"flush akhir: {flush_calls} panggilan")
+            print(f"{'skenario':<16}{'n':>6}{'p50 ms':>10}{'p99 ms':>10}{'calls/upd':>11}{'max':>5}")
+            for scenario, row in rows.items():
+                print(f"{scenario:<16}{row['count']:>6}{row['p50_ms']:>10.2f}{row['p99_ms']:>10.2f}"
+                      f"{row['calls_per_update']:>11.2f}{row['max_calls']:>5}")
+
+    if args.json:
+        with open(args.json, "w") as f:
+            json.dump(report, f, indent=2)
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description="Benchmark offline handler bot dengan Sheets palsu")
+    parser.add_argument("--members", type=int, nargs="+", default=[1000, 10000, 100000])
+    parser.add_argument("--films", type=int, nargs="+", default=[100, 10000])
+    parser.add_argument("--updates", type=int, default=300, help="Update per kombinasi")
+    parser.add_argument("--latency", type=float, default=20, help="Latency per panggilan Sheets (ms)")
+    parser.add_argument("--seed", type=int, default=1)
+    parser.add_argument("--json", help="Simpan hasil ke file JSON untuk dibandingkan antar commit")
+    return parser.parse_args(argv)
+
+if __name__ == '__main__':
+    logging.getLogger().setLevel(logging.WARNING)
+    asyncio.run(run(parse_args()))
+    sys.exit(0)
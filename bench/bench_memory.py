@@ -0,0 +1,112 @@
+"""Benchmark memori index member: list dict get_all_records, dict MemberRecord, MemberTable.
+
+Setiap layout dibangun dari isi sheet members sintetis lalu diukur dengan
+tracemalloc setelah data mentah sheet dibuang (yang tersisa = biaya resident).
+
+Contoh:
+    python -m bench.bench_memory --members 10000 100000 1000000
+"""
+import gc
+import sys
+import json
+import time
+import random
+import argparse
+import tracemalloc
+
+from storage import MemberRecord, MemberTable
+from bench.fake_sheets import fake_members
+
+def build_records(values):
+    """Cara lama: get_all_records() -> list dict berkunci string, dicari linear"""
+    header = values[0]
+    return [dict(zip(header, row)) for row in values[1:]]
+
+def lookup_records(records, user_id):
+    for record in records:
+        if str(record["telegram_id"]) == user_id:
+            return record
+    return None
+
+def build_dict(values):
+    """Index sebelumnya: dict telegram_id -> MemberRecord"""
+    index = {}
+    for idx, row_values in enumerate(values[1:], start=2):
+        record = MemberRecord.from_values(idx, row_values)
+        index.setdefault(record.telegram_id, record)
+    return index
+
+def build_table(values):
+    return MemberTable.from_sheet(values[1:], first_row=2)
+
+LAYOUTS = [
+    ("get_all_records", build_records, lookup_records),
+    ("dict_records", build_dict, lambda index, user_id: index.get(user_id)),
+    ("member_table", build_table, lambda table, user_id: table.get(user_id)),
+]
+
+def sheet_values(members, seed):
+    return [[str(v) for v in row] for row in fake_members(members, seed=seed)]
+
+def measure(members, build, lookup, lookups, seed):
+    """(byte resident, detik build, mikrodetik per lookup)"""
+    # Sheet mentah dibuat di dalam tracemalloc lalu dibuang setelah build, jadi
+    # yang terhitung = index + string sheet yang tetap dipegang index
+    gc.collect()
+    tracemalloc.start()
+    index = build(sheet_values(members, seed))
+    gc.collect()
+    resident = tracemalloc.get_traced_memory()[0]
+    tracemalloc.stop()
+    del index
+
+    # Waktu diukur terpisah karena tracemalloc memperlambat alokasi
+    values = sheet_values(members, seed)
+    started = time.perf_counter()
+    index = build(values)
+    build_seconds = time.perf_counter() - started
+    del values
+
+    rng = random.Random(seed)
+    user_ids = [str(1000000 + rng.randrange(members)) for _ in range(lookups)]
+    started = time.perf_counter()
+    for user_id in user_ids:
+        lookup(index, user_id)
+    lookup_us = (time.perf_counter() - started) / lookups * 1e6
+    return resident, build_seconds, lookup_us
+
+def run(args):
+    report = []
+    for members in args.members:
+        print(f"\n== {members} member ==")
+        print(f"{'layout':<18}{'MB':>10}{'byte/member':>13}{'build s':>10}{'lookup us':>11}")
+        for name, build, lookup in LAYOUTS:
+            if name == "get_all_records" and members > args.max_linear:
+                continue  # Lookup linear terlalu lambat untuk diukur di ukuran ini
+            lookups = args.lookups if name != "get_all_records" else max(1, args.lookups // 100)
+            resident, build_seconds, lookup_us = measure(members, build, lookup, lookups, args.seed)
+            report.append({
+                'members': members, 'layout': name, 'bytes': resident,
+                'bytes_per_member': resident / members, 'build_seconds': build_seconds,
+                'lookup_us': lookup_us
+            })
+            print(f"{name:<18}{resident / 2 ** 20:>10.1f}{resident / members:>13.1f}"
+                  f"{build_seconds:>10.2f}{lookup_us:>11.2f}")
+
+    if args.json:
+        with open(args.json, "w") as f:
+            json.dump(report, f, indent=2)
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description="Bandingkan memori layout index member")
+    parser.add_argument("--members", type=int, nargs="+", default=[10000, 100000])
+    parser.add_argument("--lookups", type=int, default=100000, help="Lookup acak per layout")
+    parser.add_argument("--max-linear", type=int, default=100000,
+                        help="Lewati get_all_records di atas jumlah member ini")
+    parser.add_argument("--seed", type=int, default=1)
+    parser.add_argument("--json", help="Simpan hasil ke file JSON untuk dibandingkan antar commit")
+    return parser.parse_args(argv)
+
+if __name__ == '__main__':
+    run(parse_args())
+    sys.exit(0)
@@ -0,0 +1,106 @@
+"""Benchmark refresh index member: load penuh (get_all_values) vs sync inkremental.
+
+Setiap putaran mengubah `--churn` baris lama dan menambah `--churn` baris baru
+langsung di worksheet palsu, lalu mengukur baris yang dibaca dari sheet dan
+waktu refresh untuk kedua cara.
+
+Contoh:
+    python -m bench.bench_sync --members 10000 100000 --churn 10 100
+"""
+import sys
+import json
+import time
+import random
+import asyncio
+import argparse
+
+from bench.fake_sheets import FakeSheetsStorage, fake_members, fake_films
+
+class CountingSheetsStorage(FakeSheetsStorage):
+    """Hitung baris yang dikembalikan worksheet members"""
+
+    def connect(self):
+        super().connect()
+        self.rows_read = 0
+        sheet = self.sheet_members
+        get_all_values, batch_get = sheet.get_all_values, sheet.batch_get
+
+        def counted_get_all_values():
+            values = get_all_values()
+            self.rows_read += len(values)
+            return values
+
+        def counted_batch_get(ranges):
+            results = batch_get(ranges)
+            self.rows_read += sum(len(values) for values in results)
+            return results
+
+        sheet.get_all_values, sheet.batch_get = counted_get_all_values, counted_batch_get
+
+def mutate(sheet, churn, rng, next_id):
+    """Ubah `churn` baris lama dan tambah `churn` member baru"""
+    for _ in range(churn):
+        sheet._set(rng.randrange(2, len(sheet.rows) + 1), 6, str(rng.randrange(6)))
+    for offset in range(churn):
+        sheet._set(len(sheet.rows) + 1, 1, str(next_id + offset))
+    return next_id + churn
+
+async def measure(members, churn, rounds, block_size, verify_blocks, seed):
+    """(baris dibaca, ms) rata-rata per refresh untuk load penuh dan sync"""
+    rng = random.Random(seed)
+    storage = CountingSheetsStorage(
+        fake_members(members, seed=seed), fake_films(10),
+        reads_per_minute=10 ** 9, writes_per_minute=10 ** 9,
+        sync_block_size=block_size, sync_verify_blocks=verify_blocks
+    )
+    await storage.ensure_member_index()
+    next_id = 9000000
+    result = {}
+    for mode in ("full", "sync"):
+        rows_read, elapsed = 0, 0.0
+        for _ in range(rounds):
+            next_id = mutate(storage.sheet_members, churn, rng, next_id)
+            storage.rows_read = 0
+            started = time.perf_counter()
+            if mode == "full":
+                await storage.load_member_index()
+            else:
+                await storage.sync_member_index()
+            elapsed += time.perf_counter() - started
+            rows_read += storage.rows_read
+        result[mode] = (rows_read / rounds, elapsed / rounds * 1000)
+    return result
+
+def run(args):
+    report = []
+    print(f"{'members':>9}{'churn':>7}{'full rows':>11}{'full ms':>9}{'sync rows':>11}{'sync ms':>9}")
+    for members in args.members:
+        for churn in args.churn:
+            result = asyncio.run(measure(
+                members, churn, args.rounds, args.block_size, args.verify_blocks, args.seed
+            ))
+            (full_rows, full_ms), (sync_rows, sync_ms) = result["full"], result["sync"]
+            report.append({
+                'members': members, 'churn': churn, 'full_rows': full_rows, 'full_ms': full_ms,
+                'sync_rows': sync_rows, 'sync_ms': sync_ms
+            })
+            print(f"{members:>9}{churn:>7}{full_rows:>11.0f}{full_ms:>9.1f}{sync_rows:>11.0f}{sync_ms:>9.1f}")
+
+    if args.json:
+        with open(args.json, "w") as f:
+            json.dump(report, f, indent=2)
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description="Bandingkan load penuh vs sync inkremental sheet members")
+    parser.add_argument("--members", type=int, nargs="+", default=[10000, 100000])
+    parser.add_argument("--churn", type=int, nargs="+", default=[10, 100], help="Baris diubah + ditambah per putaran")
+    parser.add_argument("--rounds", type=int, default=5)
+    parser.add_argument("--block-size", type=int, default=500)
+    parser.add_argument("--verify-blocks", type=int, default=2)
+    parser.add_argument("--seed", type=int, default=1)
+    parser.add_argument("--json", help="Simpan hasil ke file JSON untuk dibandingkan antar commit")
+    return parser.parse_args(argv)
+
+if __name__ == '__main__':
+    run(parse_args())
+    sys.exit(0)
@@ -0,0 +1,186 @@
+"""Worksheet Google Sheets palsu di memori untuk benchmark dan load test"""
+import re
+import time
+import random
+import threading
+from collections import Counter
+from datetime import datetime, timedelta
+
+from storage import SheetsStorage, rowcol_to_a1
+
+A1_CELL = re.compile(r"([A-Z]*)(\d*)")
+
+def a1_to_rowcol(label):
+    """(baris, kolom) dari label A1; bagian yang kosong ("A", "12") jadi None"""
+    letters, row = A1_CELL.fullmatch(label).groups()
+    col = 0
+    for letter in letters:
+        col = col * 26 + ord(letter) - 64
+    return int(row) if row else None, col or None
+
+class FakeSpreadsheet:
+    """Cukup untuk get_lastUpdateTime(): waktu berubah setiap ada penulisan"""
+
+    def __init__(self):
+        self.version = 0
+
+    def touch(self):
+        self.version += 1
+
+    def get_lastUpdateTime(self):
+        return f"2024-01-01T00:00:00.{self.version:06d}Z"
+
+class FakeCell:
+    def __init__(self, row, col, value):
+        self.row = row
+        self.col = col
+        self.value = value
+
+class FakeWorksheet:
+    """Implementasi in-memory method gspread yang dipakai storage, dengan latency per call"""
+
+    def __init__(self, title, rows, latency=0.0, jitter=0.0, spreadsheet=None):
+        self.title = title
+        self.spreadsheet = spreadsheet or FakeSpreadsheet()
+        self.rows = [[str(v) for v in row] for row in rows]  # Baris pertama = header
+        self.latency = latency
+        self.jitter = jitter
+        self.calls = Counter()
+        self.lock = threading.Lock()
+
+    def _call(self, name):
+        with self.lock:
+            self.calls[name] += 1
+        delay = self.latency + random.uniform(0, self.jitter)
+        if delay:
+            time.sleep(delay)
+
+    def _set(self, row, col, value):
+        self.spreadsheet.touch()
+        while len(self.rows) < row:
+            self.rows.append([])
+        cells = self.rows[row - 1]
+        cells.extend([""] * (col - len(cells)))
+        cells[col - 1] = str(value)
+
+    def _updated_range(self, first_row, count, width):
+        return {'updates': {'updatedRange': f"{self.title}!A{first_row}:{rowcol_to_a1(first_row + count - 1, width)}"}}
+
+    def get_all_values(self):
+        self._call("get_all_values")
+        return [list(row) for row in self.rows]
+
+    def get_all_records(self):
+        self._call("get_all_records")
+        header = self.rows[0]
+        return [dict(zip(header, row + [""] * (len(header) - len(row)))) for row in self.rows[1:]]
+
+    def row_values(self, row):
+        self._call("row_values")
+        return list(self.rows[row - 1]) if row <= len(self.rows) else []
+
+    def cell(self, row, col):
+        self._call("cell")
+        values = self.rows[row - 1] if row <= len(self.rows) else []
+        return FakeCell(row, col, values[col - 1] if col <= len(values) else "")
+
+    def update_cell(self, row, col, value):
+        self._call("update_cell")
+        self._set(row, col, value)
+
+    def get(self, range_name):
+        self._call("get")
+        start, _, end = range_name.partition(":")
+        first_row, first_col = a1_to_rowcol(start)
+        last_row, last_col = a1_to_rowcol(end or start)
+        return [
+            self.rows[row - 1][first_col - 1:last_col]
+            for row in range(first_row, min(last_row, len(self.rows)) + 1)
+        ]
+
+    def batch_get(self, ranges):
+        """Seperti API: sel kosong di kanan dan baris kosong di akhir tiap range dipotong"""
+        self._call("batch_get")
+        results = []
+        for range_name in ranges:
+            start, _, end = range_name.partition(":")
+            first_row, first_col = a1_to_rowcol(start)
+            last_row, last_col = a1_to_rowcol(end or start)
+            first_row, first_col = first_row or 1, first_col or 1
+            last_row = min(last_row or len(self.rows), len(self.rows))
+            values = []
+            for row in range(first_row, last_row + 1):
+                cells = self.rows[row - 1][first_col - 1:last_col]
+                while cells and cells[-1] == "":
+                    cells = cells[:-1]
+                values.append(list(cells))
+            while values and not values[-1]:
+                values.pop()
+            results.append(values)
+        return results
+
+    def append_row(self, values, value_input_option=None):
+        self._call("append_row")
+        self.spreadsheet.touch()
+        self.rows.append([str(v) for v in values])
+        return self._updated_range(len(self.rows), 1, len(values))
+
+    def append_rows(self, values, value_input_option=None):
+        self._call("append_rows")
+        self.spreadsheet.touch()
+        first_row = len(self.rows) + 1
+        self.rows.extend([str(v) for v in row] for row in values)
+        return self._updated_range(first_row, len(values), max(len(row) for row in values))
+
+    def batch_update(self, data, value_input_option=None):
+        self._call("batch_update")
+        for entry in data:
+            start, _, _ = entry['range'].partition(":")
+            first_row, first_col = a1_to_rowcol(start)
+            for row_offset, row_values in enumerate(entry['values']):
+                for col_offset, value in enumerate(row_values):
+                    self._set(first_row + row_offset, first_col + col_offset, value)
+
+def fake_members(count, vip_ratio=0.1, seed=1):
+    """Sheet members sintetis: telegram_id 1000000+i, sebagian VIP aktif"""
+    rng = random.Random(seed)
+    now = datetime.now()
+    rows = [["telegram_id", "username", "status", "vip_expiry", "last_updated", "quota"]]
+    for i in range(count):
+        vip = rng.random() < vip_ratio
+        rows.append([
+            str(1000000 + i),
+            f"user{i}",
+            "vip" if vip else "non-vip",
+            (now + timedelta(days=rng.randint(-5, 30))).strftime("%Y-%m-%d") if vip else "",
+            (now - timedelta(days=rng.randint(0, 2))).strftime("%Y-%m-%d %H:%M:%S"),
+            str(rng.randint(0, 5))
+        ])
+    return rows
+
+def fake_films(count):
+    """Sheet film_links sintetis dengan kode F0..F{count-1}"""
+    rows = [["code", "title", "free_msg_id", "vip_msg_id", "is_part2_vip", "free_link", "vip_link"]]
+    for i in range(count):
+        rows.append([
+            f"F{i}", f"Film {i}", str(100 + i), str(200000 + i), "TRUE",
+            f"https://t.me/c/1/{100 + i}", f"https://t.me/c/1/{200000 + i}"
+        ])
+    return rows
+
+class FakeSheetsStorage(SheetsStorage):
+    """SheetsStorage asli, tapi worksheet-nya FakeWorksheet (tanpa Google API)"""
+
+    def __init__(self, members, films, latency=0.0, jitter=0.0, **kwargs):
+        spreadsheet = FakeSpreadsheet()
+        self.fake_members = FakeWorksheet("members", members, latency, jitter, spreadsheet)
+        self.fake_films = FakeWorksheet("film_links", films, latency, jitter, spreadsheet)
+        super().__init__(None, **kwargs)
+
+    def connect(self):
+        self.sheet_members = self.fake_members
+        self.sheet_films = self.fake_films
+
+    def sheet_calls(self):
+        """Total panggilan ke kedua worksheet"""
+        return sum(self.fake_members.calls.values()) + sum(self.fake_films.calls.values())
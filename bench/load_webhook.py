@@ -0,0 +1,230 @@
+"""Load test webhook: POST update sintetis ke /{BOT_TOKEN} dengan concurrency bertahap.
+
+Server bot dijalankan di proses terpisah dengan Bot API palsu dan Sheets palsu,
+lalu generator menaikkan jumlah klien paralel per tahap dan melaporkan
+throughput, latency ack webhook, error rate dan latency proses update
+(dari /metrics server).
+
+Contoh:
+    python -m bench.load_webhook run --stages 1 10 50 100 200 --duration 10
+    python -m bench.load_webhook serve --port 8600   # server saja
+    python -m bench.load_webhook run --url http://127.0.0.1:8600
+"""
+import os
+import re
+import sys
+import time
+import random
+import asyncio
+import logging
+import argparse
+import subprocess
+from collections import Counter
+
+os.environ.setdefault("BOT_TOKEN", "123456:BENCH")
+
+import httpx
+
+import main
+from bench.bench_handlers import percentile
+from bench.fake_sheets import FakeSheetsStorage, fake_members, fake_films
+from bench.stub_telegram import StubTelegramRequest, message_update, callback_update
+
+# (jenis update, bobot) - campuran kira-kira seperti traffic channel
+TRAFFIC = [
+    ("start_p1", 30),
+    ("start_p2", 15),
+    ("status", 15),
+    ("button_vip", 10),
+    ("button_status", 10),
+    ("button_free", 20),
+]
+
+HISTOGRAM_LINE = re.compile(r'^cdrama_update_latency_seconds_bucket\{le="([^"]+)"\} (\S+)$')
+
+# ===== SERVER =====
+async def serve(args):
+    """Jalankan app FastAPI asli di atas storage + Bot API palsu"""
+    import uvicorn
+
+    storage = FakeSheetsStorage(
+        fake_members(args.members), fake_films(args.films),
+        latency=args.sheets_latency / 1000, jitter=args.sheets_latency / 2000,
+        flush_interval=main.SHEETS_FLUSH_INTERVAL,
+        flush_max_cells=main.SHEETS_FLUSH_MAX_CELLS,
+        member_record_ttl=main.MEMBER_RECORD_TTL,
+        film_cache_ttl=main.FILM_CACHE_TTL,
+        reads_per_minute=main.SHEETS_READS_PER_MINUTE,
+        writes_per_minute=main.SHEETS_WRITES_PER_MINUTE,
+        user_max_wait=main.SHEETS_USER_MAX_WAIT,
+        background_max_wait=main.SHEETS_BACKGROUND_MAX_WAIT
+    )
+    await storage.start()
+    main.storage = storage
+
+    application = main.initialize_bot(StubTelegramRequest(latency=args.telegram_latency / 1000))
+    await application.initialize()
+    await application.start()
+    main.application = application
+
+    config = uvicorn.Config(main.app, host="127.0.0.1", port=args.port, log_level="warning")
+    await uvicorn.Server(config).serve()
+
+# ===== GENERATOR =====
+class Traffic:
+    """Pembuat update mentah dengan update_id unik"""
+
+    def __init__(self, members, films, new_user_ratio, seed):
+        self.members = members
+        self.films = films
+        self.new_user_ratio = new_user_ratio
+        self.rng = random.Random(seed)
+        self.next_id = int(time.time()) * 1000
+        self.kinds = [kind for kind, _ in TRAFFIC]
+        self.weights = [weight for _, weight in TRAFFIC]
+
+    def next(self):
+        self.next_id += 1
+        update_id = self.next_id
+        if self.rng.random() < self.new_user_ratio:
+            user_id = 5000000 + update_id % 10000000
+        else:
+            user_id = 1000000 + self.rng.randrange(self.members)
+        film_code = f"F{self.rng.randrange(self.films)}"
+        kind = self.rng.choices(self.kinds, self.weights)[0]
+
+        if kind == "start_p1":
+            return message_update(update_id, user_id, f"/start {main.encode_film_code(film_code, 'P1')}")
+        if kind == "start_p2":
+            return message_update(update_id, user_id, f"/start {main.encode_film_code(film_code, 'P2')}")
+        if kind == "status":
+            return message_update(update_id, user_id, "/status")
+        if kind == "button_vip":
+            return callback_update(update_id, user_id, "vip")
+        if kind == "button_status":
+            return callback_update(update_id, user_id, "status")
+        return callback_update(update_id, user_id, f"free_{film_code}")
+
+async def scrape_update_histogram(client):
+    """Bucket kumulatif cdrama_update_latency_seconds dari /metrics server"""
+    response = await client.get("/metrics")
+    buckets = {}
+    for line in response.text.splitlines():
+        match = HISTOGRAM_LINE.match(line)
+        if match:
+            buckets[float(match.group(1))] = float(match.group(2))
+    return buckets
+
+def histogram_quantile(before, after, q):
+    """Perkiraan kuantil (batas atas bucket) dari selisih dua snapshot histogram"""
+    bounds = sorted(after)
+    deltas = [after[b] - before.get(b, 0) for b in bounds]
+    total = deltas[-1] if deltas else 0
+    if not total:
+        return None, 0
+    for bound, count in zip(bounds, deltas):
+        if count >= q * total:
+            return bound, int(total)
+    return bounds[-1], int(total)
+
+async def run_stage(client, path, headers, traffic, concurrency, duration):
+    """Satu tahap: `concurrency` klien POST berurutan selama `duration` detik"""
+    latencies = []
+    outcomes = Counter()
+    deadline = time.perf_counter() + duration
+
+    async def worker():
+        while time.perf_counter() < deadline:
+            data = traffic.next()
+            started = time.perf_counter()
+            try:
+                response = await client.post(path, json=data, headers=headers)
+                outcomes[response.status_code] += 1
+            except httpx.HTTPError as e:
+                outcomes[type(e).__name__] += 1
+                continue
+            latencies.append(time.perf_counter() - started)
+
+    started = time.perf_counter()
+    await asyncio.gather(*[worker() for _ in range(concurrency)])
+    return latencies, outcomes, time.perf_counter() - started
+
+async def wait_until_ready(client, timeout=60):
+    deadline = time.perf_counter() + timeout
+    while time.perf_counter() < deadline:
+        try:
+            if (await client.get("/healthz")).status_code == 200:
+                return
+        except httpx.HTTPError:
+            pass
+        await asyncio.sleep(0.5)
+    raise RuntimeError("Server load test tidak siap")
+
+async def generate(args, url):
+    traffic = Traffic(args.members, args.films, args.new_user_ratio, args.seed)
+    path = f"/{main.BOT_TOKEN}"
+    headers = {"X-Telegram-Bot-Api-Secret-Token": main.WEBHOOK_SECRET}
+    limits = httpx.Limits(max_connections=max(args.stages), max_keepalive_connections=max(args.stages))
+
+    async with httpx.AsyncClient(base_url=url, limits=limits, timeout=args.timeout) as client:
+        await wait_until_ready(client)
+        print(f"{'klien':>6}{'req':>8}{'req/s':>9}{'p50 ms':>9}{'p95 ms':>9}{'p99 ms':>9}"
+              f"{'error%':>8}{'diproses':>10}{'proses p99':>12}")
+        for concurrency in args.stages:
+            before = await scrape_update_histogram(client)
+            latencies, outcomes, elapsed = await run_stage(
+                client, path, headers, traffic, concurrency, args.duration
+            )
+            # Beri waktu worker menguras antrian sebelum membaca histogram
+            await asyncio.sleep(args.drain)
+            after = await scrape_update_histogram(client)
+
+            total = sum(outcomes.values())
+            errors = total - outcomes.get(200, 0)
+            process_p99, processed = histogram_quantile(before, after, 0.99)
+            p = (lambda q: percentile(latencies, q) * 1000) if latencies else (lambda q: float("nan"))
+            print(f"{concurrency:>6}{total:>8}{total / elapsed:>9.1f}{p(0.50):>9.1f}{p(0.95):>9.1f}{p(0.99):>9.1f}"
+                  f"{100 * errors / max(total, 1):>8.2f}{processed:>10}"
+                  f"{'<= %gs' % process_p99 if process_p99 is not None else '-':>12}")
+            if errors:
+                print(f"       status: {dict(outcomes)}")
+
+async def run(args):
+    if args.url:
+        await generate(args, args.url)
+        return
+
+    # Tanpa --url: jalankan server di subprocess supaya generator tidak berebut event loop
+    command = [
+        sys.executable, "-m", "bench.load_webhook", "serve", "--port", str(args.port),
+        "--members", str(args.members), "--films", str(args.films),
+        "--sheets-latency", str(args.sheets_latency), "--telegram-latency", str(args.telegram_latency)
+    ]
+    server = subprocess.Popen(command, cwd=os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+    try:
+        await generate(args, f"http://127.0.0.1:{args.port}")
+    finally:
+        server.terminate()
+        server.wait(timeout=30)
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description="Load test webhook Telegram dengan traffic sintetis")
+    parser.add_argument("mode", choices=["run", "serve"], nargs="?", default="run")
+    parser.add_argument("--url", help="Server yang sudah berjalan (default: start server sendiri)")
+    parser.add_argument("--port", type=int, default=8600)
+    parser.add_argument("--members", type=int, default=10000)
+    parser.add_argument("--films", type=int, default=1000)
+    parser.add_argument("--sheets-latency", type=float, default=150, help="Latency Sheets palsu (ms)")
+    parser.add_argument("--telegram-latency", type=float, default=50, help="Latency Bot API palsu (ms)")
+    parser.add_argument("--stages", type=int, nargs="+", default=[1, 5, 10, 25, 50, 100, 200])
+    parser.add_argument("--duration", type=float, default=10, help="Detik per tahap")
+    parser.add_argument("--drain", type=float, default=2, help="Detik menunggu antrian habis antar tahap")
+    parser.add_argument("--new-user-ratio", type=float, default=0.05)
+    parser.add_argument("--timeout", type=float, default=30)
+    parser.add_argument("--seed", type=int, default=1)
+    return parser.parse_args(argv)
+
+if __name__ == '__main__':
+    logging.getLogger().setLevel(logging.WARNING)
+    args = parse_args()
+    asyncio.run(serve(args) if args.mode == "serve" else run(args))
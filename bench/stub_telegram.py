@@ -0,0 +1,68 @@
+"""Bot API palsu: BaseRequest yang menjawab semua method tanpa jaringan"""
+import json
+import asyncio
+from collections import Counter
+
+from telegram.request import BaseRequest
+
+class StubTelegramRequest(BaseRequest):
+    """Jawab request Bot API dengan respon sukses minimal, opsional dengan latency"""
+
+    def __init__(self, latency=0.0):
+        self.latency = latency
+        self.calls = Counter()
+
+    async def initialize(self):
+        pass
+
+    async def shutdown(self):
+        pass
+
+    async def do_request(self, url, method, request_data=None, read_timeout=None,
+                         write_timeout=None, connect_timeout=None, pool_timeout=None):
+        name = url.rsplit("/", 1)[-1]
+        params = request_data.parameters if request_data else {}
+        self.calls[name] += 1
+        if self.latency:
+            await asyncio.sleep(self.latency)
+
+        chat = {'id': int(params.get('chat_id', 1)), 'type': 'private'}
+        if name == "getMe":
+            result = {'id': 1, 'is_bot': True, 'first_name': 'bench', 'username': 'VIPDramaCinaBot'}
+        elif name in ("sendMessage", "editMessageText"):
+            result = {'message_id': 1, 'date': 0, 'chat': chat, 'text': params.get('text', '')}
+        elif name == "copyMessage":
+            result = {'message_id': 2}
+        else:
+            result = True
+        return 200, json.dumps({'ok': True, 'result': result}).encode()
+
+def message_update(update_id, user_id, text):
+    """Update mentah pesan teks private chat (command jika diawali '/')"""
+    entities = []
+    if text.startswith("/"):
+        entities = [{'type': 'bot_command', 'offset': 0, 'length': len(text.split()[0])}]
+    return {
+        'update_id': update_id,
+        'message': {
+            'message_id': update_id,
+            'date': 0,
+            'chat': {'id': user_id, 'type': 'private'},
+            'from': {'id': user_id, 'is_bot': False, 'first_name': 'Bench', 'username': f"u{user_id}"},
+            'text': text,
+            'entities': entities
+        }
+    }
+
+def callback_update(update_id, user_id, data):
+    """Update mentah klik tombol inline"""
+    return {
+        'update_id': update_id,
+        'callback_query': {
+            'id': str(update_id),
+            'chat_instance': 'bench',
+            'data': data,
+            'from': {'id': user_id, 'is_bot': False, 'first_name': 'Bench'},
+            'message': {'message_id': 1, 'date': 0, 'chat': {'id': user_id, 'type': 'private'}, 'text': '-'}
+        }
+    }
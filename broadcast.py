@@ -0,0 +1,346 @@
+import time
+import logging
+import asyncio
+import sqlite3
+from datetime import datetime, timedelta
+from functools import partial
+from concurrent.futures import ThreadPoolExecutor
+
+from telegram.error import RetryAfter, Forbidden, BadRequest, TimedOut, NetworkError
+
+from sheets_scheduler import TokenBucket
+
+logger = logging.getLogger(__name__)
+
+BROADCAST_SCHEMA = """
+CREATE TABLE IF NOT EXISTS broadcasts (
+    id INTEGER PRIMARY KEY AUTOINCREMENT,
+    audience TEXT NOT NULL,
+    text TEXT NOT NULL,
+    status TEXT NOT NULL DEFAULT 'preparing',
+    admin_chat_id INTEGER,
+    created_at TEXT NOT NULL,
+    finished_at TEXT
+);
+CREATE TABLE IF NOT EXISTS broadcast_recipients (
+    broadcast_id INTEGER NOT NULL,
+    chat_id INTEGER NOT NULL,
+    status TEXT NOT NULL DEFAULT 'pending',
+    error TEXT,
+    PRIMARY KEY (broadcast_id, chat_id)
+);
+CREATE INDEX IF NOT EXISTS idx_recipients_status ON broadcast_recipients (broadcast_id, status);
+CREATE TABLE IF NOT EXISTS blocked_chats (
+    chat_id INTEGER PRIMARY KEY,
+    blocked_at TEXT NOT NULL
+);
+"""
+
+# Filter penerima per audience
+AUDIENCES = {
+    "all": lambda record, now: True,
+    "vip": lambda record, now: record.is_vip(),
+    "nonvip": lambda record, now: not record.is_vip(),
+    # VIP yang masa aktifnya habis besok
+    "expiring": lambda record, now: (
+        record.status == "vip" and record.expiry_date is not None
+        and record.expiry_date.date() == (now + timedelta(days=1)).date()
+    ),
+}
+
+class BroadcastStore:
+    """Status broadcast + daftar penerima di SQLite, supaya bisa dilanjutkan setelah restart"""
+
+    def __init__(self, path):
+        self.path = path
+        # Satu thread agar semua akses ke koneksi SQLite berurutan
+        self.executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix="broadcast")
+        self.conn = sqlite3.connect(path, check_same_thread=False, isolation_level=None)
+        self.conn.execute("PRAGMA journal_mode=WAL")
+        self.conn.executescript(BROADCAST_SCHEMA)
+
+    async def run(self, func, *args):
+        """Jalankan operasi SQLite di thread khusus"""
+        loop = asyncio.get_running_loop()
+        return await loop.run_in_executor(self.executor, partial(func, *args))
+
+    def _execute(self, sql, params=()):
+        cursor = self.conn.execute(sql, params)
+        return cursor.lastrowid, cursor.fetchall()
+
+    def _executemany(self, sql, seq):
+        with self.conn:
+            self.conn.execute("BEGIN")
+            self.conn.executemany(sql, seq)
+
+    async def create(self, audience, text, admin_chat_id=None):
+        broadcast_id, _ = await self.run(
+            self._execute,
+            "INSERT INTO broadcasts (audience, text, admin_chat_id, created_at) VALUES (?, ?, ?, ?)",
+            (audience, text, admin_chat_id, datetime.now().strftime("%Y-%m-%d %H:%M:%S"))
+        )
+        return broadcast_id
+
+    async def add_recipients(self, broadcast_id, chat_ids):
+        """Tambah penerima (chat yang pernah memblokir bot dilewati)"""
+        await self.run(
+            self._executemany,
+            "INSERT OR IGNORE INTO broadcast_recipients (broadcast_id, chat_id) "
+            "SELECT ?, ? WHERE NOT EXISTS (SELECT 1 FROM blocked_chats WHERE chat_id = ?)",
+            [(broadcast_id, chat_id, chat_id) for chat_id in chat_ids]
+        )
+
+    async def set_status(self, broadcast_id, status):
+        finished_at = datetime.now().strftime("%Y-%m-%d %H:%M:%S") if status in ("done", "cancelled") else None
+        await self.run(
+            self._execute,
+            "UPDATE broadcasts SET status = ?, finished_at = ? WHERE id = ?",
+            (status, finished_at, broadcast_id)
+        )
+
+    async def get(self, broadcast_id):
+        _, rows = await self.run(
+            self._execute,
+            "SELECT id, audience, text, status, admin_chat_id FROM broadcasts WHERE id = ?",
+            (broadcast_id,)
+        )
+        if not rows:
+            return None
+        return dict(zip(("id", "audience", "text", "status", "admin_chat_id"), rows[0]))
+
+    async def unfinished(self):
+        """Broadcast yang terputus (misal karena restart)"""
+        _, rows = await self.run(
+            self._execute, "SELECT id FROM broadcasts WHERE status IN ('preparing', 'running') ORDER BY id"
+        )
+        return [row[0] for row in rows]
+
+    async def pending_recipients(self, broadcast_id, limit):
+        _, rows = await self.run(
+            self._execute,
+            "SELECT chat_id FROM broadcast_recipients WHERE broadcast_id = ? AND status = 'pending' LIMIT ?",
+            (broadcast_id, limit)
+        )
+        return [row[0] for row in rows]
+
+    async def mark_results(self, broadcast_id, results):
+        """Simpan hasil kirim: list (chat_id, status, error)"""
+        await self.run(
+            self._executemany,
+            "UPDATE broadcast_recipients SET status = ?, error = ? WHERE broadcast_id = ? AND chat_id = ?",
+            [(status, error, broadcast_id, chat_id) for chat_id, status, error in results]
+        )
+        blocked = [(chat_id, datetime.now().strftime("%Y-%m-%d %H:%M:%S"))
+                   for chat_id, status, _ in results if status == "blocked"]
+        if blocked:
+            await self.run(
+                self._executemany, "INSERT OR IGNORE INTO blocked_chats (chat_id, blocked_at) VALUES (?, ?)", blocked
+            )
+
+    async def block(self, chat_id):
+        """User memblokir bot, lewati di broadcast berikutnya"""
+        await self.run(
+            self._execute, "INSERT OR IGNORE INTO blocked_chats (chat_id, blocked_at) VALUES (?, ?)",
+            (chat_id, datetime.now().strftime("%Y-%m-%d %H:%M:%S"))
+        )
+
+    async def unblock(self, chat_id):
+        """User kembali memakai bot, boleh menerima broadcast lagi"""
+        await self.run(self._execute, "DELETE FROM blocked_chats WHERE chat_id = ?", (chat_id,))
+
+    async def progress(self, broadcast_id):
+        """Jumlah penerima per status"""
+        _, rows = await self.run(
+            self._execute,
+            "SELECT status, COUNT(*) FROM broadcast_recipients WHERE broadcast_id = ? GROUP BY status",
+            (broadcast_id,)
+        )
+        counts = {"pending": 0, "sent": 0, "failed": 0, "blocked": 0}
+        counts.update(dict(rows))
+        return counts
+
+class BroadcastEngine:
+    """Kirim broadcast di background dengan batas global + per chat.
+
+    Penerima di-stream dari member store ke SQLite lebih dulu, lalu dikirim
+    per batch. Status tiap penerima disimpan, jadi broadcast yang terputus
+    dilanjutkan dari penerima yang belum terkirim.
+    """
+
+    def __init__(self, store, get_storage, rate_per_second=25, per_chat_interval=1.0,
+                 workers=4, batch_size=100, max_attempts=3, progress_interval=15, run_lock=None):
+        self.store = store
+        self.get_storage = get_storage  # coroutine() -> Storage
+        # Opsional: run_lock(key) -> async context manager yang yield False jika
+        # broadcast sedang dijalankan proses lain (misal SharedState.lock tanpa menunggu)
+        self.run_lock = run_lock
+        self.bucket = TokenBucket(rate_per_second * 60, burst=rate_per_second)
+        self.per_chat_interval = per_chat_interval
+        self.workers = workers
+        self.batch_size = batch_size
+        self.max_attempts = max_attempts
+        self.progress_interval = progress_interval
+        self.last_sent = {}  # chat_id -> waktu kirim terakhir (monotonic)
+        self.tasks = {}  # broadcast_id -> asyncio.Task
+
+    async def start(self, bot, audience, text, admin_chat_id=None, chat_ids=None):
+        """Buat broadcast baru lalu jalankan di background, return id-nya
+
+        chat_ids: daftar penerima yang sudah diketahui (misal dari VipIndex),
+        jadi member store tidak perlu di-scan.
+        """
+        if audience not in AUDIENCES:
+            raise ValueError(f"Audience tidak dikenal: {audience}")
+        broadcast_id = await self.store.create(audience, text, admin_chat_id)
+        if chat_ids is not None:
+            await self.store.add_recipients(broadcast_id, chat_ids)
+            await self.store.set_status(broadcast_id, "running")
+        self._spawn(bot, broadcast_id)
+        return broadcast_id
+
+    async def resume_all(self, bot):
+        """Lanjutkan broadcast yang terputus karena restart"""
+        for broadcast_id in await self.store.unfinished():
+            if broadcast_id not in self.tasks:
+                logger.info(f"Melanjutkan broadcast #{broadcast_id}")
+                self._spawn(bot, broadcast_id)
+
+    async def cancel(self, broadcast_id):
+        task = self.tasks.get(broadcast_id)
+        if task is not None:
+            task.cancel()
+        await self.store.set_status(broadcast_id, "cancelled")
+
+    async def stop(self):
+        """Hentikan task saat shutdown tanpa mengubah status, supaya dilanjutkan setelah restart"""
+        tasks = list(self.tasks.values())
+        for task in tasks:
+            task.cancel()
+        await asyncio.gather(*tasks, return_exceptions=True)
+
+    def _spawn(self, bot, broadcast_id):
+        task = asyncio.get_running_loop().create_task(self._run(bot, broadcast_id))
+        self.tasks[broadcast_id] = task
+        task.add_done_callback(lambda _: self.tasks.pop(broadcast_id, None))
+
+    async def _collect_recipients(self, broadcast):
+        """Stream member dari storage ke daftar penerima"""
+        storage = await self.get_storage()
+        matches = AUDIENCES[broadcast["audience"]]
+        now = datetime.now()
+        total = 0
+        async for records in storage.iter_members(self.batch_size * 10):
+            chat_ids = [int(record.telegram_id) for record in records
+                        if record.telegram_id.isdigit() and matches(record, now)]
+            await self.store.add_recipients(broadcast["id"], chat_ids)
+            total += len(chat_ids)
+        await self.store.set_status(broadcast["id"], "running")
+        logger.info(f"Broadcast #{broadcast['id']}: {total} penerima ({broadcast['audience']})")
+
+    async def _run(self, bot, broadcast_id):
+        if self.run_lock is None:
+            await self._run_broadcast(bot, broadcast_id)
+            return
+        async with self.run_lock(f"broadcast:{broadcast_id}") as acquired:
+            if not acquired:
+                logger.info(f"Broadcast #{broadcast_id} sedang dijalankan proses lain")
+                return
+            await self._run_broadcast(bot, broadcast_id)
+
+    async def _run_broadcast(self, bot, broadcast_id):
+        broadcast = await self.store.get(broadcast_id)
+        if broadcast is None or broadcast["status"] in ("done", "cancelled"):
+            return  # Sudah diselesaikan proses lain
+        try:
+            if broadcast["status"] == "preparing":
+                # Penerima dikumpulkan ulang dari awal; INSERT OR IGNORE menjaga status lama
+                await self._collect_recipients(broadcast)
+
+            last_report = time.monotonic()
+            while True:
+                batch = await self.store.pending_recipients(broadcast_id, self.batch_size)
+                if not batch:
+                    break
+                results = await self._send_batch(bot, batch, broadcast["text"])
+                await self.store.mark_results(broadcast_id, results)
+                if time.monotonic() - last_report >= self.progress_interval:
+                    await self._report(bot, broadcast)
+                    last_report = time.monotonic()
+
+            await self.store.set_status(broadcast_id, "done")
+            await self._report(bot, broadcast, finished=True)
+        except asyncio.CancelledError:
+            logger.info(f"Broadcast #{broadcast_id} dihentikan")
+            raise
+        except Exception as e:
+            # Status tetap running, jadi dilanjutkan saat resume berikutnya
+            logger.error(f"Broadcast #{broadcast_id} terhenti: {e}")
+
+    async def _send_batch(self, bot, chat_ids, text):
+        """Kirim satu batch dengan beberapa worker yang berbagi rate limit global"""
+        queue = list(chat_ids)
+        results = []
+
+        async def worker():
+            while queue:
+                chat_id = queue.pop()
+                results.append(await self._send(bot, chat_id, text))
+
+        await asyncio.gather(*[worker() for _ in range(min(self.workers, len(chat_ids)))])
+
+        # Buang jejak chat yang jedanya sudah lewat agar dict tidak tumbuh sepanjang broadcast
+        cutoff = time.monotonic() - self.per_chat_interval
+        self.last_sent = {chat_id: sent for chat_id, sent in self.last_sent.items() if sent > cutoff}
+        return results
+
+    async def _wait_turn(self, chat_id):
+        """Tunggu token global dan jeda minimum per chat"""
+        while True:
+            delay = self.bucket.delay()
+            last = self.last_sent.get(chat_id)
+            if last is not None:
+                delay = max(delay, last + self.per_chat_interval - time.monotonic())
+            if delay <= 0:
+                self.bucket.take()
+                self.last_sent[chat_id] = time.monotonic()
+                return
+            await asyncio.sleep(delay)
+
+    async def _send(self, bot, chat_id, text):
+        """Kirim ke satu chat, return (chat_id, status, error)"""
+        for attempt in range(self.max_attempts):
+            await self._wait_turn(chat_id)
+            try:
+                await bot.send_message(chat_id=chat_id, text=text)
+                return chat_id, "sent", None
+            except RetryAfter as e:
+                # Batas Telegram terlampaui: tahan semua pengiriman, lalu coba lagi
+                logger.warning(f"Broadcast kena RetryAfter {e.retry_after} detik")
+                self.bucket.pause(e.retry_after)
+            except Forbidden as e:
+                return chat_id, "blocked", str(e)
+            except BadRequest as e:
+                return chat_id, "failed", str(e)
+            except (TimedOut, NetworkError) as e:
+                if attempt == self.max_attempts - 1:
+                    return chat_id, "failed", str(e)
+                await asyncio.sleep(2 ** attempt)
+        return chat_id, "failed", "retry limit"
+
+    async def _report(self, bot, broadcast, finished=False):
+        """Kirim progress ke admin yang memulai broadcast"""
+        counts = await self.store.progress(broadcast["id"])
+        total = sum(counts.values())
+        done = total - counts["pending"]
+        logger.info(f"Broadcast #{broadcast['id']}: {done}/{total} {counts}")
+        if not broadcast.get("admin_chat_id"):
+            return
+        try:
+            await bot.send_message(
+                chat_id=broadcast["admin_chat_id"],
+                text=f"{'✅ Selesai' if finished else '📤 Progress'} broadcast #{broadcast['id']}: "
+                     f"{done}/{total}\n"
+                     f"Terkirim: {counts['sent']}, diblokir: {counts['blocked']}, gagal: {counts['failed']}"
+            )
+        except Exception as e:
+            logger.warning(f"Gagal kirim progress broadcast: {e}")
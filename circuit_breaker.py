@@ -0,0 +1,84 @@
+import time
+import asyncio
+import logging
+
+import metrics
+
+logger = logging.getLogger(__name__)
+
+class CircuitOpen(Exception):
+    """Backend dianggap down; request ditolak tanpa dicoba"""
+
+class CircuitBreaker:
+    """Circuit breaker sederhana dengan probe pemulihan di background.
+
+    Setelah failure_threshold kegagalan berturut-turut circuit terbuka:
+    semua request langsung gagal dengan CircuitOpen. Selama terbuka, satu
+    task memanggil probe() tiap reset_timeout detik dan menutup circuit
+    begitu probe berhasil, jadi traffic user tidak pernah dipakai sebagai probe.
+    """
+
+    def __init__(self, name, probe, failure_threshold=5, reset_timeout=30):
+        self.name = name
+        self.probe = probe  # coroutine() ringan yang raise jika backend belum pulih
+        self.failure_threshold = failure_threshold
+        self.reset_timeout = reset_timeout
+        self.failures = 0
+        self.opened_at = None
+        self._probe_task = None
+
+    @property
+    def is_open(self):
+        return self.opened_at is not None
+
+    def check(self):
+        """Raise CircuitOpen jika circuit sedang terbuka"""
+        if self.is_open:
+            raise CircuitOpen(f"{self.name} tidak tersedia (circuit terbuka {time.monotonic() - self.opened_at:.0f} detik)")
+
+    def record_success(self):
+        self.failures = 0
+
+    def record_failure(self):
+        self.failures += 1
+        if not self.is_open and self.failures >= self.failure_threshold:
+            self._trip()
+
+    def _trip(self):
+        self.opened_at = time.monotonic()
+        metrics.CIRCUIT_OPEN.set(1, circuit=self.name)
+        logger.error(f"🔌 Circuit {self.name} terbuka setelah {self.failures} kegagalan berturut-turut")
+        if self._probe_task is None or self._probe_task.done():
+            self._probe_task = asyncio.get_running_loop().create_task(self._probe_loop())
+
+    def close(self):
+        if self.is_open:
+            logger.info(f"✅ Circuit {self.name} tertutup kembali")
+        self.opened_at = None
+        self.failures = 0
+        metrics.CIRCUIT_OPEN.set(0, circuit=self.name)
+
+    async def _probe_loop(self):
+        while self.is_open:
+            await asyncio.sleep(self.reset_timeout)
+            try:
+                await self.probe()
+            except Exception as e:
+                logger.warning(f"Probe {self.name} masih gagal: {e}")
+                continue
+            self.close()
+
+    async def stop(self):
+        if self._probe_task is not None:
+            self._probe_task.cancel()
+            try:
+                await self._probe_task
+            except asyncio.CancelledError:
+                pass
+            self._probe_task = None
+
+    def state(self):
+        """Ringkasan untuk /healthz"""
+        if not self.is_open:
+            return {"state": "closed", "failures": self.failures}
+        return {"state": "open", "open_seconds": round(time.monotonic() - self.opened_at)}
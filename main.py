@@ -1,22 +1,22 @@
+import time
+_import_started = time.perf_counter()
+
 import os
 import json
-import gspread
 import logging
-import time
 import base64
 import sys
 import requests
-from fastapi import FastAPI, Request, HTTPException
-from fastapi.responses import JSONResponse
+from fastapi import FastAPI, Request, HTTPException, BackgroundTasks
+from fastapi.responses import JSONResponse, PlainTextResponse
 from fastapi import status as fastapi_status
 
 print("Python version:", sys.version)
 
 import asyncio
-from threading import Thread
-from flask import Flask, request, jsonify
-from werkzeug import __version__ as werkzeug_version
-from datetime import datetime, timedelta
+from contextlib import asynccontextmanager, AsyncExitStack
+from functools import partial
+from datetime import datetime, timedelta, time as dtime
 from telegram import Update, InlineKeyboardButton, InlineKeyboardMarkup
 from telegram.ext import (
     Application,
@@ -26,12 +26,20 @@ from telegram.ext import (
     filters,
     CallbackQueryHandler,
     CallbackContext,
+    ChatMemberHandler,
     JobQueue
 )
-from oauth2client.service_account import ServiceAccountCredentials
 
-from requests.adapters import HTTPAdapter
-from urllib3.util.retry import Retry
+from storage import SheetsStorage, SQLiteStorage, KeyedLocks, VipStatusCache
+from sheets_scheduler import sheets_priority, PRIORITY_PAYMENT, PRIORITY_BACKGROUND
+from broadcast import BroadcastStore, BroadcastEngine, AUDIENCES
+from payments import (
+    PaymentLedger, TRAKTEER_PACKAGE_MAPPING, extract_payment, payment_txn_id, apply_payment, reconcile_payments
+)
+from update_queue import UpdateDispatcher
+from shared_state import SharedState
+import metrics
+from metrics import track_handler
 
 # Setup logging
 logging.basicConfig(
@@ -58,33 +66,56 @@ start_time = datetime.now()
 BOT_TOKEN = os.getenv('BOT_TOKEN')
 BOT_USERNAME = "VIPDramaCinaBot"  # Pastikan sama dengan username bot
 CHANNEL_PRIVATE = "-1002683110383"  # Gunakan ID channel numerik
+ADMIN_ID = os.getenv('ADMIN_ID', "YOUR_ADMIN_ID")  # Ganti dengan ID Telegram admin
+FILM_CACHE_TTL = int(os.getenv('FILM_CACHE_TTL', 600))  # Detik sebelum katalog film dimuat ulang
 PORT = int(os.getenv('PORT', 8443))
 WEBHOOK_URL = os.getenv('WEBHOOK_URL', "https://cdrama-bot.onrender.com")
+WEBHOOK_SECRET = os.getenv('WEBHOOK_SECRET', 'WEBHOOK_SECRET_TOKEN')  # secret_token yang dikirim Telegram
 TRAKTEER_WEBHOOK_SECRET = os.getenv('TRAKTEER_WEBHOOK_SECRET', "trhook-9WUnIQtx4Sz0lsmKtpb6CP0v")
-TRAKTEER_PACKAGE_MAPPING = {
-    "vip1hari": {"days": 1, "price": 1000},
-    "vip3hari": {"days": 3, "price": 2000},
-    "vip7hari": {"days": 7, "price": 5000},
-    "vip30hari": {"days": 30, "price": 25000},
-    "vip5bulan": {"days": 180, "price": 145000}
-}
-
-# Inisialisasi Google Sheets
-try:
-    scope = ["https://spreadsheets.google.com/feeds", "https://www.googleapis.com/auth/drive"]
-    creds = ServiceAccountCredentials.from_json_keyfile_dict(
-        json.loads(os.getenv('GOOGLE_SERVICE_ACCOUNT')), 
-        scope
-    )
-    client = gspread.authorize(creds)
-    spreadsheet = client.open("cdrama_database")
-    sheet_members = spreadsheet.worksheet("members")
-    sheet_films = spreadsheet.worksheet("film_links")
-    logger.info("✅ Berhasil terhubung ke Google Sheets")
-except Exception as e:
-    logger.error(f"❌ Gagal menginisialisasi Google Sheets: {e}")
-    raise
-
+SHEETS_MAX_WORKERS = int(os.getenv('SHEETS_MAX_WORKERS', 8))  # Thread pool untuk panggilan gspread
+SHEETS_RETRY_BACKOFF = float(os.getenv('SHEETS_RETRY_BACKOFF', 2))  # Detik, dikali 2 tiap percobaan
+SHEETS_FLUSH_INTERVAL = float(os.getenv('SHEETS_FLUSH_INTERVAL', 5))  # Detik antar flush write-behind
+SHEETS_READS_PER_MINUTE = int(os.getenv('SHEETS_READS_PER_MINUTE', 60))  # Kuota baca Sheets per menit
+SHEETS_WRITES_PER_MINUTE = int(os.getenv('SHEETS_WRITES_PER_MINUTE', 60))  # Kuota tulis Sheets per menit
+SHEETS_USER_MAX_WAIT = float(os.getenv('SHEETS_USER_MAX_WAIT', 10))  # Detik maks request user menunggu kuota
+SHEETS_BACKGROUND_MAX_WAIT = float(os.getenv('SHEETS_BACKGROUND_MAX_WAIT', 30))  # Detik maks job background menunggu kuota
+SHEETS_CIRCUIT_FAILURES = int(os.getenv('SHEETS_CIRCUIT_FAILURES', 5))  # Kegagalan berturut-turut sebelum circuit terbuka
+SHEETS_CIRCUIT_RESET = float(os.getenv('SHEETS_CIRCUIT_RESET', 30))  # Detik antar probe pemulihan
+SHEETS_FLUSH_MAX_CELLS = int(os.getenv('SHEETS_FLUSH_MAX_CELLS', 200))  # Flush lebih awal jika antrian sebesar ini
+MEMBER_RECORD_TTL = int(os.getenv('MEMBER_RECORD_TTL', 300))  # Detik sebelum satu baris member dibaca ulang, 0 = tidak pernah
+SHEET_SYNC_INTERVAL = int(os.getenv('SHEET_SYNC_INTERVAL', 60))  # Detik antar sinkronisasi inkremental dari sheet, 0 = mati
+SHEET_SYNC_BLOCK_SIZE = int(os.getenv('SHEET_SYNC_BLOCK_SIZE', 500))  # Baris per blok fingerprint
+SHEET_SYNC_VERIFY_BLOCKS = int(os.getenv('SHEET_SYNC_VERIFY_BLOCKS', 2))  # Blok lama yang dicek ulang per sinkronisasi
+WEBHOOK_MAX_CONNECTIONS = int(os.getenv('WEBHOOK_MAX_CONNECTIONS', 40))  # Koneksi paralel dari Telegram
+CONCURRENT_UPDATES = int(os.getenv('CONCURRENT_UPDATES', WEBHOOK_MAX_CONNECTIONS))  # Worker UpdateDispatcher (update paralel antar chat), 0 = satu per satu
+UPDATE_QUEUE_SIZE = int(os.getenv('UPDATE_QUEUE_SIZE', 1000))  # Update menunggu maksimal sebelum webhook membalas 503
+UPDATE_ENQUEUE_TIMEOUT = float(os.getenv('UPDATE_ENQUEUE_TIMEOUT', 5))  # Detik menunggu slot antrian
+UPDATE_DEDUPE_SIZE = int(os.getenv('UPDATE_DEDUPE_SIZE', 10000))  # Jumlah update_id terakhir yang diingat
+PAYMENTS_DB = os.getenv('PAYMENTS_DB', "payments.db")  # Ledger pembayaran Trakteer (dedupe + retry)
+PAYMENT_MAX_ATTEMPTS = int(os.getenv('PAYMENT_MAX_ATTEMPTS', 10))
+PAYMENT_RETRY_INTERVAL = int(os.getenv('PAYMENT_RETRY_INTERVAL', 60))  # Detik antar retry pembayaran pending
+RECONCILE_BATCH_SIZE = int(os.getenv('RECONCILE_BATCH_SIZE', 500))  # Maks pembayaran per rekonsiliasi
+QUOTA_RESET_JOB = os.getenv('QUOTA_RESET_JOB', "0") == "1"  # Reset kuota massal di sheet tiap tengah malam
+BROADCAST_DB = os.getenv('BROADCAST_DB', "broadcasts.db")  # Status broadcast + penerima (untuk resume)
+BROADCAST_RATE = float(os.getenv('BROADCAST_RATE', 25))  # Pesan per detik, di bawah batas global Telegram (30)
+BROADCAST_PER_CHAT_INTERVAL = float(os.getenv('BROADCAST_PER_CHAT_INTERVAL', 1))  # Detik minimum antar pesan ke chat yang sama
+BROADCAST_WORKERS = int(os.getenv('BROADCAST_WORKERS', 4))  # Pengiriman paralel per broadcast
+VIP_NEGATIVE_TTL = int(os.getenv('VIP_NEGATIVE_TTL', 60))  # Detik jawaban "bukan VIP" di-cache sebelum dicek ulang
+VIP_SWEEP_INTERVAL = int(os.getenv('VIP_SWEEP_INTERVAL', 600))  # Detik antar penurunan VIP yang sudah habis
+VIP_REMINDER_JOB = os.getenv('VIP_REMINDER_JOB', "0") == "1"  # Pengingat harian ke VIP yang habis besok
+VIP_REMINDER_HOUR = int(os.getenv('VIP_REMINDER_HOUR', 10))  # Jam kirim pengingat (waktu lokal server)
+VIP_REMINDER_TEXT = os.getenv(
+    'VIP_REMINDER_TEXT',
+    "⏰ Masa aktif VIP kamu berakhir besok.\nKetik /vip untuk memperpanjang dan tetap menonton tanpa batas!"
+)
+SHARED_STATE_DB = os.getenv('SHARED_STATE_DB', "")  # File SQLite bersama antar worker/instance, kosong = satu proses
+WEB_WORKERS = int(os.getenv('WEB_WORKERS', 1))  # Proses uvicorn untuk python main.py, >1 butuh SHARED_STATE_DB
+SHARED_STATE_POLL = float(os.getenv('SHARED_STATE_POLL', 2))  # Detik antar cek invalidasi member dari worker lain
+STORAGE_BACKEND = os.getenv('STORAGE_BACKEND', "sheets")  # "sheets" atau "sqlite"
+SQLITE_PATH = os.getenv('SQLITE_PATH', "cdrama.db")
+SQLITE_SHEETS_EXPORT = os.getenv('SQLITE_SHEETS_EXPORT', "0") == "1"  # Ekspor member ke sheet untuk tim ops
+SQLITE_EXPORT_INTERVAL = int(os.getenv('SQLITE_EXPORT_INTERVAL', 300))  # Detik antar ekspor ke sheet
+FILMS_CSV = os.getenv('FILMS_CSV', "")  # Katalog film CSV (header seperti sheet film_links) untuk SQLite tanpa Sheets
 # Daftar paket VIP
 VIP_PACKAGES = [
     {"label": "⚡ 1 Hari - Rp1.000", "days": 1, "price": 1000, "url": "https://trakteer.id/vipdramacina/tip?quantity=1&step=2&display_name=Nama+Kamu&supporter_message=Saya+beli+VIP+1+hari"},
@@ -94,157 +125,227 @@ VIP_PACKAGES = [
     {"label": "👑 5 Bulan (FREE 1 BULAN) - Rp145.000", "days": 180, "price": 145000, "url": "https://trakteer.id/vipdramacina/tip?quantity=145&step=2&display_name=Nama+Kamu&supporter_message=Saya+beli+VIP+6+bulan"}
 ]
 
+# ===== STATE BERSAMA =====
+# Tanpa SHARED_STATE_DB semua lock/dedupe cukup di memori proses ini. Dengan
+# SHARED_STATE_DB, semua worker uvicorn (dan instance lain yang memakai file
+# yang sama) berbagi kuota harian, dedupe update, lock per user/job dan
+# invalidasi cache member.
+shared_state = None
+local_locks = KeyedLocks()
+
+def get_shared_state():
+    """SharedState jika SHARED_STATE_DB diisi, None jika bot berjalan sebagai satu proses"""
+    global shared_state
+    if shared_state is None and SHARED_STATE_DB:
+        shared_state = SharedState(SHARED_STATE_DB)
+    return shared_state
+
+@asynccontextmanager
+async def shared_lock(key):
+    """Lock per key (misal per user), lintas worker jika state bersama aktif"""
+    shared = get_shared_state()
+    if shared is None:
+        async with local_locks.hold(key):
+            yield
+    else:
+        async with shared.lock(key):
+            yield
+
+@asynccontextmanager
+async def member_locks(user_ids):
+    """Lock member:{id} untuk banyak user sekaligus (urut id supaya tidak deadlock)"""
+    async with AsyncExitStack() as stack:
+        for user_id in sorted(dict.fromkeys(str(user_id) for user_id in user_ids)):
+            await stack.enter_async_context(shared_lock(f"member:{user_id}"))
+        yield
+
+async def claim_job(name, slot):
+    """True jika proses ini yang menjalankan job `name` untuk slot (misal tanggal) ini"""
+    shared = get_shared_state()
+    return shared is None or await shared.claim(f"job:{name}:{slot}")
+
+async def claim_update(update_id):
+    return await get_shared_state().claim(f"update:{update_id}")
+
+async def invalidate_member(user_id):
+    """Status VIP user berubah: buang cache lokal lalu beri tahu worker lain"""
+    vip_status_cache.invalidate(user_id)
+    shared = get_shared_state()
+    if shared is not None:
+        await shared.publish_invalidation(user_id)
+
+async def sync_shared_state(context: CallbackContext):
+    """Job berkala: terapkan invalidasi member dari worker lain"""
+    try:
+        user_ids = await get_shared_state().fetch_invalidations()
+        if not user_ids:
+            return
+        storage = await get_storage()
+        for user_id in user_ids:
+            vip_status_cache.invalidate(user_id)
+            await storage.refresh_member(user_id)
+    except Exception as e:
+        logger.error(f"Gagal sinkron state bersama: {e}")
+
+async def prune_shared_state(context: CallbackContext):
+    try:
+        await get_shared_state().prune(datetime.now().date().isoformat())
+    except Exception as e:
+        logger.error(f"Gagal membersihkan state bersama: {e}")
+
+# ===== STORAGE =====
+def create_storage():
+    """Bangun backend storage sesuai STORAGE_BACKEND"""
+    def sheets_storage():
+        return SheetsStorage(
+            json.loads(os.getenv('GOOGLE_SERVICE_ACCOUNT')),
+            max_workers=SHEETS_MAX_WORKERS,
+            retry_backoff=SHEETS_RETRY_BACKOFF,
+            flush_interval=SHEETS_FLUSH_INTERVAL,
+            flush_max_cells=SHEETS_FLUSH_MAX_CELLS,
+            member_record_ttl=MEMBER_RECORD_TTL,
+            film_cache_ttl=FILM_CACHE_TTL,
+            reads_per_minute=SHEETS_READS_PER_MINUTE,
+            writes_per_minute=SHEETS_WRITES_PER_MINUTE,
+            user_max_wait=SHEETS_USER_MAX_WAIT,
+            background_max_wait=SHEETS_BACKGROUND_MAX_WAIT,
+            circuit_failure_threshold=SHEETS_CIRCUIT_FAILURES,
+            circuit_reset_timeout=SHEETS_CIRCUIT_RESET,
+            shared_state=get_shared_state(),
+            sync_block_size=SHEET_SYNC_BLOCK_SIZE,
+            sync_verify_blocks=SHEET_SYNC_VERIFY_BLOCKS
+        )
+
+    try:
+        if STORAGE_BACKEND == "sqlite":
+            return SQLiteStorage(
+                SQLITE_PATH,
+                sheets=sheets_storage() if SQLITE_SHEETS_EXPORT else None,
+                export_interval=SQLITE_EXPORT_INTERVAL,
+                films_csv=FILMS_CSV or None
+            )
+        return sheets_storage()
+    except Exception as e:
+        logger.error(f"❌ Gagal menginisialisasi storage {STORAGE_BACKEND}: {e}")
+        raise
+
+# Storage (dan otorisasi Sheets) baru dibuat saat startup/pemakaian pertama,
+# bukan saat import, supaya cold start bisa langsung menerima request.
+storage = None
+storage_lock = asyncio.Lock()
+
+async def get_storage():
+    """Mendapatkan storage, dibuat dan di-start saat pertama kali dipakai"""
+    global storage
+    if storage is None:
+        async with storage_lock:
+            if storage is None:
+                started = time.perf_counter()
+                instance = await asyncio.to_thread(create_storage)
+                await instance.start()
+                storage = instance
+                record_startup("storage_ready", started)
+    return storage
+
 # ===== FUNGSI BANTUAN =====
-def refresh_connection():
-    """Refresh koneksi Google Sheets dengan timeout"""
+async def get_member_record(user_id):
+    """Mendapatkan MemberRecord user, None jika belum terdaftar"""
+    storage = await get_storage()
+    return await storage.get_member(user_id)
+
+async def add_new_user(user):
+    """Menambahkan user baru ke storage"""
+    storage = await get_storage()
+    await storage.add_member(user.id, user.username or "")
+    return True
+
+async def consume_quota(user_id):
+    """Pakai satu kuota secara atomik, kembalikan sisa kuota atau None jika habis"""
+    storage = await get_storage()
+    return await storage.consume_quota(user_id, datetime.now())
+
+async def reset_daily_quotas(context: CallbackContext):
+    """Job tengah malam: reset kuota semua member basi dalam satu penulisan"""
     try:
-        global client, sheet_members, sheet_films
-        client = gspread.authorize(creds)
-        spreadsheet = client.open("cdrama_database")
-        sheet_members = spreadsheet.worksheet("members")
-        sheet_films = spreadsheet.worksheet("film_links")
-        logger.info("Koneksi Google Sheets diperbarui")
-        return True
+        now = datetime.now()
+        if not await claim_job("reset_daily_quotas", now.date().isoformat()):
+            return
+        storage = await get_storage()
+        with sheets_priority(PRIORITY_BACKGROUND):
+            count = await storage.reset_daily_quotas(now)
+        logger.info(f"Reset kuota harian: {count} member")
     except Exception as e:
-        logger.error(f"Gagal refresh koneksi: {e}")
-        time.sleep(5)  # Tunggu sebelum retry
-        return False
+        logger.error(f"Gagal reset kuota harian: {e}")
 
-def safe_sheets_operation(func, max_retries=3):
-    """Eksekusi operasi Google Sheets dengan retry"""
-    for attempt in range(max_retries):
-        try:
-            return func()
-        except Exception as e:
-            logger.warning(f"Percobaan {attempt+1} gagal: {e}")
-            if attempt == max_retries - 1:
-                raise
-            time.sleep(2)
-            refresh_connection()
-
-def get_user_row(user_id):
-    """Mendapatkan baris user di spreadsheet"""
-    def operation():
-        records = sheet_members.get_all_records()
-        for idx, record in enumerate(records, start=2):
-            if str(record.get('telegram_id', '')) == str(user_id):
-                return idx
-        return None
-    return safe_sheets_operation(operation)
-
-def add_new_user(user):
-    """Menambahkan user baru ke spreadsheet"""
-    def operation():
-        sheet_members.append_row([
-            str(user.id),
-            user.username or "",
-            "non-vip",
-            "",
-            datetime.now().strftime("%Y-%m-%d %H:%M:%S"),
-            5  # Kuota awal
-        ])
-        return True
-    return safe_sheets_operation(operation)
-
-def reset_daily_quota_if_needed(row):
-    """Reset kuota harian jika sudah lewat hari"""
-    def operation():
-        last_updated = sheet_members.cell(row, 5).value
-        if last_updated:
-            last_date = datetime.strptime(last_updated, "%Y-%m-%d %H:%M:%S").date()
-            if last_date < datetime.now().date():
-                sheet_members.update_cell(row, 6, 5)
-                sheet_members.update_cell(row, 5, datetime.now().strftime("%Y-%m-%d %H:%M:%S"))
-    safe_sheets_operation(operation)
-
-def get_today_quota(row):
-    """Mendapatkan kuota harian user"""
-    def operation():
-        return int(sheet_members.cell(row, 6).value)
-    return safe_sheets_operation(operation)
-
-def reduce_quota(row):
-    """Mengurangi kuota user"""
-    def operation():
-        current = get_today_quota(row)
-        if current > 0:
-            sheet_members.update_cell(row, 6, current - 1)
-    safe_sheets_operation(operation)
-
-def get_film_link(film_code, is_vip=False):
+async def get_film_link(film_code, is_vip=False):
     """Mendapatkan link film berdasarkan kode"""
-    def operation():
-        records = sheet_films.get_all_records()
-        for record in records:
-            if record.get('code') == film_code:
-                return record.get('vip_link' if is_vip else 'free_link')
+    storage = await get_storage()
+    film = await storage.get_film(film_code)
+    if not film:
         return None
-    return safe_sheets_operation(operation)
+    return film['vip_link' if is_vip else 'free_link']
+
+# Cache cek VIP: nonton Part 2 beruntun tidak perlu menyentuh storage
+vip_status_cache = VipStatusCache(negative_ttl=VIP_NEGATIVE_TTL)
 
-def check_vip_status(user_id):
+async def check_vip_status(user_id):
     """Memeriksa status VIP user"""
-    def operation():
-        row = get_user_row(user_id)
-        if not row:
-            return False
-            
-        vip_status = sheet_members.cell(row, 3).value
-        vip_expiry = sheet_members.cell(row, 4).value
-        
-        if vip_status == "vip" and vip_expiry:
-            expiry_date = datetime.strptime(vip_expiry, "%Y-%m-%d")
-            return expiry_date >= datetime.now()
-        return False
-    return safe_sheets_operation(operation)
+    now = datetime.now()
+    cached = vip_status_cache.get(user_id, now)
+    if cached is not None:
+        metrics.CACHE_REQUESTS.inc(cache="vip", result="hit")
+        return cached
+
+    metrics.CACHE_REQUESTS.inc(cache="vip", result="miss")
+    record = await get_member_record(user_id)
+    is_vip = record is not None and record.is_vip()
+    # Data cadangan saat Sheets down tidak di-cache sebagai jawaban non-VIP
+    if is_vip or record is None or not record.stale:
+        vip_status_cache.put(user_id, is_vip, now, expiry=record.expiry_date if is_vip else None)
+    return is_vip
+
+async def expire_vips(context: CallbackContext):
+    """Job berkala: turunkan VIP yang sudah habis ke non-vip (satu penulisan batch)"""
+    try:
+        if not await claim_job("expire_vips", int(time.time() // VIP_SWEEP_INTERVAL)):
+            return
+        storage = await get_storage()
+        with sheets_priority(PRIORITY_BACKGROUND):
+            expired = await storage.expire_vips(datetime.now())
+        if expired:
+            logger.info(f"VIP habis diturunkan: {len(expired)} member")
+    except Exception as e:
+        logger.error(f"Gagal menurunkan VIP yang habis: {e}")
 
-def update_vip_status(user_id, package_id):
-    """Update status VIP user di Google Sheets"""
-    def operation():
-        try:
-            # Dapatkan package info
-            package = TRAKTEER_PACKAGE_MAPPING.get(package_id)
-            if not package:
-                logger.error(f"Package {package_id} not found!")
-                return False
-
-            # Cari user
-            records = sheet_members.get_all_records()
-            for idx, record in enumerate(records, start=2):
-                if str(record.get('telegram_id', '')) == str(user_id):
-                    # Hitung expiry date
-                    expiry_date = (datetime.now() + timedelta(days=package['days'])).strftime("%Y-%m-%d")
-                    
-                    # Update sheet
-                    sheet_members.update_cell(idx, 3, "vip")  # Kolom status
-                    sheet_members.update_cell(idx, 4, expiry_date)  # Kolom expiry
-                    
-                    logger.info(f"Updated user {user_id} to VIP until {expiry_date}")
-                    return True
-
-            logger.error(f"User {user_id} not found in sheet")
-            return False
-
-        except Exception as e:
-            logger.error(f"Sheet update error: {str(e)}")
-            return False
-
-    return safe_sheets_operation(operation)
+async def sync_sheets(context: CallbackContext):
+    """Job berkala: terapkan perubahan manual di sheet tanpa membaca ulang seluruh sheet"""
+    try:
+        storage = await get_storage()
+        with sheets_priority(PRIORITY_BACKGROUND):
+            changed = await storage.sync_sheets()
+        if changed is None:
+            vip_status_cache.invalidate()
+        else:
+            for user_id in changed:
+                vip_status_cache.invalidate(user_id)
+    except Exception as e:
+        logger.error(f"Gagal sinkronisasi sheet: {e}")
 
 # ===== HANDLER COMMAND =====
+@track_handler
 async def start(update: Update, context: CallbackContext):
     """Handler untuk command /start"""
     try:
         user = update.effective_user
-        row = get_user_row(user.id)
-        if row is None:
-            if not add_new_user(user):
+        if await get_member_record(user.id) is None:
+            if not await add_new_user(user):
                 raise Exception("Gagal mendaftarkan user baru")
 
         if context.args:
             try:
                 encoded_str = context.args[0]
                 film_code, part = decode_film_code(encoded_str)
-                film_data = get_film_info(film_code)
+                film_data = await get_film_info(film_code)
                 
                 if not film_data:
                     await update.message.reply_text("❌ Film tidak ditemukan")
@@ -255,7 +356,7 @@ async def start(update: Update, context: CallbackContext):
                         await context.bot.copy_message(
                             chat_id=update.effective_chat.id,
                             from_chat_id=int(CHANNEL_PRIVATE),
-                            message_id=int(film_data['free_msg_id'])
+                            message_id=film_data['free_msg_id']
                         )
                         
                         keyboard = [
@@ -281,12 +382,12 @@ async def start(update: Update, context: CallbackContext):
                         return
 
                 elif part == "P2":
-                    if check_vip_status(user.id) or not film_data['is_part2_vip']:
+                    if await check_vip_status(user.id) or not film_data['is_part2_vip']:
                         try:
                             await context.bot.copy_message(
                                 chat_id=update.effective_chat.id,
                                 from_chat_id=int(CHANNEL_PRIVATE),
-                                message_id=int(film_data['vip_msg_id'])
+                                message_id=film_data['vip_msg_id']
                             )
                             return
                         except Exception as e:
@@ -304,6 +405,7 @@ async def start(update: Update, context: CallbackContext):
                         return
             except Exception as e:
                 logger.error(f"Error memproses link film: {e}")
+                metrics.count_handler_error()
                 await update.message.reply_text("❌ Terjadi kesalahan saat memproses link film")
 
         keyboard = [
@@ -323,6 +425,7 @@ async def start(update: Update, context: CallbackContext):
         logger.error(f"Error di start: {e}")
         await send_error_message(update, context)
 
+@track_handler
 async def vip(update: Update, context: CallbackContext):
     try:
         user_id = update.effective_user.id
@@ -351,25 +454,19 @@ async def vip(update: Update, context: CallbackContext):
         logger.error(f"Error di vip: {e}")
         await send_error_message(update, context)
 
+@track_handler
 async def status(update: Update, context: CallbackContext):
     try:
         user = update.effective_user
-        row = get_user_row(user.id)
-        if row is None:
-            if not add_new_user(user):
+        record = await get_member_record(user.id)
+        if record is None:
+            if not await add_new_user(user):
                 raise Exception("Gagal mendaftarkan user baru")
-            row = get_user_row(user.id)
+            record = await get_member_record(user.id)
 
-        reset_daily_quota_if_needed(row)
-
-        vip_status = sheet_members.cell(row, 3).value or "non-vip"
-        vip_expiry = sheet_members.cell(row, 4).value or "-"
-        quota = sheet_members.cell(row, 6).value or "0"
-
-        is_vip = vip_status.lower() == "vip" and (
-            vip_expiry == "-" or 
-            datetime.strptime(vip_expiry, "%Y-%m-%d") >= datetime.now()
-        )
+        vip_expiry = record.vip_expiry or "-"
+        quota = record.quota_today()
+        is_vip = await check_vip_status(user.id)
 
         if vip_expiry != "-":
             try:
@@ -388,6 +485,8 @@ async def status(update: Update, context: CallbackContext):
             f"📅 Masa Aktif Hingga: {formatted_expiry}\n\n"
             "Terima kasih telah menggunakan VIP Drama Cina"
         )
+        if record.stale:
+            status_msg += "\n\n⚠️ Database sedang gangguan, data mungkin belum terbaru"
 
         keyboard = [
             [InlineKeyboardButton("💎 Upgrade VIP", callback_data="vip")],
@@ -402,26 +501,28 @@ async def status(update: Update, context: CallbackContext):
         logger.error(f"Error di status: {e}")
         await send_error_message(update, context)
 
+async def send_quota_exhausted(update: Update, context: CallbackContext):
+    await context.bot.send_message(
+        chat_id=update.effective_chat.id,
+        text="😢 Kuota gratis hari ini sudah habis!\n\n"
+             "Anda bisa menonton lagi besok atau upgrade ke VIP untuk akses tak terbatas.",
+        reply_markup=InlineKeyboardMarkup([
+            [InlineKeyboardButton("💎 Upgrade VIP", callback_data="vip")]
+        ])
+    )
+
+@track_handler
 async def gratis(update: Update, context: CallbackContext):
     try:
         user = update.effective_user
-        row = get_user_row(user.id)
-        if row is None:
-            if not add_new_user(user):
+        record = await get_member_record(user.id)
+        if record is None:
+            if not await add_new_user(user):
                 raise Exception("Gagal mendaftarkan user baru")
-            row = get_user_row(user.id)
+            record = await get_member_record(user.id)
 
-        reset_daily_quota_if_needed(row)
-
-        if get_today_quota(row) <= 0:
-            await context.bot.send_message(
-                chat_id=update.effective_chat.id,
-                text="😢 Kuota gratis hari ini sudah habis!\n\n"
-                     "Anda bisa menonton lagi besok atau upgrade ke VIP untuk akses tak terbatas.",
-                reply_markup=InlineKeyboardMarkup([
-                    [InlineKeyboardButton("💎 Upgrade VIP", callback_data="vip")]
-                ])
-            )
+        if record.quota_today() <= 0:
+            await send_quota_exhausted(update, context)
             return
 
         if not context.args:
@@ -431,13 +532,17 @@ async def gratis(update: Update, context: CallbackContext):
             )
             return
 
-        film_link = get_film_link(context.args[0])
+        film_link = await get_film_link(context.args[0])
         if film_link:
-            reduce_quota(row)
+            remaining = await consume_quota(user.id)
+            if remaining is None:
+                # Kalah balapan dengan tap lain yang menghabiskan kuota
+                await send_quota_exhausted(update, context)
+                return
             await context.bot.send_message(
                 chat_id=update.effective_chat.id,
                 text=f"🎬 Berikut tontonan gratis Anda:\n{film_link}\n\n"
-                     f"Sisa kuota hari ini: {get_today_quota(row)}/5"
+                     f"Sisa kuota hari ini: {remaining}/5"
             )
         else:
             await context.bot.send_message(
@@ -448,6 +553,7 @@ async def gratis(update: Update, context: CallbackContext):
         logger.error(f"Error di gratis: {e}")
         await send_error_message(update, context)
 
+@track_handler
 async def vip_episode(update: Update, context: CallbackContext):
     try:
         user = update.effective_user
@@ -458,7 +564,7 @@ async def vip_episode(update: Update, context: CallbackContext):
             )
             return
 
-        film_link = get_film_link(context.args[0], is_vip=True)
+        film_link = await get_film_link(context.args[0], is_vip=True)
         if not film_link:
             await context.bot.send_message(
                 chat_id=update.effective_chat.id,
@@ -466,7 +572,7 @@ async def vip_episode(update: Update, context: CallbackContext):
             )
             return
 
-        if check_vip_status(user.id):
+        if await check_vip_status(user.id):
             await context.bot.send_message(
                 chat_id=update.effective_chat.id,
                 text=f"💎 VIP Access:\n{film_link}"
@@ -485,6 +591,7 @@ async def vip_episode(update: Update, context: CallbackContext):
         logger.error(f"Error di vip_episode: {e}")
         await send_error_message(update, context)
 
+@track_handler
 async def button_handler(update: Update, context: CallbackContext):
     try:
         query = update.callback_query
@@ -503,6 +610,7 @@ async def button_handler(update: Update, context: CallbackContext):
         logger.error(f"Error di button_handler: {e}")
         await send_error_message(update, context)
 
+@track_handler
 async def handle_message(update: Update, context: CallbackContext):
     try:
         await context.bot.send_message(
@@ -511,8 +619,10 @@ async def handle_message(update: Update, context: CallbackContext):
         )
     except Exception as e:
         logger.error(f"Error di handle_message: {e}")
+        metrics.count_handler_error()
 
 async def send_error_message(update: Update, context: CallbackContext):
+    metrics.count_handler_error()
     try:
         error_msg = (
             "⚠️ Maaf, terjadi gangguan teknis\n\n"
@@ -527,9 +637,10 @@ async def send_error_message(update: Update, context: CallbackContext):
     except Exception as e:
         logger.error(f"Gagal mengirim pesan error: {e}")
 
+@track_handler
 async def generate_film_links(update: Update, context: CallbackContext):
     """Generate film links (NEW)"""
-    if str(update.effective_user.id) != "YOUR_ADMIN_ID":  # Ganti dengan ID Telegram admin
+    if str(update.effective_user.id) != ADMIN_ID:
         return
 
     if not context.args:
@@ -537,7 +648,7 @@ async def generate_film_links(update: Update, context: CallbackContext):
         return
 
     film_code = context.args[0]
-    film_data = get_film_info(film_code)
+    film_data = await get_film_info(film_code)
     
     if not film_data:
         await update.message.reply_text("❌ Film not found")
@@ -556,20 +667,18 @@ async def generate_film_links(update: Update, context: CallbackContext):
         f"▫️ [Part 2 ({'VIP' if film_data['is_part2_vip'] else 'Free'})]({part2_link})"
     )
 
-def get_film_info(film_code):
+async def get_film_info(film_code):
     """Mendapatkan data film lengkap termasuk ID pesan"""
-    def operation():
-        records = sheet_films.get_all_records()
-        for record in records:
-            if record['code'] == film_code:
-                return {
-                    'title': record['title'],
-                    'free_msg_id': record['free_msg_id'],
-                    'vip_msg_id': record['vip_msg_id'],
-                    'is_part2_vip': record.get('is_part2_vip', 'TRUE') == 'TRUE'
-                }
+    storage = await get_storage()
+    film = await storage.get_film(film_code)
+    if not film:
         return None
-    return safe_sheets_operation(operation)
+    return {
+        'title': film['title'],
+        'free_msg_id': film['free_msg_id'],
+        'vip_msg_id': film['vip_msg_id'],
+        'is_part2_vip': film['is_part2_vip']
+    }
 
 def encode_film_code(film_code, part):
     """Encode kode film untuk URL"""
@@ -579,10 +688,26 @@ def decode_film_code(encoded_str):
     """Decode kode film dari URL"""
     return base64.urlsafe_b64decode(encoded_str.encode()).decode().split("_")
 
+@track_handler
+async def reload_films(update: Update, context: CallbackContext):
+    """Handler admin untuk /reload_films: muat ulang katalog film"""
+    if str(update.effective_user.id) != ADMIN_ID:
+        return
+
+    try:
+        storage = await get_storage()
+        total = await storage.reload_films()
+        await update.message.reply_text(f"✅ Katalog film dimuat ulang: {total} film")
+    except Exception as e:
+        logger.error(f"Gagal reload katalog film: {e}")
+        metrics.count_handler_error()
+        await update.message.reply_text("❌ Gagal memuat ulang katalog film")
+
 async def keep_alive(context: CallbackContext):
     """Refresh koneksi secara berkala"""
     try:
-        refresh_connection()
+        storage = await get_storage()
+        await storage.keep_alive()
         logger.info("✅ Koneksi diperbarui")
     except Exception as e:
         logger.error(f"Gagal refresh koneksi: {e}")
@@ -590,12 +715,13 @@ async def keep_alive(context: CallbackContext):
 async def ping_server(context: CallbackContext):
     try:
         # Gunakan session dengan timeout pendek
-        response = requests.get(f"{WEBHOOK_URL}/healthz", timeout=3)
+        response = await asyncio.to_thread(requests.get, f"{WEBHOOK_URL}/healthz", timeout=3)
         logger.info(f"🏓 Ping successful - Status: {response.status_code}")
     except Exception as e:
         logger.warning(f"Ping failed: {str(e)}")
         # Tidak perlu refresh webhook otomatis
 
+@track_handler
 async def bot_health_check(update: Update, context: CallbackContext):
     """Handler for /health command"""
     try:
@@ -606,12 +732,21 @@ async def bot_health_check(update: Update, context: CallbackContext):
         )
     except Exception as e:
         logger.error(f"Health check error: {e}")
+        metrics.count_handler_error()
         await update.message.reply_text("⚠️ Bot is running but with some issues")
         
 # ===== TELEGRAM BOT SETUP =====
-def initialize_bot():
-    """Initialize the Telegram bot application"""
-    application = Application.builder().token(BOT_TOKEN).build()
+def initialize_bot(request=None):
+    """Initialize the Telegram bot application
+
+    request: BaseRequest pengganti HTTP ke Bot API (dipakai benchmark/load test)
+    """
+    # Paralelisme update diatur UpdateDispatcher(workers=CONCURRENT_UPDATES),
+    # bukan builder.concurrent_updates: worker memanggil process_update langsung
+    builder = Application.builder().token(BOT_TOKEN)
+    if request is not None:
+        builder = builder.request(request).get_updates_request(request)
+    application = builder.build()
     
     # Initialize JobQueue
     job_queue = application.job_queue
@@ -619,6 +754,56 @@ def initialize_bot():
         job_queue = JobQueue()
         application.job_queue = job_queue
 
+    # Reset kuota massal tiap tengah malam (waktu lokal server). Opsional,
+    # karena kuota sudah dihitung lazy dari last_updated.
+    if QUOTA_RESET_JOB:
+        job_queue.run_daily(
+            reset_daily_quotas,
+            time=dtime(0, 0, tzinfo=datetime.now().astimezone().tzinfo),
+            name="reset_daily_quotas"
+        )
+
+    # VIP yang sudah habis diturunkan di sheet, hanya menyentuh user yang habis
+    job_queue.run_repeating(
+        expire_vips,
+        interval=VIP_SWEEP_INTERVAL,
+        first=VIP_SWEEP_INTERVAL,
+        name="expire_vips"
+    )
+
+    # Perubahan yang dibuat tim ops langsung di sheet (edit/tambah baris)
+    if SHEET_SYNC_INTERVAL:
+        job_queue.run_repeating(
+            sync_sheets,
+            interval=SHEET_SYNC_INTERVAL,
+            first=SHEET_SYNC_INTERVAL,
+            name="sync_sheets"
+        )
+
+    if VIP_REMINDER_JOB:
+        job_queue.run_daily(
+            vip_expiry_reminder,
+            time=dtime(VIP_REMINDER_HOUR, 0, tzinfo=datetime.now().astimezone().tzinfo),
+            name="vip_expiry_reminder"
+        )
+
+    if SHARED_STATE_DB:
+        job_queue.run_repeating(
+            sync_shared_state, interval=SHARED_STATE_POLL, first=SHARED_STATE_POLL, name="sync_shared_state"
+        )
+        job_queue.run_repeating(prune_shared_state, interval=3600, first=60, name="prune_shared_state")
+
+    # Broadcast yang terputus karena restart dilanjutkan setelah bot siap
+    job_queue.run_once(resume_broadcasts, when=5, name="resume_broadcasts")
+
+    # Pembayaran yang gagal diterapkan (misal Sheets sedang down) dicoba lagi
+    job_queue.run_repeating(
+        retry_pending_payments,
+        interval=PAYMENT_RETRY_INTERVAL,
+        first=PAYMENT_RETRY_INTERVAL,
+        name="retry_pending_payments"
+    )
+
     # Register handlers
     application.add_handler(CommandHandler("start", start))
     application.add_handler(CommandHandler("health", bot_health_check))
@@ -627,28 +812,95 @@ def initialize_bot():
     application.add_handler(CommandHandler("gratis", gratis))
     application.add_handler(CommandHandler("vip_episode", vip_episode))
     application.add_handler(CommandHandler("generate_link", generate_film_links))
+    application.add_handler(CommandHandler("reload_films", reload_films))
+    application.add_handler(CommandHandler("reconcile", reconcile))
+    application.add_handler(CommandHandler("broadcast", broadcast))
+    application.add_handler(ChatMemberHandler(track_bot_blocked, ChatMemberHandler.MY_CHAT_MEMBER))
     application.add_handler(CallbackQueryHandler(button_handler))
     application.add_handler(MessageHandler(filters.TEXT & ~filters.COMMAND, handle_message))
     
     return application  # This should be INSIDE the function
 
-# Initialize the bot application
-application = initialize_bot()
+# Application dibangun saat startup (atau update pertama), bukan saat import
+application = None
+application_lock = asyncio.Lock()
+
+async def get_application():
+    """Mendapatkan Application yang sudah initialize() + start()"""
+    global application
+    if application is None:
+        async with application_lock:
+            if application is None:
+                started = time.perf_counter()
+                instance = initialize_bot()
+                await instance.initialize()
+                await instance.start()
+                application = instance
+                record_startup("bot_ready", started)
+    return application
+
+async def stop_application():
+    """Hentikan bot (job queue, update) dengan rapi saat server berhenti"""
+    global application
+    if application is None:
+        return
+    async with application_lock:
+        if application.running:
+            await application.stop()
+        await application.shutdown()
+        application = None
+
+async def process_raw_update(data):
+    """Dipanggil worker antrian: parse update lalu jalankan handler"""
+    application = await get_application()
+    update = Update.de_json(data, application.bot)
+    with metrics.track_update():
+        await application.process_update(update)
+    if "first_update" not in startup_report:
+        record_startup("first_update", _import_started)
+
+# Webhook hanya memasukkan update ke antrian; worker yang menjalankan handler
+update_dispatcher = UpdateDispatcher(
+    process_raw_update,
+    workers=CONCURRENT_UPDATES or 1,
+    maxsize=UPDATE_QUEUE_SIZE,
+    dedupe_size=UPDATE_DEDUPE_SIZE,
+    enqueue_timeout=UPDATE_ENQUEUE_TIMEOUT,
+    claim=claim_update if SHARED_STATE_DB else None
+)
+
+# ===== STARTUP REPORT =====
+# Durasi tiap tahap startup (ms) untuk mengukur time-to-first-update
+startup_report = {}
+
+def record_startup(stage, started):
+    """Catat durasi satu tahap startup dan total sejak proses mulai"""
+    now = time.perf_counter()
+    startup_report[stage] = {
+        "duration_ms": round((now - started) * 1000, 1),
+        "since_import_ms": round((now - _import_started) * 1000, 1)
+    }
+    logger.info(f"⏱️ Startup {stage}: {startup_report[stage]}")
+
+async def warm_up():
+    """Siapkan storage dan bot di background supaya server bisa langsung listen"""
+    try:
+        await asyncio.gather(get_storage(), get_application())
+    except Exception as e:
+        logger.error(f"Warm-up gagal, akan dicoba lagi saat update pertama: {e}")
 
 # ===== WEBHOOK ENDPOINTS =====
 @app.post(f'/{BOT_TOKEN}')
 async def telegram_webhook(request: Request):
-    """Endpoint to receive updates from Telegram"""
+    """Endpoint to receive updates from Telegram: validasi, antrekan, langsung 200"""
+    if request.headers.get("X-Telegram-Bot-Api-Secret-Token") != WEBHOOK_SECRET:
+        logger.error("Invalid Telegram webhook secret")
+        raise HTTPException(status_code=fastapi_status.HTTP_403_FORBIDDEN)
+
     try:
-        # Initialize the bot if not already initialized
-        if not application.running:
-            await application.initialize()
-            await application.start()
-        
         json_data = await request.json()
-        update = Update.de_json(json_data, application.bot)
-        await application.process_update(update)
-        return {"status": "ok"}
+        if not isinstance(json_data, dict) or not isinstance(json_data.get("update_id"), int):
+            raise ValueError("update_id tidak ada")
     except Exception as e:
         logger.error(f"Error processing update: {e}")
         raise HTTPException(
@@ -656,10 +908,52 @@ async def telegram_webhook(request: Request):
             detail={"status": "error", "message": str(e)}
         )
 
+    result = await update_dispatcher.submit(json_data)
+    if result == "full":
+        # Telegram akan mengirim ulang update ini nanti
+        raise HTTPException(
+            status_code=fastapi_status.HTTP_503_SERVICE_UNAVAILABLE,
+            detail={"status": "error", "message": "Update queue full"}
+        )
+    return {"status": "ok", "result": result}
+
+@app.on_event("startup")
+async def start_background_init():
+    """Mulai warm-up storage + bot (initialize + start) tanpa menahan startup server"""
+    app.state.warm_up = asyncio.create_task(warm_up())
+    update_dispatcher.start()
+
+@app.on_event("shutdown")
+async def stop_background():
+    """Kuras antrian update, hentikan bot, lalu flush penulisan yang tertunda"""
+    warm_up_task = getattr(app.state, "warm_up", None)
+    if warm_up_task is not None and not warm_up_task.done():
+        await asyncio.gather(warm_up_task, return_exceptions=True)
+    await update_dispatcher.stop()
+    if broadcast_engine is not None:
+        await broadcast_engine.stop()
+    await stop_application()
+    if storage is not None:
+        await storage.stop()
+
 @app.get("/healthz")
 async def health_check():
     """Health check endpoint for Render"""
-    return {"status": "ok", "uptime": str(datetime.now() - start_time)}
+    health = {
+        "status": "ok",
+        "uptime": str(datetime.now() - start_time),
+        "startup": startup_report
+    }
+    breaker = getattr(storage, "breaker", None) or getattr(getattr(storage, "sheets", None), "breaker", None)
+    if breaker is not None:
+        health["sheets"] = breaker.state()
+    return health
+
+@app.get("/metrics")
+async def metrics_endpoint():
+    """Metrik format teks Prometheus"""
+    metrics.UPDATE_QUEUE_DEPTH.set(update_dispatcher.size)
+    return PlainTextResponse(metrics.REGISTRY.render(), media_type="text/plain; version=0.0.4")
 
 def setup_webhook():
     """Setup Telegram webhook (synchronous)"""
@@ -679,9 +973,9 @@ def setup_webhook():
             json={
                 'url': webhook_url,
                 'drop_pending_updates': True,
-                'secret_token': os.getenv('WEBHOOK_SECRET', 'WEBHOOK_SECRET_TOKEN'),
-                'allowed_updates': ['message', 'callback_query'],
-                'max_connections': 40
+                'secret_token': WEBHOOK_SECRET,
+                'allowed_updates': ['message', 'callback_query', 'my_chat_member'],
+                'max_connections': WEBHOOK_MAX_CONNECTIONS
             },
             timeout=10
         )
@@ -702,7 +996,7 @@ def setup_webhook():
 
 # ===== TRAKTEER WEBHOOK HANDLER =====
 @app.post("/trakteer_webhook")
-async def trakteer_webhook(request: Request):
+async def trakteer_webhook(request: Request, background_tasks: BackgroundTasks):
     try:
         # Verifikasi secret token
         incoming_secret = request.headers.get("X-Webhook-Token")
@@ -713,76 +1007,239 @@ async def trakteer_webhook(request: Request):
         data = await request.json()
         logger.info(f"Raw webhook data: {json.dumps(data, indent=2)}")  # Log lengkap
 
-        # Cari user_id dari supporter_message (fallback jika email tidak ada)
-        supporter_message = data.get("supporter_message", "")
-        user_id = None
-        
-        # Method 1: Cari dari "?utm_source=USER_ID" di supporter_message
-        if "utm_source=" in supporter_message:
-            user_id = supporter_message.split("utm_source=")[1].split("&")[0].split("?")[0]
-        
-        # Method 2: Cari pola email di supporter_message
-        if not user_id and "@vipbot.com" in supporter_message:
-            user_id = supporter_message.split("@vipbot.com")[0][-10:]  # Ambil 10 digit terakhir
-
-        if not user_id or not user_id.isdigit():
-            logger.error(f"Failed to extract user_id from: {supporter_message}")
+        user_id, package_id = extract_payment(data)
+        if not user_id:
+            logger.error(f"Failed to extract user_id from: {data.get('supporter_message', '')}")
             return JSONResponse({"status": "error", "message": "User ID not found"})
 
-        # Proses package
-        package_id = "vip1hari"  # Default, sesuaikan dengan quantity jika perlu
-        quantity = int(data.get("quantity", 0))
-        
-        if quantity == 2:
-            package_id = "vip1hari"
-        elif quantity == 5:
-            package_id = "vip3hari"
-        elif quantity == 10:
-            package_id = "vip7hari"
-        elif quantity == 30:
-            package_id = "vip30hari"
-        elif quantity == 150:
-            package_id = "vip6bulan"
-        # ... tambahkan mapping lainnya sesuai kebutuhan
-
-        # Update status VIP
-        success = update_vip_status(user_id, package_id)
-        if success:
-            logger.info(f"Successfully updated VIP status for user {user_id}")
-            return JSONResponse({"status": "success"})
-        else:
-            logger.error(f"Failed to update VIP status for user {user_id}")
-            return JSONResponse({"status": "error", "message": "Google Sheets update failed"})
+        # Catat dulu di ledger; retry Trakteer dengan transaction id yang sama diabaikan
+        txn_id = payment_txn_id(data)
+        if not await get_payment_ledger().record(txn_id, user_id, package_id, data):
+            logger.info(f"Duplicate payment {txn_id} ignored")
+            return JSONResponse({"status": "duplicate"})
+
+        # Update status VIP setelah response dikirim
+        background_tasks.add_task(process_vip_payment, txn_id)
+        return JSONResponse({"status": "accepted"})
 
+    except HTTPException:
+        raise
     except Exception as e:
         logger.error(f"Webhook processing failed: {str(e)}", exc_info=True)
         raise HTTPException(status_code=500)
 
-async def process_vip_payment(user_id: str, package_id: str):
-    """Background task untuk update VIP status"""
+# Ledger pembayaran dibuka saat pertama dipakai
+payment_ledger = None
+
+def get_payment_ledger():
+    """Mendapatkan ledger pembayaran (SQLite di PAYMENTS_DB)"""
+    global payment_ledger
+    if payment_ledger is None:
+        payment_ledger = PaymentLedger(PAYMENTS_DB)
+    return payment_ledger
+
+async def process_vip_payment(txn_id: str):
+    """Background task: terapkan satu pembayaran dari ledger, aman untuk di-retry"""
+    await apply_payment(
+        await get_storage(), get_payment_ledger(), txn_id, TRAKTEER_PACKAGE_MAPPING, PAYMENT_MAX_ATTEMPTS,
+        lock=shared_lock, on_applied=invalidate_member
+    )
+
+async def reconcile_pending_payments():
+    """Terapkan semua pembayaran pending sekaligus (satu baca + satu tulis batch).
+
+    Pembayaran yang baru masuk dilewati dulu karena masih ditangani background task.
+    """
+    ledger = get_payment_ledger()
+    # Satu rekonsiliasi sekaligus di semua worker, pending dibaca setelah dapat lock
+    async with shared_lock("reconcile_payments"):
+        pending = await ledger.pending(
+            max_attempts=PAYMENT_MAX_ATTEMPTS,
+            limit=RECONCILE_BATCH_SIZE,
+            before=datetime.now() - timedelta(seconds=PAYMENT_RETRY_INTERVAL)
+        )
+        if not pending:
+            return 0, 0
+        user_ids = list(dict.fromkeys(payment.user_id for payment in pending))
+        try:
+            # Lock yang sama dengan process_vip_payment; ledger dibaca ulang di
+            # dalam lock karena background task bisa sudah menerapkan sebagian
+            async with member_locks(user_ids):
+                pending = await fresh_pending(ledger, pending)
+                if not pending:
+                    return 0, 0
+                with sheets_priority(PRIORITY_PAYMENT):
+                    return await reconcile_payments(
+                        await get_storage(), ledger, pending, TRAKTEER_PACKAGE_MAPPING, PAYMENT_MAX_ATTEMPTS
+                    )
+        finally:
+            for user_id in user_ids:
+                await invalidate_member(user_id)
+
+async def fresh_pending(ledger, payments):
+    """Baca ulang pembayaran dari ledger, hanya yang masih pending"""
+    fresh = [await ledger.get(payment.txn_id) for payment in payments]
+    return [payment for payment in fresh if payment is not None and payment.status == "pending"]
+
+async def retry_pending_payments(context: CallbackContext):
+    """Job berkala: rekonsiliasi pembayaran yang belum berhasil diterapkan"""
     try:
-        success = update_vip_status(user_id, package_id)
-        if success:
-            logger.info(f"VIP status updated for user {user_id}")
-        else:
-            logger.error(f"Failed to update VIP status for user {user_id}")
+        await reconcile_pending_payments()
     except Exception as e:
-        logger.error(f"Background task error: {str(e)}")
+        logger.error(f"Gagal retry pembayaran: {e}")
+
+@track_handler
+async def reconcile(update: Update, context: CallbackContext):
+    """Handler admin untuk /reconcile: terapkan pembayaran pending sekarang"""
+    if str(update.effective_user.id) != ADMIN_ID:
+        return
+
+    try:
+        applied, failed = await reconcile_pending_payments()
+        await update.message.reply_text(f"✅ Rekonsiliasi selesai: {applied} diterapkan, {failed} gagal")
+    except Exception as e:
+        logger.error(f"Error reconciling payments: {e}")
+        metrics.count_handler_error()
+        await update.message.reply_text("❌ Rekonsiliasi gagal, coba lagi nanti")
+
+# ===== BROADCAST =====
+# Engine broadcast dibuat saat pertama dipakai
+broadcast_engine = None
+
+def get_broadcast_engine():
+    """Mendapatkan engine broadcast (status di BROADCAST_DB)"""
+    global broadcast_engine
+    if broadcast_engine is None:
+        broadcast_engine = BroadcastEngine(
+            BroadcastStore(BROADCAST_DB),
+            get_storage,
+            rate_per_second=BROADCAST_RATE,
+            per_chat_interval=BROADCAST_PER_CHAT_INTERVAL,
+            workers=BROADCAST_WORKERS,
+            # Broadcast yang dilanjutkan setelah restart hanya dijalankan satu worker
+            run_lock=partial(get_shared_state().lock, wait=False) if SHARED_STATE_DB else None
+        )
+    return broadcast_engine
+
+@track_handler
+async def broadcast(update: Update, context: CallbackContext):
+    """Handler admin untuk /broadcast <audience> <pesan>, /broadcast status|cancel <id>"""
+    if str(update.effective_user.id) != ADMIN_ID:
+        return
+
+    usage = (
+        f"Usage: /broadcast <{'|'.join(AUDIENCES)}> <pesan>\n"
+        "/broadcast status <id>\n"
+        "/broadcast cancel <id>"
+    )
+    if len(context.args) < 2:
+        await update.message.reply_text(usage)
+        return
+
+    engine = get_broadcast_engine()
+    command = context.args[0].lower()
+    try:
+        if command in ("status", "cancel"):
+            broadcast_id = int(context.args[1])
+            info = await engine.store.get(broadcast_id)
+            if info is None:
+                await update.message.reply_text("❌ Broadcast tidak ditemukan")
+                return
+            if command == "cancel":
+                await engine.cancel(broadcast_id)
+                info["status"] = "cancelled"
+            counts = await engine.store.progress(broadcast_id)
+            await update.message.reply_text(
+                f"📤 Broadcast #{broadcast_id} ({info['status']}): "
+                f"{counts['sent']} terkirim, {counts['blocked']} diblokir, "
+                f"{counts['failed']} gagal, {counts['pending']} menunggu"
+            )
+            return
+
+        if command not in AUDIENCES:
+            await update.message.reply_text(usage)
+            return
+
+        # Ambil teks asli agar baris baru dan spasi di pesan tetap utuh
+        text = update.message.text.split(None, 2)[2]
+        broadcast_id = await engine.start(context.bot, command, text, update.effective_chat.id)
+        await update.message.reply_text(f"✅ Broadcast #{broadcast_id} dimulai ({command})")
+    except ValueError:
+        await update.message.reply_text(usage)
+    except Exception as e:
+        logger.error(f"Error broadcast: {e}")
+        metrics.count_handler_error()
+        await update.message.reply_text("❌ Broadcast gagal dimulai, coba lagi nanti")
+
+async def vip_expiry_reminder(context: CallbackContext):
+    """Job harian: ingatkan VIP yang masa aktifnya habis besok"""
+    try:
+        if not await claim_job("vip_expiry_reminder", datetime.now().date().isoformat()):
+            return
+        storage = await get_storage()
+        tomorrow = datetime.combine(datetime.now().date() + timedelta(days=1), dtime())
+        chat_ids = [int(user_id) for user_id in await storage.vips_expiring(tomorrow, tomorrow + timedelta(days=1))
+                    if user_id.isdigit()]
+        broadcast_id = await get_broadcast_engine().start(
+            context.bot, "expiring", VIP_REMINDER_TEXT, chat_ids=chat_ids
+        )
+        logger.info(f"Pengingat VIP dijadwalkan (broadcast #{broadcast_id})")
+    except Exception as e:
+        logger.error(f"Gagal memulai pengingat VIP: {e}")
+
+async def resume_broadcasts(context: CallbackContext):
+    try:
+        await get_broadcast_engine().resume_all(context.bot)
+    except Exception as e:
+        logger.error(f"Gagal melanjutkan broadcast: {e}")
+
+@track_handler
+async def track_bot_blocked(update: Update, context: CallbackContext):
+    """Catat user yang memblokir / membuka blokir bot supaya broadcast tidak sia-sia"""
+    member = update.my_chat_member
+    if member is None or member.chat.type != "private":
+        return
+    store = get_broadcast_engine().store
+    if member.new_chat_member.status == "kicked":
+        await store.block(member.chat.id)
+    elif member.new_chat_member.status == "member":
+        await store.unblock(member.chat.id)
 
 # ===== MAIN EXECUTION =====
+# python main.py                -> set webhook lalu jalankan server dengan WEB_WORKERS proses
+# python main.py --set-webhook  -> hanya set webhook, untuk deploy yang menjalankan
+#                                  "uvicorn main:app --workers N" sendiri (worker tidak set webhook)
 if __name__ == "__main__":
     import uvicorn
     
-    # Setup webhook
+    # Setup webhook sekali di sini, bukan per worker
     if not setup_webhook():
         logger.error("Failed to setup webhook, exiting...")
         exit(1)
+    if "--set-webhook" in sys.argv[1:]:
+        exit(0)
     
     # Run the server
-    uvicorn.run(
-        "main:app",
-        host="0.0.0.0",
-        port=int(os.getenv("PORT", 8443)),
-        log_level="info"
-    )
+    if WEB_WORKERS > 1:
+        if not SHARED_STATE_DB:
+            logger.error("WEB_WORKERS > 1 butuh SHARED_STATE_DB, exiting...")
+            exit(1)
+        # uvicorn hanya bisa menjalankan beberapa worker dari import string;
+        # tiap worker meng-import modul "main" sendiri tanpa menjalankan blok ini
+        uvicorn.run(
+            "main:app",
+            host="0.0.0.0",
+            port=PORT,
+            workers=WEB_WORKERS,
+            log_level="info"
+        )
+    else:
+        # Satu proses: kirim objek app, karena "main:app" akan meng-import file
+        # ini lagi sebagai modul "main" di proses yang sama (bot dibuat dua kali)
+        uvicorn.run(
+            app,
+            host="0.0.0.0",
+            port=PORT,
+            log_level="info"
+        )
 
@@ -0,0 +1,188 @@
+import time
+import logging
+from bisect import bisect_left
+from contextlib import contextmanager
+from contextvars import ContextVar
+from functools import wraps
+
+logger = logging.getLogger(__name__)
+
+# Batas bucket latency (detik), mirip default client Prometheus
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10)
+CALL_BUCKETS = (0, 1, 2, 3, 5, 8, 13, 21)
+
+# ===== METRIK =====
+class Metric:
+    """Dasar metrik berlabel; nilai disimpan per tuple label"""
+    kind = "untyped"
+
+    def __init__(self, name, documentation, labelnames=()):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self.values = {}
+
+    def _key(self, labels):
+        return tuple(str(labels.get(name, "")) for name in self.labelnames)
+
+    def _format_labels(self, key, extra=()):
+        pairs = list(zip(self.labelnames, key)) + list(extra)
+        if not pairs:
+            return ""
+        escaped = (
+            name + '="' + str(value).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n") + '"'
+            for name, value in pairs
+        )
+        return "{" + ",".join(escaped) + "}"
+
+    def samples(self):
+        """(nama, label, nilai) untuk format teks Prometheus"""
+        for key, value in sorted(self.values.items()):
+            yield self.name, self._format_labels(key), value
+
+    def render(self):
+        lines = [f"# HELP {self.name} {self.documentation}", f"# TYPE {self.name} {self.kind}"]
+        lines += [f"{name}{labels} {value}" for name, labels, value in self.samples()]
+        return "\n".join(lines)
+
+class Counter(Metric):
+    kind = "counter"
+
+    def inc(self, amount=1, **labels):
+        key = self._key(labels)
+        self.values[key] = self.values.get(key, 0) + amount
+
+class Gauge(Metric):
+    kind = "gauge"
+
+    def set(self, value, **labels):
+        self.values[self._key(labels)] = value
+
+class Histogram(Metric):
+    kind = "histogram"
+
+    def __init__(self, name, documentation, labelnames=(), buckets=LATENCY_BUCKETS):
+        super().__init__(name, documentation, labelnames)
+        self.buckets = tuple(sorted(buckets))
+
+    def observe(self, value, **labels):
+        key = self._key(labels)
+        state = self.values.get(key)
+        if state is None:
+            # [jumlah per bucket (+Inf di akhir), sum, count]
+            state = self.values[key] = [[0] * (len(self.buckets) + 1), 0.0, 0]
+        state[0][bisect_left(self.buckets, value)] += 1
+        state[1] += value
+        state[2] += 1
+
+    @contextmanager
+    def time(self, **labels):
+        started = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(time.perf_counter() - started, **labels)
+
+    def samples(self):
+        for key, (counts, total, count) in sorted(self.values.items()):
+            cumulative = 0
+            for bound, bucket_count in zip(self.buckets + (float("inf"),), counts):
+                cumulative += bucket_count
+                le = "+Inf" if bound == float("inf") else repr(bound)
+                yield f"{self.name}_bucket", self._format_labels(key, [("le", le)]), cumulative
+            yield f"{self.name}_sum", self._format_labels(key), total
+            yield f"{self.name}_count", self._format_labels(key), count
+
+class Registry:
+    """Kumpulan metrik yang dirender bersama di /metrics"""
+
+    def __init__(self):
+        self.metrics = {}
+
+    def register(self, metric):
+        self.metrics[metric.name] = metric
+        return metric
+
+    def render(self):
+        return "\n".join(metric.render() for metric in self.metrics.values()) + "\n"
+
+REGISTRY = Registry()
+
+HANDLER_LATENCY = REGISTRY.register(Histogram(
+    "cdrama_handler_latency_seconds", "Durasi handler Telegram", ["handler"]))
+HANDLER_ERRORS = REGISTRY.register(Counter(
+    "cdrama_handler_errors_total", "Exception di handler Telegram (ditangkap handler atau lolos)", ["handler"]))
+UPDATE_LATENCY = REGISTRY.register(Histogram(
+    "cdrama_update_latency_seconds", "Durasi proses satu update Telegram dari antrian"))
+SHEETS_CALLS_PER_UPDATE = REGISTRY.register(Histogram(
+    "cdrama_sheets_calls_per_update", "Request Google Sheets per update Telegram", buckets=CALL_BUCKETS))
+SHEETS_LATENCY = REGISTRY.register(Histogram(
+    "cdrama_sheets_latency_seconds", "Durasi satu percobaan operasi Google Sheets", ["operation"]))
+SHEETS_CALLS = REGISTRY.register(Counter(
+    "cdrama_sheets_calls_total", "Percobaan operasi Google Sheets", ["operation", "result"]))
+SHEETS_RETRIES = REGISTRY.register(Counter(
+    "cdrama_sheets_retries_total", "Retry operasi Google Sheets", ["operation"]))
+SHEETS_QUEUE_WAIT = REGISTRY.register(Histogram(
+    "cdrama_sheets_queue_wait_seconds", "Waktu tunggu kuota di scheduler Sheets", ["priority"]))
+SHEETS_SHED = REGISTRY.register(Counter(
+    "cdrama_sheets_shed_total", "Request Sheets yang ditolak scheduler karena kuota penuh", ["priority"]))
+SHEETS_RECONNECTS = REGISTRY.register(Counter(
+    "cdrama_sheets_reconnects_total", "Pemulihan koneksi Sheets per jenis", ["kind"]))
+CIRCUIT_OPEN = REGISTRY.register(Gauge(
+    "cdrama_circuit_open", "1 jika circuit breaker sedang terbuka", ["circuit"]))
+CACHE_REQUESTS = REGISTRY.register(Counter(
+    "cdrama_cache_requests_total", "Lookup cache storage", ["cache", "result"]))
+UPDATE_QUEUE_DEPTH = REGISTRY.register(Gauge(
+    "cdrama_update_queue_depth", "Update yang menunggu di antrian webhook"))
+SHEET_SYNCS = REGISTRY.register(Counter(
+    "cdrama_sheet_syncs_total", "Sinkronisasi inkremental worksheet per hasil", ["sheet", "result"]))
+SHEET_SYNC_ROWS = REGISTRY.register(Counter(
+    "cdrama_sheet_sync_rows_total", "Baris berubah/baru yang diterapkan oleh sinkronisasi", ["sheet"]))
+
+# ===== PER UPDATE =====
+# Penghitung request Sheets untuk update yang sedang diproses (None di luar update)
+_update_calls = ContextVar("update_calls", default=None)
+
+@contextmanager
+def track_update():
+    """Ukur durasi satu update dan jumlah request Sheets yang dipicunya"""
+    calls = [0]
+    token = _update_calls.set(calls)
+    try:
+        with UPDATE_LATENCY.time():
+            yield
+    finally:
+        _update_calls.reset(token)
+        SHEETS_CALLS_PER_UPDATE.observe(calls[0])
+
+def count_sheets_call():
+    calls = _update_calls.get()
+    if calls is not None:
+        calls[0] += 1
+
+# Nama handler yang sedang berjalan, untuk error yang ditangkap handler itu sendiri
+_current_handler = ContextVar("current_handler", default=None)
+
+def track_handler(func):
+    """Bungkus handler Telegram dengan histogram latency + counter error"""
+    name = func.__name__
+
+    @wraps(func)
+    async def wrapper(*args, **kwargs):
+        started = time.perf_counter()
+        token = _current_handler.set(name)
+        try:
+            return await func(*args, **kwargs)
+        except Exception:
+            HANDLER_ERRORS.inc(handler=name)
+            raise
+        finally:
+            _current_handler.reset(token)
+            HANDLER_LATENCY.observe(time.perf_counter() - started, handler=name)
+    return wrapper
+
+def count_handler_error():
+    """Catat exception yang ditangkap di dalam handler (tidak lolos ke track_handler)"""
+    name = _current_handler.get()
+    if name is not None:
+        HANDLER_ERRORS.inc(handler=name)
@@ -0,0 +1,288 @@
+import json
+import logging
+import hashlib
+import asyncio
+import sqlite3
+from contextlib import nullcontext
+from dataclasses import dataclass, replace
+from datetime import datetime, timedelta
+from functools import partial
+from concurrent.futures import ThreadPoolExecutor
+from typing import Optional
+from sheets_scheduler import sheets_priority, PRIORITY_PAYMENT
+
+logger = logging.getLogger(__name__)
+
+PAYMENTS_SCHEMA = """
+CREATE TABLE IF NOT EXISTS payments (
+    txn_id TEXT PRIMARY KEY,
+    user_id TEXT NOT NULL,
+    package_id TEXT NOT NULL,
+    status TEXT NOT NULL DEFAULT 'pending',
+    vip_expiry TEXT,
+    attempts INTEGER NOT NULL DEFAULT 0,
+    error TEXT,
+    payload TEXT,
+    created_at TEXT NOT NULL,
+    applied_at TEXT
+);
+CREATE INDEX IF NOT EXISTS idx_payments_status ON payments (status);
+"""
+
+PAYMENT_COLUMNS = "txn_id, user_id, package_id, status, vip_expiry, attempts, error, created_at"
+
+@dataclass
+class Payment:
+    """Satu event pembayaran Trakteer di ledger"""
+    txn_id: str
+    user_id: str
+    package_id: str
+    status: str = "pending"  # pending / applied / failed
+    vip_expiry: Optional[str] = None  # Expiry yang dihitung saat pertama diproses
+    attempts: int = 0
+    error: Optional[str] = None
+    created_at: str = ""
+
+# ===== PAYLOAD TRAKTEER =====
+TRAKTEER_PACKAGE_MAPPING = {
+    "vip1hari": {"days": 1, "price": 1000},
+    "vip3hari": {"days": 3, "price": 2000},
+    "vip7hari": {"days": 7, "price": 5000},
+    "vip30hari": {"days": 30, "price": 25000},
+    "vip5bulan": {"days": 180, "price": 145000}
+}
+
+def extract_payment(data):
+    """Ambil (user_id, package_id) dari payload Trakteer, user_id None jika tidak ditemukan"""
+    # Cari user_id dari supporter_message (fallback jika email tidak ada)
+    supporter_message = data.get("supporter_message", "")
+    user_id = None
+
+    # Method 1: Cari dari "?utm_source=USER_ID" di supporter_message
+    if "utm_source=" in supporter_message:
+        user_id = supporter_message.split("utm_source=")[1].split("&")[0].split("?")[0]
+
+    # Method 2: Cari pola email di supporter_message
+    if not user_id and "@vipbot.com" in supporter_message:
+        user_id = supporter_message.split("@vipbot.com")[0][-10:]  # Ambil 10 digit terakhir
+
+    if not user_id or not user_id.isdigit():
+        user_id = None
+
+    # Proses package
+    package_id = "vip1hari"  # Default, sesuaikan dengan quantity jika perlu
+    quantity = int(data.get("quantity", 0))
+
+    if quantity == 2:
+        package_id = "vip1hari"
+    elif quantity == 5:
+        package_id = "vip3hari"
+    elif quantity == 10:
+        package_id = "vip7hari"
+    elif quantity == 30:
+        package_id = "vip30hari"
+    elif quantity == 150:
+        package_id = "vip6bulan"
+    # ... tambahkan mapping lainnya sesuai kebutuhan
+
+    return user_id, package_id
+
+def payment_txn_id(data):
+    """Kunci dedupe pembayaran: transaction id Trakteer, atau hash payload jika tidak ada"""
+    txn_id = data.get("transaction_id") or data.get("id")
+    if txn_id:
+        return str(txn_id)
+    return "sha256:" + hashlib.sha256(json.dumps(data, sort_keys=True).encode()).hexdigest()
+
+def vip_expiry_after(record, days, now):
+    """Expiry baru: diperpanjang dari expiry lama jika VIP masih aktif, selain itu dari sekarang"""
+    current = record.expiry_date if record.status == "vip" else None
+    start = current if current is not None and current >= now else now
+    return (start + timedelta(days=days)).strftime("%Y-%m-%d")
+
+# ===== LEDGER =====
+class PaymentLedger:
+    """Ledger pembayaran di SQLite dengan transaction id sebagai kunci dedupe"""
+
+    def __init__(self, path):
+        self.path = path
+        # Satu thread agar semua akses ke koneksi SQLite berurutan
+        self.executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix="payments")
+        self.conn = sqlite3.connect(path, check_same_thread=False, isolation_level=None)
+        self.conn.execute("PRAGMA journal_mode=WAL")
+        self.conn.executescript(PAYMENTS_SCHEMA)
+
+    async def run(self, func, *args):
+        """Jalankan operasi SQLite di thread khusus"""
+        loop = asyncio.get_running_loop()
+        return await loop.run_in_executor(self.executor, partial(func, *args))
+
+    def _execute(self, sql, params=()):
+        cursor = self.conn.execute(sql, params)
+        return cursor.rowcount, cursor.fetchall()
+
+    async def record(self, txn_id, user_id, package_id, payload=None):
+        """Catat pembayaran baru. False jika txn_id sudah pernah dicatat (replay)"""
+        rowcount, _ = await self.run(
+            self._execute,
+            "INSERT OR IGNORE INTO payments (txn_id, user_id, package_id, payload, created_at) "
+            "VALUES (?, ?, ?, ?, ?)",
+            (txn_id, str(user_id), package_id, json.dumps(payload) if payload is not None else None,
+             datetime.now().strftime("%Y-%m-%d %H:%M:%S"))
+        )
+        return rowcount == 1
+
+    async def get(self, txn_id):
+        _, rows = await self.run(
+            self._execute, f"SELECT {PAYMENT_COLUMNS} FROM payments WHERE txn_id = ?", (txn_id,)
+        )
+        return Payment(*rows[0]) if rows else None
+
+    async def pending(self, max_attempts=None, limit=None, before=None):
+        """Pembayaran yang belum diterapkan, urut dari yang paling lama"""
+        sql = f"SELECT {PAYMENT_COLUMNS} FROM payments WHERE status = 'pending'"
+        params = []
+        if max_attempts is not None:
+            sql += " AND attempts < ?"
+            params.append(max_attempts)
+        if before is not None:
+            sql += " AND created_at < ?"
+            params.append(before.strftime("%Y-%m-%d %H:%M:%S"))
+        sql += " ORDER BY created_at"
+        if limit is not None:
+            sql += " LIMIT ?"
+            params.append(limit)
+        _, rows = await self.run(self._execute, sql, tuple(params))
+        return [Payment(*row) for row in rows]
+
+    async def set_expiry(self, txn_id, vip_expiry):
+        """Simpan expiry hasil hitungan supaya retry menulis nilai yang sama"""
+        await self.run(
+            self._execute,
+            "UPDATE payments SET vip_expiry = ? WHERE txn_id = ?",
+            (vip_expiry, txn_id)
+        )
+
+    def _executemany(self, sql, seq):
+        with self.conn:
+            self.conn.execute("BEGIN")
+            self.conn.executemany(sql, seq)
+
+    async def mark_applied(self, *txn_ids):
+        applied_at = datetime.now().strftime("%Y-%m-%d %H:%M:%S")
+        await self.run(
+            self._executemany,
+            "UPDATE payments SET status = 'applied', error = NULL, applied_at = ? WHERE txn_id = ?",
+            [(applied_at, txn_id) for txn_id in txn_ids]
+        )
+
+    async def mark_attempt_failed(self, txn_id, error, final=False):
+        """Catat percobaan gagal; final=True berarti tidak akan dicoba lagi"""
+        await self.run(
+            self._execute,
+            "UPDATE payments SET attempts = attempts + 1, error = ?, status = ? WHERE txn_id = ?",
+            (str(error), "failed" if final else "pending", txn_id)
+        )
+
+# ===== PENERAPAN =====
+def _no_lock(key):
+    return nullcontext()
+
+async def apply_payment(storage, ledger, txn_id, packages, max_attempts=10, lock=None, on_applied=None, now=None):
+    """Terapkan satu pembayaran dari ledger, aman untuk di-retry.
+
+    lock(key): async context manager per user (lintas worker di bot), supaya
+    dua pembayaran user yang sama tidak menghitung expiry dari nilai lama
+    yang sama. on_applied(user_id): coroutine setelah tulisan masuk ke
+    storage, misal invalidasi cache di worker lain.
+    """
+    payment = await ledger.get(txn_id)
+    if payment is None:
+        return
+    async with (lock or _no_lock)(f"member:{payment.user_id}"):
+        # Penulisan pembayaran didahulukan di atas traffic user/background
+        with sheets_priority(PRIORITY_PAYMENT):
+            payment = await ledger.get(txn_id)
+            if payment is None or payment.status != "pending":
+                return  # Sudah diterapkan atau gagal permanen: replay tidak melakukan apa-apa
+
+            try:
+                package = packages.get(payment.package_id)
+                if not package:
+                    logger.error(f"Package {payment.package_id} not found!")
+                    await ledger.mark_attempt_failed(txn_id, "package not found", final=True)
+                    return
+
+                record = await storage.get_member(payment.user_id)
+                if record is None:
+                    logger.error(f"User {payment.user_id} not found in sheet")
+                    await ledger.mark_attempt_failed(txn_id, "user not found", final=True)
+                    return
+
+                # Expiry dihitung sekali dan disimpan, jadi retry menulis nilai yang sama
+                expiry_date = payment.vip_expiry
+                if expiry_date is None:
+                    expiry_date = vip_expiry_after(record, package['days'], now or datetime.now())
+                    await ledger.set_expiry(txn_id, expiry_date)
+
+                await storage.update_member(payment.user_id, status="vip", vip_expiry=expiry_date)
+                await storage.flush()
+                # Worker lain baru boleh membaca ulang setelah tulisan masuk ke storage
+                if on_applied is not None:
+                    await on_applied(payment.user_id)
+                await ledger.mark_applied(txn_id)
+                logger.info(f"VIP status updated for user {payment.user_id} until {expiry_date} ({txn_id})")
+            except Exception as e:
+                logger.error(f"Pembayaran {txn_id} gagal diterapkan: {e}")
+                await ledger.mark_attempt_failed(txn_id, e, final=payment.attempts + 1 >= max_attempts)
+
+# ===== REKONSILIASI =====
+async def reconcile_payments(storage, ledger, payments, packages, max_attempts=10, now=None):
+    """Terapkan banyak pembayaran sekaligus: satu snapshot member, satu penulisan batch.
+
+    Pembayaran user yang sama ditumpuk (expiry diperpanjang berurutan).
+    Return (jumlah diterapkan, jumlah gagal permanen).
+    """
+    now = now or datetime.now()
+    members = await storage.member_snapshot()
+    changed = {}  # user_id -> MemberRecord setelah pembayaran
+    applied = []
+    failed = 0
+
+    for payment in sorted(payments, key=lambda p: p.created_at):
+        user_id = str(payment.user_id)
+        package = packages.get(payment.package_id)
+        record = changed.get(user_id) or members.get(user_id)
+        if not package or record is None:
+            error = "package not found" if not package else "user not found"
+            logger.error(f"Pembayaran {payment.txn_id} gagal: {error}")
+            await ledger.mark_attempt_failed(payment.txn_id, error, final=True)
+            failed += 1
+            continue
+
+        # Percobaan sebelumnya sudah sempat menulis expiry ini ke storage
+        if payment.vip_expiry and record.status == "vip" and record.vip_expiry >= payment.vip_expiry:
+            applied.append(payment)
+            continue
+
+        expiry_date = vip_expiry_after(record, package['days'], now)
+        await ledger.set_expiry(payment.txn_id, expiry_date)
+        changed[user_id] = replace(record, status="vip", vip_expiry=expiry_date)
+        applied.append(payment)
+
+    try:
+        if changed:
+            await storage.update_members({
+                user_id: {"status": "vip", "vip_expiry": record.vip_expiry}
+                for user_id, record in changed.items()
+            })
+    except Exception as e:
+        logger.error(f"Rekonsiliasi {len(applied)} pembayaran gagal ditulis: {e}")
+        for payment in applied:
+            await ledger.mark_attempt_failed(payment.txn_id, e, final=payment.attempts + 1 >= max_attempts)
+        raise
+
+    if applied:
+        await ledger.mark_applied(*(payment.txn_id for payment in applied))
+    logger.info(f"Rekonsiliasi: {len(applied)} pembayaran diterapkan ({len(changed)} member), {failed} gagal")
+    return len(applied), failed
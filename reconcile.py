@@ -0,0 +1,92 @@
+import sys
+import csv
+import asyncio
+import argparse
+from main import (
+    logger, PAYMENT_MAX_ATTEMPTS, SHARED_STATE_DB,
+    create_storage, get_payment_ledger, member_locks, fresh_pending, invalidate_member
+)
+from payments import TRAKTEER_PACKAGE_MAPPING, extract_payment, payment_txn_id, reconcile_payments
+from sheets_scheduler import sheets_priority, PRIORITY_PAYMENT
+
+# Nama kolom export CSV Trakteer -> nama field payload webhook
+CSV_FIELDS = {
+    "id": "transaction_id",
+    "transaction_id": "transaction_id",
+    "pesan": "supporter_message",
+    "supporter_message": "supporter_message",
+    "jumlah": "quantity",
+    "quantity": "quantity",
+}
+
+def read_trakteer_csv(path):
+    """Baca export CSV Trakteer menjadi list payload seperti di webhook"""
+    with open(path, newline="", encoding="utf-8-sig") as f:
+        for row in csv.DictReader(f):
+            data = {}
+            for name, value in row.items():
+                key = CSV_FIELDS.get((name or "").strip().lower().replace(" ", "_"))
+                if key:
+                    data[key] = value.strip()
+            yield data
+
+async def reconcile_csv(path):
+    """Catat semua baris CSV ke ledger lalu terapkan yang masih pending sekaligus"""
+    ledger = get_payment_ledger()
+    txn_ids = []
+    for data in read_trakteer_csv(path):
+        user_id, package_id = extract_payment(data)
+        if not user_id:
+            logger.warning(f"Baris tanpa user_id dilewati: {data}")
+            continue
+        txn_id = payment_txn_id(data)
+        await ledger.record(txn_id, user_id, package_id, data)
+        txn_ids.append(txn_id)
+
+    # Baris duplikat di CSV cukup diterapkan sekali
+    payments = [payment for payment in [await ledger.get(txn_id) for txn_id in dict.fromkeys(txn_ids)]
+                if payment.status == "pending"]
+    if not payments:
+        logger.info("Tidak ada pembayaran baru untuk diterapkan")
+        return 0, 0
+
+    user_ids = list(dict.fromkeys(payment.user_id for payment in payments))
+    storage = await asyncio.to_thread(create_storage)
+    await storage.start()
+    try:
+        # Bot yang sedang jalan bisa menerapkan pembayaran yang sama lewat webhook
+        async with member_locks(user_ids):
+            try:
+                payments = await fresh_pending(ledger, payments)
+                with sheets_priority(PRIORITY_PAYMENT):
+                    return await reconcile_payments(
+                        storage, ledger, payments, TRAKTEER_PACKAGE_MAPPING, PAYMENT_MAX_ATTEMPTS
+                    )
+            finally:
+                # Cache member dan VipIndex bot yang sedang jalan dibaca ulang dari sheet
+                for user_id in user_ids:
+                    await invalidate_member(user_id)
+    finally:
+        await storage.stop()
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description="Rekonsiliasi massal pembayaran Trakteer dari export CSV")
+    parser.add_argument("csv_path", help="File export CSV Trakteer")
+    parser.add_argument(
+        "--without-shared-state", action="store_true",
+        help="Jalankan tanpa SHARED_STATE_DB, hanya jika bot sedang tidak berjalan"
+    )
+    args = parser.parse_args()
+    # Tanpa state bersama, lock dan invalidasi member hanya berlaku di proses ini
+    if not SHARED_STATE_DB:
+        if not args.without_shared_state:
+            parser.error(
+                "SHARED_STATE_DB belum diisi: bot yang sedang berjalan tidak ikut terkunci "
+                "dan tidak tahu member yang diubah. Isi SHARED_STATE_DB yang sama dengan bot, "
+                "atau hentikan bot lalu pakai --without-shared-state"
+            )
+        logger.warning("⚠️ Berjalan tanpa SHARED_STATE_DB: pastikan bot sedang tidak berjalan")
+
+    applied, failed = asyncio.run(reconcile_csv(args.csv_path))
+    print(f"{applied} pembayaran diterapkan, {failed} gagal")
+    sys.exit(1 if failed else 0)
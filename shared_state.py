@@ -0,0 +1,212 @@
+import os
+import time
+import uuid
+import socket
+import asyncio
+import logging
+import sqlite3
+from contextlib import asynccontextmanager
+from functools import partial
+from concurrent.futures import ThreadPoolExecutor
+
+logger = logging.getLogger(__name__)
+
+SHARED_SCHEMA = """
+CREATE TABLE IF NOT EXISTS quotas (
+    user_id TEXT NOT NULL,
+    day TEXT NOT NULL,
+    remaining INTEGER NOT NULL,
+    PRIMARY KEY (user_id, day)
+);
+CREATE TABLE IF NOT EXISTS dedupe_keys (
+    key TEXT PRIMARY KEY,
+    expires_at REAL NOT NULL
+);
+CREATE TABLE IF NOT EXISTS locks (
+    key TEXT PRIMARY KEY,
+    token TEXT NOT NULL,
+    expires_at REAL NOT NULL
+);
+CREATE TABLE IF NOT EXISTS member_invalidations (
+    id INTEGER PRIMARY KEY AUTOINCREMENT,
+    user_id TEXT NOT NULL,
+    source TEXT NOT NULL,
+    created_at REAL NOT NULL
+);
+"""
+
+class LockTimeout(Exception):
+    """Lock bersama tidak didapat dalam batas waktu"""
+
+class SharedState:
+    """State bersama antar worker uvicorn / proses bot lewat satu file SQLite (WAL).
+
+    Menyimpan kuota harian, dedupe key, lock per key (lease dengan TTL yang
+    diperpanjang selama dipegang) dan antrian invalidasi member. Semua proses
+    yang memakai file yang sama melihat state yang sama; waktu memakai
+    time.time() karena dibandingkan antar proses.
+    """
+
+    def __init__(self, path, lock_ttl=30, dedupe_ttl=86400, invalidation_ttl=3600):
+        self.path = path
+        self.lock_ttl = lock_ttl
+        self.dedupe_ttl = dedupe_ttl
+        self.invalidation_ttl = invalidation_ttl
+        self.process_id = f"{socket.gethostname()}:{os.getpid()}"
+
+        # Satu thread agar semua akses ke koneksi SQLite berurutan
+        self.executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix="shared-state")
+        self.conn = sqlite3.connect(path, timeout=10, check_same_thread=False, isolation_level=None)
+        self.conn.execute("PRAGMA journal_mode=WAL")
+        self.conn.execute("PRAGMA synchronous=NORMAL")
+        self.conn.executescript(SHARED_SCHEMA)
+        # Invalidasi lama tidak relevan untuk proses yang baru start
+        self.last_invalidation = self.conn.execute(
+            "SELECT COALESCE(MAX(id), 0) FROM member_invalidations"
+        ).fetchone()[0]
+        logger.info(f"✅ State bersama dibuka: {path} ({self.process_id})")
+
+    async def run(self, func, *args):
+        """Jalankan operasi SQLite di thread khusus"""
+        loop = asyncio.get_running_loop()
+        return await loop.run_in_executor(self.executor, partial(func, *args))
+
+    def _execute(self, sql, params=()):
+        return self.conn.execute(sql, params).fetchall()
+
+    def _changes(self, sql, params=()):
+        """Jumlah baris yang berubah oleh satu statement"""
+        return self.conn.execute(sql, params).rowcount
+
+    # ----- Kuota -----
+    def _take_quota(self, user_id, day, initial):
+        with self.conn:
+            self.conn.execute("BEGIN IMMEDIATE")
+            self.conn.execute(
+                "INSERT OR IGNORE INTO quotas (user_id, day, remaining) VALUES (?, ?, ?)",
+                (user_id, day, initial)
+            )
+            return self.conn.execute(
+                "UPDATE quotas SET remaining = remaining - 1 "
+                "WHERE user_id = ? AND day = ? AND remaining > 0 RETURNING remaining",
+                (user_id, day)
+            ).fetchall()
+
+    async def take_quota(self, user_id, day, initial):
+        """Kurangi kuota `day` secara atomik untuk semua proses.
+
+        initial dipakai oleh proses pertama yang menyentuh user hari itu
+        (sisa kuota menurut storage). Return sisa kuota, atau None jika habis.
+        """
+        rows = await self.run(self._take_quota, str(user_id), day, initial)
+        return rows[0][0] if rows else None
+
+    # ----- Dedupe -----
+    async def claim(self, key, ttl=None):
+        """True jika key ini baru pertama kali diklaim (atau klaim lamanya sudah kedaluwarsa)"""
+        now = time.time()
+        changed = await self.run(
+            self._changes,
+            "INSERT INTO dedupe_keys (key, expires_at) VALUES (?, ?) "
+            "ON CONFLICT (key) DO UPDATE SET expires_at = excluded.expires_at "
+            "WHERE dedupe_keys.expires_at < ?",
+            (key, now + (ttl or self.dedupe_ttl), now)
+        )
+        return changed == 1
+
+    # ----- Lock -----
+    async def acquire(self, key, token, ttl=None):
+        """Coba ambil lease lock sekali, True jika berhasil"""
+        now = time.time()
+        changed = await self.run(
+            self._changes,
+            "INSERT INTO locks (key, token, expires_at) VALUES (?, ?, ?) "
+            "ON CONFLICT (key) DO UPDATE SET token = excluded.token, expires_at = excluded.expires_at "
+            "WHERE locks.expires_at < ?",
+            (key, token, now + (ttl or self.lock_ttl), now)
+        )
+        return changed == 1
+
+    async def renew(self, key, token, ttl=None):
+        changed = await self.run(
+            self._changes,
+            "UPDATE locks SET expires_at = ? WHERE key = ? AND token = ?",
+            (time.time() + (ttl or self.lock_ttl), key, token)
+        )
+        return changed == 1
+
+    async def release(self, key, token):
+        await self.run(self._changes, "DELETE FROM locks WHERE key = ? AND token = ?", (key, token))
+
+    async def _keep_lease(self, key, token, ttl):
+        while True:
+            await asyncio.sleep(ttl / 3)
+            if not await self.renew(key, token, ttl):
+                logger.warning(f"Lease lock {key} hilang sebelum dilepas")
+                return
+
+    @asynccontextmanager
+    async def lock(self, key, ttl=None, wait=True, timeout=None, poll_interval=0.05):
+        """Lock bersama per key, misal per user atau per job.
+
+        wait=False: yield False tanpa menunggu jika lock dipegang pihak lain.
+        Lease diperpanjang di background selama blok berjalan, jadi proses
+        yang mati hanya menahan lock paling lama `ttl` detik.
+        """
+        ttl = ttl or self.lock_ttl
+        token = f"{self.process_id}:{uuid.uuid4().hex}"
+        deadline = None if timeout is None else time.monotonic() + timeout
+        while not await self.acquire(key, token, ttl):
+            if not wait:
+                yield False
+                return
+            if deadline is not None and time.monotonic() >= deadline:
+                raise LockTimeout(f"Lock {key} tidak didapat dalam {timeout} detik")
+            await asyncio.sleep(poll_interval)
+
+        keeper = asyncio.get_running_loop().create_task(self._keep_lease(key, token, ttl))
+        try:
+            yield True
+        finally:
+            keeper.cancel()
+            try:
+                await keeper
+            except asyncio.CancelledError:
+                pass
+            await self.release(key, token)
+
+    # ----- Invalidasi member -----
+    async def publish_invalidation(self, user_id):
+        """Beri tahu semua proses bahwa data member ini berubah"""
+        await self.run(
+            self._changes,
+            "INSERT INTO member_invalidations (user_id, source, created_at) VALUES (?, ?, ?)",
+            (str(user_id), self.process_id, time.time())
+        )
+
+    async def fetch_invalidations(self):
+        """telegram_id yang diinvalidasi proses lain sejak pemanggilan terakhir"""
+        rows = await self.run(
+            self._execute,
+            "SELECT id, user_id, source FROM member_invalidations WHERE id > ? ORDER BY id",
+            (self.last_invalidation,)
+        )
+        if not rows:
+            return []
+        self.last_invalidation = rows[-1][0]
+        return list(dict.fromkeys(user_id for _, user_id, source in rows if source != self.process_id))
+
+    # ----- Perawatan -----
+    def _prune(self, now, today):
+        with self.conn:
+            self.conn.execute("BEGIN")
+            self.conn.execute("DELETE FROM dedupe_keys WHERE expires_at < ?", (now,))
+            self.conn.execute("DELETE FROM locks WHERE expires_at < ?", (now,))
+            self.conn.execute("DELETE FROM quotas WHERE day < ?", (today,))
+            self.conn.execute(
+                "DELETE FROM member_invalidations WHERE created_at < ?", (now - self.invalidation_ttl,)
+            )
+
+    async def prune(self, today):
+        """Hapus dedupe key, lock kedaluwarsa dan kuota hari sebelumnya"""
+        await self.run(self._prune, time.time(), today)
@@ -0,0 +1,128 @@
+import hashlib
+
+# Aksi untuk satu baris yang berubah (lihat classify_row)
+SKIP = "skip"
+PUT = "put"
+RELOAD = "reload"
+
+def _trim(rows):
+    """Buang sel kosong di kanan tiap baris dan baris kosong di akhir.
+
+    API Sheets memotong keduanya secara berbeda untuk range terbatas dan
+    range terbuka, jadi fingerprint dihitung dari bentuk yang sudah dipotong.
+    """
+    trimmed = []
+    for row in rows:
+        row = [str(value) for value in row]
+        while row and row[-1] == "":
+            row.pop()
+        trimmed.append(row)
+    while trimmed and not trimmed[-1]:
+        trimmed.pop()
+    return trimmed
+
+def fingerprint(rows):
+    """Hash isi sekumpulan baris (8 byte cukup untuk mendeteksi perubahan)"""
+    digest = hashlib.blake2b(digest_size=8)
+    for row in _trim(rows):
+        digest.update("\x1f".join(row).encode("utf-8"))
+        digest.update(b"\x1e")
+    return digest.digest()
+
+def classify_row(row, key, owner, known_row):
+    """Tentukan apa yang dilakukan pada satu baris yang isinya berubah.
+
+    key = id di baris ini sekarang ("" jika kosong), owner = id yang menurut
+    index menempati baris ini (None jika tidak ada), known_row = baris yang
+    menurut index dimiliki key (None jika key belum dikenal). Baris yang
+    bergeser atau id yang diganti tidak bisa diterapkan per baris: index
+    harus dimuat ulang penuh.
+    """
+    if owner is not None:
+        return PUT if key == owner else RELOAD
+    if not key:
+        return SKIP
+    if known_row is None:
+        return PUT
+    # Sama seperti load penuh: baris pertama per id yang menang
+    return SKIP if known_row < row else RELOAD
+
+class SheetSync:
+    """Status sinkronisasi inkremental satu worksheet.
+
+    Menyimpan jumlah baris data terakhir dan fingerprint per blok
+    block_size baris. Tiap sync hanya membaca dari blok terakhir yang belum
+    penuh sampai akhir sheet, ditambah verify_blocks blok penuh secara
+    bergiliran, dalam satu batch_get. Hanya blok yang fingerprint-nya
+    berubah dan baris baru yang diterapkan ke index, jadi biaya sync
+    mengikuti jumlah perubahan, bukan ukuran sheet.
+    """
+
+    def __init__(self, block_size=500, verify_blocks=2, first_row=2):
+        self.block_size = block_size
+        self.verify_blocks = verify_blocks
+        self.first_row = first_row  # Baris sheet pertama setelah header
+        self.row_count = 0  # Baris data yang sudah diterapkan ke index
+        self.fingerprints = []  # Fingerprint per blok, blok terakhir boleh belum penuh
+        self.cursor = 0  # Blok penuh berikutnya yang diverifikasi
+
+    def reset(self, rows):
+        """Mulai ulang dari hasil load penuh (rows = semua baris data tanpa header)"""
+        size = self.block_size
+        self.row_count = len(_trim(rows))
+        self.fingerprints = [fingerprint(rows[start:start + size]) for start in range(0, self.row_count, size)]
+        self.cursor = 0
+
+    def block_start(self, block):
+        """Nomor baris sheet pertama dari blok"""
+        return self.first_row + block * self.block_size
+
+    def plan(self):
+        """(blok tail, blok penuh yang diverifikasi kali ini)"""
+        tail = self.row_count // self.block_size
+        count = min(self.verify_blocks, tail)
+        verify = [(self.cursor + offset) % tail for offset in range(count)]
+        return tail, verify
+
+    def ranges(self, last_column):
+        """Range A1 untuk batch_get: tail (terbuka sampai akhir sheet) lalu blok verifikasi"""
+        tail, verify = self.plan()
+        ranges = [f"A{self.block_start(tail)}:{last_column}"]
+        for block in verify:
+            start = self.block_start(block)
+            ranges.append(f"A{start}:{last_column}{start + self.block_size - 1}")
+        return ranges
+
+    def apply(self, results):
+        """Bandingkan hasil batch_get (urutan sama dengan ranges()) dengan fingerprint lama.
+
+        Return list (nomor baris pertama, baris) yang perlu diterapkan ke
+        index: blok lama yang berubah dan baris baru. None jika sheet
+        menyusut (baris dihapus) sehingga index harus dimuat ulang penuh.
+        """
+        size = self.block_size
+        tail, verify = self.plan()
+        tail_rows = _trim(results[0])
+        known = self.row_count - tail * size  # Baris lama di blok tail
+        if len(tail_rows) < known:
+            return None
+
+        changes = []
+        for block, rows in zip(verify, results[1:]):
+            rows = list(rows)[:size]
+            new = fingerprint(rows)
+            if new != self.fingerprints[block]:
+                self.fingerprints[block] = new
+                changes.append((self.block_start(block), rows))
+        if verify:
+            self.cursor = (verify[-1] + 1) % tail
+
+        if known and fingerprint(tail_rows[:known]) != self.fingerprints[tail]:
+            changes.append((self.block_start(tail), tail_rows[:known]))
+        if len(tail_rows) > known:
+            changes.append((self.block_start(tail) + known, tail_rows[known:]))
+
+        del self.fingerprints[tail:]
+        self.fingerprints += [fingerprint(tail_rows[start:start + size]) for start in range(0, len(tail_rows), size)]
+        self.row_count = tail * size + len(tail_rows)
+        return changes
@@ -0,0 +1,151 @@
+import time
+import heapq
+import asyncio
+import logging
+import itertools
+from contextlib import contextmanager
+from contextvars import ContextVar
+
+import metrics
+
+logger = logging.getLogger(__name__)
+
+# Prioritas request Sheets, angka kecil dilayani lebih dulu
+PRIORITY_PAYMENT = 0
+PRIORITY_USER = 1
+PRIORITY_BACKGROUND = 2
+PRIORITY_NAMES = {PRIORITY_PAYMENT: "payment", PRIORITY_USER: "user", PRIORITY_BACKGROUND: "background"}
+
+# Prioritas untuk request Sheets dari task yang sedang berjalan (default: user)
+_priority = ContextVar("sheets_priority", default=PRIORITY_USER)
+
+@contextmanager
+def sheets_priority(priority):
+    """Semua request Sheets di dalam blok ini memakai prioritas tersebut"""
+    token = _priority.set(priority)
+    try:
+        yield
+    finally:
+        _priority.reset(token)
+
+def current_priority():
+    return _priority.get()
+
+class SheetsOverloaded(Exception):
+    """Request ditolak/ditunda karena kuota Sheets sedang habis"""
+
+class TokenBucket:
+    """Token bucket sederhana: rate_per_minute token, maksimal burst token tersimpan"""
+
+    def __init__(self, rate_per_minute, burst=None):
+        self.rate = rate_per_minute / 60.0
+        self.capacity = burst or max(1, rate_per_minute // 6)  # Default: jatah ~10 detik
+        self.tokens = float(self.capacity)
+        self.updated = time.monotonic()
+        self.paused_until = 0.0
+
+    def _refill(self, now):
+        self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+
+    def delay(self):
+        """Detik sampai satu token tersedia (0 jika tersedia sekarang)"""
+        now = time.monotonic()
+        self._refill(now)
+        if now < self.paused_until:
+            return self.paused_until - now
+        if self.tokens >= 1:
+            return 0.0
+        return (1 - self.tokens) / self.rate
+
+    def take(self):
+        self.tokens -= 1
+
+    def pause(self, seconds):
+        """Kosongkan bucket dan tahan semua request selama `seconds` (setelah 429)"""
+        self.tokens = 0.0
+        self.paused_until = max(self.paused_until, time.monotonic() + seconds)
+
+class SheetsScheduler:
+    """Pintu masuk tunggal semua request Sheets: kuota read/write + antrian prioritas.
+
+    Request payment tidak pernah ditolak. Request user/background yang
+    perkiraan waktu tunggunya melebihi max_wait langsung ditolak dengan
+    SheetsOverloaded, supaya burst tidak berubah menjadi badai 429.
+    """
+
+    def __init__(self, reads_per_minute=60, writes_per_minute=60, user_max_wait=10, background_max_wait=30):
+        self.buckets = {
+            "read": TokenBucket(reads_per_minute),
+            "write": TokenBucket(writes_per_minute),
+        }
+        self.max_wait = {
+            PRIORITY_PAYMENT: None,
+            PRIORITY_USER: user_max_wait,
+            PRIORITY_BACKGROUND: background_max_wait,
+        }
+        self.waiters = {kind: [] for kind in self.buckets}  # heap (prioritas, urutan, future)
+        self._pumps = {}
+        self._seq = itertools.count()
+
+    def estimated_wait(self, kind, priority):
+        """Perkiraan waktu tunggu: token berikutnya + antrian dengan prioritas sama/lebih tinggi"""
+        bucket = self.buckets[kind]
+        ahead = sum(1 for p, _, future in self.waiters[kind] if p <= priority and not future.done())
+        return bucket.delay() + ahead / bucket.rate
+
+    async def acquire(self, kind, priority=None):
+        """Tunggu satu token `kind` ("read"/"write") sesuai prioritas"""
+        priority = current_priority() if priority is None else priority
+        name = PRIORITY_NAMES.get(priority, str(priority))
+        max_wait = self.max_wait.get(priority)
+        bucket = self.buckets[kind]
+        queue = self.waiters[kind]
+
+        # Jalur cepat: token tersedia dan tidak ada yang antre
+        if not queue and bucket.delay() == 0:
+            bucket.take()
+            metrics.SHEETS_QUEUE_WAIT.observe(0, priority=name)
+            return
+
+        if max_wait is not None and self.estimated_wait(kind, priority) > max_wait:
+            metrics.SHEETS_SHED.inc(priority=name)
+            raise SheetsOverloaded(f"Kuota Sheets ({kind}) penuh, request {name} ditunda")
+
+        future = asyncio.get_running_loop().create_future()
+        heapq.heappush(queue, (priority, next(self._seq), future))
+        self._ensure_pump(kind)
+        started = time.monotonic()
+        try:
+            await asyncio.wait_for(future, timeout=max_wait)
+        except asyncio.TimeoutError:
+            metrics.SHEETS_SHED.inc(priority=name)
+            raise SheetsOverloaded(f"Menunggu kuota Sheets ({kind}) lebih dari {max_wait} detik")
+        metrics.SHEETS_QUEUE_WAIT.observe(time.monotonic() - started, priority=name)
+
+    def _ensure_pump(self, kind):
+        pump = self._pumps.get(kind)
+        if pump is None or pump.done():
+            self._pumps[kind] = asyncio.get_running_loop().create_task(self._pump(kind))
+
+    async def _pump(self, kind):
+        """Bagikan token ke antrian, prioritas tertinggi lebih dulu"""
+        bucket = self.buckets[kind]
+        queue = self.waiters[kind]
+        while queue:
+            if queue[0][2].done():  # Sudah timeout/batal
+                heapq.heappop(queue)
+                continue
+            delay = bucket.delay()
+            if delay > 0:
+                await asyncio.sleep(delay)
+                continue
+            _, _, future = heapq.heappop(queue)
+            if not future.done():
+                bucket.take()
+                future.set_result(None)
+
+    def penalize(self, kind, seconds):
+        """Sheets membalas 429: tahan semua request jenis ini, bukan retry sendiri-sendiri"""
+        logger.warning(f"Kuota Sheets ({kind}) terlampaui, semua request ditahan {seconds:.1f} detik")
+        self.buckets[kind].pause(seconds)
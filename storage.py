@@ -0,0 +1,1830 @@
+import re
+import csv
+import time
+import heapq
+import logging
+import asyncio
+import sqlite3
+import threading
+from contextlib import asynccontextmanager, contextmanager
+from functools import partial
+from concurrent.futures import ThreadPoolExecutor
+from array import array
+from bisect import bisect_left
+from dataclasses import dataclass, field, replace
+from datetime import date, datetime, timedelta
+from typing import Optional
+
+import metrics
+from sheets_scheduler import SheetsScheduler, sheets_priority, PRIORITY_BACKGROUND
+from circuit_breaker import CircuitBreaker
+from sheet_sync import SheetSync, classify_row, PUT, RELOAD
+
+logger = logging.getLogger(__name__)
+
+TOKEN_REFRESH_MARGIN = timedelta(minutes=5)  # Token OAuth diperbarui sebelum sisa umurnya segini
+SHEETS_SCOPE = ["https://spreadsheets.google.com/feeds", "https://www.googleapis.com/auth/drive"]
+
+# Kolom sheet members (1-based) -> nama field MemberRecord
+MEMBER_COLUMNS = {
+    1: "telegram_id",
+    2: "username",
+    3: "status",
+    4: "vip_expiry",
+    5: "last_updated",
+    6: "quota"
+}
+MEMBER_FIELDS = {name: col for col, name in MEMBER_COLUMNS.items()}
+DAILY_QUOTA = 5  # Tontonan gratis per hari
+VIP_FIELDS = {"status", "vip_expiry"}  # Field yang mengubah isi VipIndex
+
+# ===== MODEL =====
+@dataclass
+class MemberRecord:
+    """Satu member (baris A-F sheet members / baris tabel members SQLite)"""
+    telegram_id: str
+    username: str = ""
+    status: str = "non-vip"
+    vip_expiry: str = ""
+    last_updated: str = ""
+    quota: int = 0
+    row: Optional[int] = None  # Nomor baris di sheet, None untuk backend lain
+    fetched_at: float = field(default_factory=time.monotonic)
+    stale: bool = False  # True jika dilayani dari cache lama karena Sheets tidak tersedia
+
+    @classmethod
+    def from_values(cls, row, values):
+        """Parse nilai mentah satu baris sheet"""
+        values = [str(v) for v in values] + [""] * (6 - len(values))
+        try:
+            quota = int(values[5] or 0)
+        except (TypeError, ValueError):
+            quota = 0
+        return cls(
+            telegram_id=values[0].strip(),
+            username=values[1],
+            status=values[2],
+            vip_expiry=values[3],
+            last_updated=values[4],
+            quota=quota,
+            row=row
+        )
+
+    def to_values(self):
+        """Nilai kolom A-F untuk ditulis ke sheet"""
+        return [self.telegram_id, self.username, self.status, self.vip_expiry, self.last_updated, self.quota]
+
+    @property
+    def expiry_date(self):
+        """Tanggal vip_expiry sebagai datetime, None jika kosong/tidak valid"""
+        try:
+            return datetime.strptime(self.vip_expiry, "%Y-%m-%d")
+        except (TypeError, ValueError):
+            return None
+
+    def quota_stale(self, today=None):
+        """True jika kuota tersimpan berasal dari hari sebelumnya"""
+        try:
+            last_date = datetime.strptime(self.last_updated, "%Y-%m-%d %H:%M:%S").date()
+        except (TypeError, ValueError):
+            return False
+        return last_date < (today or datetime.now().date())
+
+    def quota_today(self, today=None):
+        """Kuota efektif hari ini, tanpa perlu menulis reset ke storage"""
+        return DAILY_QUOTA if self.quota_stale(today) else self.quota
+
+    def is_vip(self):
+        expiry_date = self.expiry_date
+        return self.status == "vip" and expiry_date is not None and expiry_date >= datetime.now()
+
+def _parse_msg_id(value):
+    """Parse message ID dari sheet, None jika kosong/tidak valid"""
+    try:
+        return int(value)
+    except (TypeError, ValueError):
+        return None
+
+def film_entry(record):
+    """Bentuk entry katalog dari satu record sheet film_links"""
+    return {
+        'code': str(record.get('code', '')),
+        'title': record.get('title', ''),
+        'free_msg_id': _parse_msg_id(record.get('free_msg_id')),
+        'vip_msg_id': _parse_msg_id(record.get('vip_msg_id')),
+        'is_part2_vip': record.get('is_part2_vip', 'TRUE') == 'TRUE',
+        'free_link': record.get('free_link'),
+        'vip_link': record.get('vip_link'),
+    }
+
+def read_films_csv(path):
+    """Katalog film dari file CSV dengan header yang sama seperti sheet film_links"""
+    films = {}
+    with open(path, newline="", encoding="utf-8-sig") as f:
+        for record in csv.DictReader(f):
+            entry = film_entry(record)
+            if entry['code'] and entry['code'] not in films:
+                films[entry['code']] = entry
+    return list(films.values())
+
+class KeyedLocks:
+    """asyncio.Lock per key (misal per user), dibuang lagi saat tidak dipakai"""
+
+    def __init__(self):
+        self._locks = {}  # key -> [lock, jumlah pemakai]
+
+    @asynccontextmanager
+    async def hold(self, key):
+        entry = self._locks.setdefault(key, [asyncio.Lock(), 0])
+        entry[1] += 1
+        try:
+            async with entry[0]:
+                yield
+        finally:
+            entry[1] -= 1
+            if entry[1] == 0:
+                del self._locks[key]
+
+class VipIndex:
+    """Member VIP terurut menurut tanggal expiry, disimpan di memori.
+
+    `expiries` menjawab "apakah user ini VIP sekarang" tanpa parse cell,
+    heap (expiry, telegram_id) membuat sweeper dan pengingat hanya menyentuh
+    user yang expiry-nya memang sudah/akan lewat. Entry heap yang basi
+    (expiry user sudah berubah) dilewati saat dibaca.
+    """
+
+    def __init__(self):
+        self.expiries = {}  # telegram_id (str) -> datetime expiry
+        self.heap = []  # (expiry, telegram_id)
+
+    def __len__(self):
+        return len(self.expiries)
+
+    def rebuild(self, records):
+        """Bangun ulang dari semua record (O(n), hanya saat index member dimuat)"""
+        self.expiries = {}
+        for record in records:
+            expiry = record.expiry_date if record.status == "vip" else None
+            if expiry is not None:
+                self.expiries[record.telegram_id] = expiry
+        self.heap = [(expiry, user_id) for user_id, expiry in self.expiries.items()]
+        heapq.heapify(self.heap)
+
+    def update(self, record):
+        """Ikuti perubahan status/vip_expiry satu record"""
+        expiry = record.expiry_date if record.status == "vip" else None
+        self.set(record.telegram_id, expiry)
+
+    def set(self, user_id, expiry):
+        user_id = str(user_id)
+        if expiry is None:
+            self.expiries.pop(user_id, None)
+            return
+        if self.expiries.get(user_id) == expiry:
+            return
+        self.expiries[user_id] = expiry
+        heapq.heappush(self.heap, (expiry, user_id))
+        if len(self.heap) > 2 * len(self.expiries) + 64:
+            # Terlalu banyak entry basi: padatkan
+            self.heap = [(expiry, user_id) for user_id, expiry in self.expiries.items()]
+            heapq.heapify(self.heap)
+
+    def is_vip(self, user_id, now):
+        expiry = self.expiries.get(str(user_id))
+        return expiry is not None and expiry >= now
+
+    def pop_expired(self, now):
+        """Keluarkan semua VIP yang expiry-nya sudah lewat, return list (telegram_id, expiry)"""
+        expired = []
+        while self.heap and self.heap[0][0] < now:
+            expiry, user_id = heapq.heappop(self.heap)
+            if self.expiries.get(user_id) == expiry:
+                del self.expiries[user_id]
+                expired.append((user_id, expiry))
+        return expired
+
+    def expiring_between(self, start, end):
+        """telegram_id VIP dengan start <= expiry < end.
+
+        Hanya menelusuri bagian heap yang lebih kecil dari end, jadi biayanya
+        sebanding jumlah user yang habis sebelum end, bukan jumlah VIP.
+        """
+        result = []
+        stack = [0] if self.heap else []
+        while stack:
+            i = stack.pop()
+            expiry, user_id = self.heap[i]
+            if expiry >= end:
+                continue
+            if expiry >= start and self.expiries.get(user_id) == expiry:
+                result.append(user_id)
+            stack.extend(child for child in (2 * i + 1, 2 * i + 2) if child < len(self.heap))
+        return result
+
+class VipStatusCache:
+    """Cache hasil cek VIP per user untuk gating Part 2 / vip_episode.
+
+    Jawaban VIP berlaku sampai expiry user, jawaban non-VIP hanya
+    selama negative_ttl detik supaya upgrade manual di sheet tetap terlihat.
+    Pembayaran yang diterapkan wajib memanggil invalidate().
+    """
+
+    def __init__(self, negative_ttl=60, max_entries=100000):
+        self.negative_ttl = negative_ttl
+        self.max_entries = max_entries
+        self.entries = {}  # telegram_id (str) -> (is_vip, berlaku sampai: datetime)
+
+    def get(self, user_id, now):
+        """True/False dari cache, None jika tidak ada atau sudah kedaluwarsa"""
+        entry = self.entries.get(str(user_id))
+        if entry is None or now > entry[1]:
+            return None
+        return entry[0]
+
+    def put(self, user_id, is_vip, now, expiry=None):
+        if len(self.entries) >= self.max_entries:
+            self.entries = {key: entry for key, entry in self.entries.items() if now <= entry[1]}
+        until = expiry if is_vip else now + timedelta(seconds=self.negative_ttl)
+        self.entries[str(user_id)] = (is_vip, until)
+
+    def invalidate(self, user_id=None):
+        """Buang cache satu user, atau semua user jika user_id None"""
+        if user_id is None:
+            self.entries.clear()
+        else:
+            self.entries.pop(str(user_id), None)
+
+class MemberTable:
+    """Index member resident dalam bentuk kolom array, bukan satu objek per member.
+
+    Kolom tetap ~40 byte per member (id int64, status uint8, expiry sebagai
+    nomor hari, last_updated sebagai detik, kuota uint8) + username UTF-8
+    dalam satu bytearray, dengan dict telegram_id -> slot. Nilai yang tidak
+    muat di format padat (tanggal tidak valid, kuota di luar 0-255, id bukan
+    angka, dst.) disimpan apa adanya di `overflow`, jadi record yang dibaca
+    kembali sama persis dengan isi sheet.
+
+    get() mengembalikan MemberRecord baru: perubahan harus disimpan lagi
+    dengan put().
+    """
+
+    OVERFLOW_FIELDS = ("telegram_id", "username", "status", "vip_expiry", "last_updated", "quota")
+
+    def __init__(self):
+        self.ids = array("q")  # telegram_id, -1 jika bukan angka (lihat overflow)
+        self.rows = array("i")  # Nomor baris sheet, 0 = None
+        self.status = array("B")  # Index ke status_names
+        self.expiry = array("i")  # date.toordinal() vip_expiry, 0 = kosong
+        self.updated = array("q")  # Detik sejak 0001-01-01 untuk last_updated, 0 = kosong
+        self.quota = array("B")
+        self.fetched = array("d")  # fetched_at (monotonic)
+        self.name_offsets = array("I")
+        self.name_lengths = array("H")
+        self.names = bytearray()
+        self.slots = {}  # int telegram_id (atau str jika bukan angka) -> slot
+        self.overflow = {}  # (slot, field) -> nilai asli yang tidak muat di kolom
+        self.rows_sorted = True  # Kolom rows urut (load penuh), cukup di-bisect langsung
+        self._row_order = None  # Slot urut nomor baris jika rows tidak urut, dibangun saat dibutuhkan
+        self.status_names = ["non-vip", "vip", ""]
+        self.status_codes = {name: code for code, name in enumerate(self.status_names)}
+        # Tanggal yang sama dipakai banyak member: parse/format sekali saja
+        self._days = {}  # "YYYY-MM-DD" -> nomor hari
+        self._day_names = {}  # nomor hari -> "YYYY-MM-DD"
+
+    @classmethod
+    def from_sheet(cls, values, first_row=2):
+        """Bangun tabel dari baris sheet members tanpa header (baris pertama per id yang menang)"""
+        table = cls()
+        columns = ([], [], [], [], [], [], [], [], [])
+        ids, rows, status, expiry, updated, quota, fetched, offsets, lengths = columns
+        names = []
+        offset = 0
+        for row, row_values in enumerate(values, start=first_row):
+            if not row_values:
+                continue
+            record = MemberRecord.from_values(row, row_values)
+            key = cls._key(record.telegram_id)
+            if not record.telegram_id or key in table.slots:
+                continue
+            slot = table.slots[key] = len(ids)
+            encoded = table._encode(slot, record, key)
+            ids.append(encoded[0])
+            status.append(encoded[1])
+            expiry.append(encoded[2])
+            updated.append(encoded[3])
+            quota.append(encoded[4])
+            rows.append(row)
+            fetched.append(record.fetched_at)
+            offsets.append(offset)
+            lengths.append(len(encoded[5]))
+            names.append(encoded[5])
+            offset += len(encoded[5])
+
+        for column, values_ in zip(
+            (table.ids, table.rows, table.status, table.expiry, table.updated,
+             table.quota, table.fetched, table.name_offsets, table.name_lengths),
+            columns
+        ):
+            column.fromlist(values_)
+        table.names = bytearray(b"".join(names))
+        return table
+
+    @staticmethod
+    def _key(user_id):
+        user_id = str(user_id)
+        # Hanya angka tanpa nol di depan yang bisa bolak-balik int <-> str tanpa berubah
+        if user_id.isdigit() and user_id.isascii() and len(user_id) <= 18 and (user_id[0] != "0" or user_id == "0"):
+            return int(user_id)
+        return user_id
+
+    def __len__(self):
+        return len(self.slots)
+
+    def __contains__(self, user_id):
+        return self._key(user_id) in self.slots
+
+    # ----- Encode / decode kolom -----
+    def _day(self, value):
+        """Nomor hari untuk "YYYY-MM-DD", None jika tidak bisa dibentuk ulang persis"""
+        day = self._days.get(value)
+        if day is None:
+            try:
+                parsed = date.fromisoformat(value)
+            except (TypeError, ValueError):
+                return None
+            if parsed.isoformat() != value:
+                return None
+            day = self._days[value] = parsed.toordinal()
+            self._day_names[day] = value
+        return day
+
+    def _day_name(self, day):
+        name = self._day_names.get(day)
+        if name is None:
+            name = self._day_names[day] = date.fromordinal(day).isoformat()
+        return name
+
+    def _seconds(self, value):
+        """Detik untuk "YYYY-MM-DD HH:MM:SS", None untuk format lain"""
+        if len(value) != 19 or value[10] != " " or value[13] != ":" or value[16] != ":":
+            return None
+        clock = value[11:13] + value[14:16] + value[17:19]
+        day = self._day(value[:10])
+        if day is None or not (clock.isascii() and clock.isdigit()):
+            return None
+        hour, minute, second = int(clock[:2]), int(clock[2:4]), int(clock[4:])
+        if hour > 23 or minute > 59 or second > 59:
+            return None
+        return day * 86400 + hour * 3600 + minute * 60 + second
+
+    def _encode(self, slot, record, key):
+        """(id, status, expiry, updated, quota, username) untuk kolom; nilai lain ke overflow"""
+        overflow = self.overflow
+        if not isinstance(key, int):
+            overflow[(slot, "telegram_id")] = record.telegram_id
+            key = -1
+
+        code = self.status_codes.get(record.status)
+        if code is None:
+            if len(self.status_names) < 256:
+                code = self.status_codes[record.status] = len(self.status_names)
+                self.status_names.append(record.status)
+            else:
+                overflow[(slot, "status")] = record.status
+                code = 0
+
+        expiry = 0
+        if record.vip_expiry:
+            expiry = self._day(record.vip_expiry) or 0
+            if not expiry:
+                overflow[(slot, "vip_expiry")] = record.vip_expiry
+
+        updated = 0
+        if record.last_updated:
+            updated = self._seconds(record.last_updated) or 0
+            if not updated:
+                overflow[(slot, "last_updated")] = record.last_updated
+
+        quota = record.quota
+        if type(quota) is not int or not 0 <= quota <= 255:
+            overflow[(slot, "quota")] = quota
+            quota = 0
+
+        name = record.username.encode("utf-8")
+        if len(name) > 65535:
+            overflow[(slot, "username")] = record.username
+            name = b""
+        return key, code, expiry, updated, quota, name
+
+    def _record(self, slot):
+        overflow = self.overflow
+        expiry = self.expiry[slot]
+        updated = self.updated[slot]
+        if updated:
+            days, seconds = divmod(updated, 86400)
+            hour, seconds = divmod(seconds, 3600)
+            minute, second = divmod(seconds, 60)
+            last_updated = f"{self._day_name(days)} {hour:02d}:{minute:02d}:{second:02d}"
+        else:
+            last_updated = overflow.get((slot, "last_updated"), "") if overflow else ""
+        offset = self.name_offsets[slot]
+        record = MemberRecord(
+            telegram_id=str(self.ids[slot]),
+            username=self.names[offset:offset + self.name_lengths[slot]].decode("utf-8"),
+            status=self.status_names[self.status[slot]],
+            vip_expiry=self._day_name(expiry) if expiry else "",
+            last_updated=last_updated,
+            quota=self.quota[slot],
+            row=self.rows[slot] or None,
+            fetched_at=self.fetched[slot]
+        )
+        if overflow:
+            for name in self.OVERFLOW_FIELDS:
+                value = overflow.get((slot, name))
+                if value is not None:
+                    setattr(record, name, value)
+        return record
+
+    # ----- Akses -----
+    def get(self, user_id):
+        """MemberRecord (salinan) atau None"""
+        slot = self.slots.get(self._key(user_id))
+        return None if slot is None else self._record(slot)
+
+    def put(self, record):
+        """Tambah atau timpa member berdasarkan telegram_id"""
+        key = self._key(record.telegram_id)
+        slot = self.slots.get(key)
+        if slot is None:
+            slot = self.slots[key] = len(self.ids)
+            for column in (self.ids, self.status, self.expiry, self.updated,
+                           self.quota, self.name_offsets, self.name_lengths):
+                column.append(0)
+            self.fetched.append(0.0)  # rows diisi oleh _set_row
+        else:
+            for name in self.OVERFLOW_FIELDS:
+                self.overflow.pop((slot, name), None)
+
+        key, code, expiry, updated, quota, name = self._encode(slot, record, key)
+        self.ids[slot] = key
+        self._set_row(slot, record.row or 0)
+        self.status[slot] = code
+        self.expiry[slot] = expiry
+        self.updated[slot] = updated
+        self.quota[slot] = quota
+        self.fetched[slot] = record.fetched_at
+        offset = self.name_offsets[slot]
+        if self.names[offset:offset + self.name_lengths[slot]] != name:
+            # Username lama dibiarkan sebagai sampah sampai index dimuat ulang
+            self.name_offsets[slot] = len(self.names)
+            self.name_lengths[slot] = len(name)
+            self.names += name
+
+    def row_of(self, user_id):
+        """Nomor baris sheet member ini, None jika tidak dikenal"""
+        slot = self.slots.get(self._key(user_id))
+        return None if slot is None else self.rows[slot] or None
+
+    def _set_row(self, slot, row):
+        rows, order = self.rows, self._row_order
+        keep_order = False
+        if len(rows) == slot:
+            rows.append(row)
+            # Baris baru di akhir sheet (kasus umum) cukup ditambahkan ke urutan
+            keep_order = order is not None and (not order or rows[order[-1]] <= row)
+            if keep_order:
+                order.append(slot)
+        elif rows[slot] == row:
+            return
+        else:
+            rows[slot] = row
+        # append_row yang berjalan bersamaan bisa selesai tidak urut baris
+        if self.rows_sorted and not (
+            (slot == 0 or rows[slot - 1] <= row) and (slot + 1 == len(rows) or row <= rows[slot + 1])
+        ):
+            self.rows_sorted = False
+        if not keep_order:
+            self._row_order = None
+
+    def id_at_row(self, row):
+        """telegram_id yang menempati baris sheet ini, None jika tidak ada"""
+        rows = self.rows
+        if self.rows_sorted:
+            slot = bisect_left(rows, row)
+            found = slot < len(rows) and rows[slot] == row
+        else:
+            if self._row_order is None:
+                self._row_order = array("i", sorted(range(len(rows)), key=rows.__getitem__))
+            order = self._row_order
+            index = bisect_left(order, row, key=rows.__getitem__)
+            found = index < len(order) and rows[order[index]] == row
+            slot = order[index] if found else None
+        return self._record(slot).telegram_id if found else None
+
+    def values(self):
+        """Semua record, urut slot (= urut baris saat dimuat dari sheet)"""
+        # Salin daftar slot: member baru boleh ditambah selama iterasi berjalan
+        for slot in list(self.slots.values()):
+            yield self._record(slot)
+
+    def items(self):
+        for record in self.values():
+            yield record.telegram_id, record
+
+    def vip_records(self):
+        """Hanya member berstatus vip (tanpa membuat record untuk member lain)"""
+        vip = self.status_codes["vip"]
+        for slot in self.slots.values():
+            if self.status[slot] == vip and (slot, "status") not in self.overflow:
+                yield self._record(slot)
+
+    def reset_stale_quotas(self, now, quota):
+        """Set kuota penuh untuk semua member yang last_updated-nya sebelum hari ini.
+
+        Dikerjakan langsung di kolom; return nomor baris yang berubah.
+        """
+        today = now.date().toordinal() * 86400
+        stamp = today + now.hour * 3600 + now.minute * 60 + now.second
+        updated = self.updated
+        changed = []
+        for slot in self.slots.values():
+            if 0 < updated[slot] < today:
+                updated[slot] = stamp
+                self.quota[slot] = quota
+                self.overflow.pop((slot, "quota"), None)
+                changed.append(self.rows[slot])
+        return changed
+
+# ===== INTERFACE =====
+class Storage:
+    """Interface penyimpanan member, kuota, status VIP dan katalog film"""
+
+    async def start(self):
+        """Dipanggil saat aplikasi start (di dalam event loop)"""
+
+    async def stop(self):
+        """Dipanggil saat aplikasi berhenti, flush semua yang tertunda"""
+
+    async def flush(self):
+        """Pastikan semua penulisan tertunda sudah tersimpan"""
+
+    async def keep_alive(self):
+        """Jaga koneksi ke backend tetap hidup"""
+
+    async def sync_sheets(self):
+        """Terapkan perubahan yang dibuat langsung di sheet ke cache (inkremental).
+
+        Return list telegram_id member yang berubah, atau None jika index
+        dimuat ulang penuh (anggap semua member bisa berubah).
+        """
+        return []
+
+    async def get_member(self, user_id):
+        """MemberRecord user atau None jika belum terdaftar"""
+        raise NotImplementedError
+
+    async def add_member(self, user_id, username):
+        """Daftarkan member baru (non-vip, kuota 5) dan kembalikan record-nya"""
+        raise NotImplementedError
+
+    async def update_member(self, user_id, **values):
+        """Update field member (status, vip_expiry, last_updated, quota)"""
+        raise NotImplementedError
+
+    async def refresh_member(self, user_id):
+        """Baca ulang satu member yang diubah proses lain (cache lokal + VipIndex)"""
+        raise NotImplementedError
+
+    async def member_snapshot(self):
+        """Dict telegram_id -> MemberRecord yang segar, dibaca dalam satu kali baca"""
+        raise NotImplementedError
+
+    async def update_members(self, updates):
+        """Terapkan {user_id: {field: nilai}} untuk banyak member dalam satu penulisan"""
+        raise NotImplementedError
+
+    async def iter_members(self, batch_size=500):
+        """Async generator: semua member dalam list berisi maksimal batch_size record"""
+        raise NotImplementedError
+        yield
+
+    async def get_vip_index(self):
+        """VipIndex yang sudah dimuat dan mengikuti semua update member"""
+        raise NotImplementedError
+
+    async def vips_expiring(self, start, end):
+        """telegram_id VIP yang expiry-nya di [start, end), misal untuk pengingat"""
+        return (await self.get_vip_index()).expiring_between(start, end)
+
+    async def expire_vips(self, now):
+        """Turunkan semua VIP yang sudah habis ke non-vip dalam satu penulisan.
+
+        Kembalikan list telegram_id yang diturunkan.
+        """
+        index = await self.get_vip_index()
+        expired = index.pop_expired(now)
+        if not expired:
+            return []
+        try:
+            await self.update_members({user_id: {"status": "non-vip"} for user_id, _ in expired})
+        except Exception:
+            # Dicoba lagi oleh sweep berikutnya
+            for user_id, expiry in expired:
+                index.set(user_id, expiry)
+            raise
+        return [user_id for user_id, _ in expired]
+
+    async def consume_quota(self, user_id, now):
+        """Kurangi kuota hari ini secara atomik per user.
+
+        Kembalikan sisa kuota setelah dikurangi, atau None jika sudah habis.
+        """
+        raise NotImplementedError
+
+    async def reset_daily_quotas(self, now):
+        """Tulis kuota penuh untuk semua member yang last_updated-nya sebelum hari ini"""
+        raise NotImplementedError
+
+    async def get_film(self, film_code):
+        """Entry katalog film atau None jika kode tidak ada"""
+        raise NotImplementedError
+
+    async def reload_films(self):
+        """Muat ulang katalog film, kembalikan jumlah film"""
+        raise NotImplementedError
+
+# ===== GOOGLE SHEETS =====
+# gspread & oauth2client baru di-import saat SheetsStorage dibuat, supaya
+# backend SQLite dan proses yang belum butuh Sheets tidak membayar biayanya.
+def rowcol_to_a1(row, col):
+    """Koordinat 1-based ke notasi A1 (sama seperti gspread.utils.rowcol_to_a1)"""
+    label = ""
+    while col:
+        col, rem = divmod(col - 1, 26)
+        label = chr(65 + rem) + label
+    return f"{label}{row}"
+
+class SheetWriteBuffer:
+    """Antrian tulis cell yang digabung per baris lalu dikirim sebagai satu batch_update"""
+
+    def __init__(self, write, flush_interval, max_pending):
+        self.write = write  # coroutine(data) yang mengirim batch_update
+        self.flush_interval = flush_interval
+        self.max_pending = max_pending
+        self.pending = {}  # row -> {col: value}
+        self.in_flight = {}  # row -> {col: value} yang sedang dikirim oleh flush
+        self._trackers = []  # Tulisan selesai per pembacaan sheet yang sedang berjalan (lihat tracking)
+        self._flush_lock = asyncio.Lock()
+        self._task = None
+        self._threshold_flush = None
+
+    def pending_cells(self):
+        return sum(len(cols) for cols in self.pending.values())
+
+    def unflushed(self, row):
+        """{kolom: nilai} baris ini yang belum pasti ada di sheet (sedang dikirim + masih antre)"""
+        cols = dict(self.in_flight.get(row, {}))
+        cols.update(self.pending.get(row, {}))
+        return cols
+
+    def unflushed_rows(self):
+        return self.in_flight.keys() | self.pending.keys()
+
+    @contextmanager
+    def tracking(self):
+        """Kumpulkan {row: {kolom: nilai}} yang selesai ditulis selama blok berjalan.
+
+        Hasil baca sheet untuk baris tersebut bisa diambil sebelum tulisan
+        masuk, jadi tidak boleh menimpa nilai lokal yang lebih baru.
+        """
+        written = {}
+        self._trackers.append(written)
+        try:
+            yield written
+        finally:
+            self._trackers.remove(written)
+
+    def queue(self, row, values):
+        """Antrekan penulisan {kolom: nilai} untuk satu baris"""
+        self.queue_many([(row, values)])
+
+    def queue_many(self, items):
+        """Antrekan banyak (row, {kolom: nilai}) sekaligus, flush batas dicek sekali"""
+        for row, values in items:
+            self.pending.setdefault(row, {}).update(values)
+        if self.pending_cells() >= self.max_pending and (
+            self._threshold_flush is None or self._threshold_flush.done()
+        ):
+            self._threshold_flush = asyncio.get_running_loop().create_task(self._background_flush())
+
+    async def _background_flush(self):
+        # Task mewarisi context pemanggil (prioritas user), padahal flush
+        # ini bukan bagian dari request user mana pun
+        with sheets_priority(PRIORITY_BACKGROUND):
+            return await self.flush()
+
+    @staticmethod
+    def _build_ranges(pending):
+        """Gabungkan kolom yang bersebelahan per baris menjadi range A1"""
+        data = []
+        for row, cols in sorted(pending.items()):
+            run = []
+            for col in sorted(cols):
+                if run and col != run[-1] + 1:
+                    data.append(SheetWriteBuffer._range_entry(row, run, cols))
+                    run = []
+                run.append(col)
+            if run:
+                data.append(SheetWriteBuffer._range_entry(row, run, cols))
+        return data
+
+    @staticmethod
+    def _range_entry(row, run, cols):
+        start = rowcol_to_a1(row, run[0])
+        end = rowcol_to_a1(row, run[-1])
+        return {
+            'range': start if start == end else f"{start}:{end}",
+            'values': [[cols[col] for col in run]]
+        }
+
+    async def flush(self, raise_errors=False):
+        """Kirim semua penulisan yang tertunda dalam satu request.
+
+        raise_errors: lempar ulang error penulisan (setelah batch dikembalikan
+        ke antrian) untuk pemanggil yang harus tahu tulisannya sudah masuk.
+        """
+        async with self._flush_lock:
+            if not self.pending:
+                return 0
+            batch, self.pending = self.pending, {}
+            data = self._build_ranges(batch)
+
+            self.in_flight = batch
+            try:
+                await self.write(data)
+            except Exception as e:
+                # Kembalikan ke antrian tanpa menimpa nilai yang lebih baru
+                for row, cols in batch.items():
+                    merged = dict(cols)
+                    merged.update(self.pending.get(row, {}))
+                    self.pending[row] = merged
+                logger.error(f"Gagal flush {len(data)} range ke Sheets: {e}")
+                if raise_errors:
+                    raise
+                return 0
+            finally:
+                self.in_flight = {}
+            for written in self._trackers:
+                for row, cols in batch.items():
+                    written.setdefault(row, {}).update(cols)
+
+            logger.info(f"Flush {len(data)} range ({len(batch)} baris) ke Sheets")
+            return len(data)
+
+    async def _run(self):
+        # Flush periodik boleh ditunda scheduler; yang gagal tetap di antrian
+        while True:
+            await asyncio.sleep(self.flush_interval)
+            await self._background_flush()
+
+    def start(self):
+        """Mulai flush periodik di event loop yang sedang berjalan"""
+        if self._task is None or self._task.done():
+            self._task = asyncio.get_running_loop().create_task(self._run())
+
+    async def stop(self):
+        """Hentikan flush periodik lalu flush sisa antrian"""
+        if self._task is not None:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+        await self.flush()
+
+def _status_code(error):
+    return getattr(getattr(error, "response", None), "status_code", None)
+
+def _is_rate_limited(error):
+    """True jika error dari Google API adalah 429 (kuota terlampaui)"""
+    return _status_code(error) == 429
+
+def _is_auth_error(error):
+    """Token ditolak/tidak bisa diperbarui: perlu otorisasi ulang"""
+    return _status_code(error) == 401 or type(error).__name__ in ("RefreshError", "AccessTokenRefreshError")
+
+def _is_transport_error(error):
+    """Koneksi putus/timeout: cukup ganti sesi HTTP"""
+    import requests
+
+    return isinstance(error, (
+        requests.exceptions.ConnectionError,
+        requests.exceptions.Timeout,
+        requests.exceptions.ChunkedEncodingError
+    ))
+
+def _film_record(header, values):
+    """Satu baris film_links sebagai dict, sama seperti hasil get_all_records()"""
+    from gspread.utils import numericise_all
+
+    width = max(len(header), len(values))
+    keys = list(header) + [""] * (width - len(header))
+    return dict(zip(keys, numericise_all(list(values) + [""] * (width - len(values)))))
+
+def _column_letter(col):
+    return re.sub(r"\d", "", rowcol_to_a1(1, max(col, 1)))
+
+def _row_from_updated_range(response):
+    """Ambil nomor baris awal dari response append (misal 'members!A12:F12')"""
+    try:
+        updated_range = response['updates']['updatedRange']
+        return int(re.search(r'![A-Z]+(\d+)', updated_range).group(1))
+    except Exception:
+        return None
+
+class SheetsStorage(Storage):
+    """Backend Google Sheets (spreadsheet cdrama_database)"""
+
+    def __init__(self, service_account_info, spreadsheet_name="cdrama_database",
+                 max_workers=8, retry_backoff=2, flush_interval=5, flush_max_cells=200,
+                 member_record_ttl=300, film_cache_ttl=600, reads_per_minute=60,
+                 writes_per_minute=60, user_max_wait=10, background_max_wait=30,
+                 circuit_failure_threshold=5, circuit_reset_timeout=30, shared_state=None,
+                 sync_block_size=500, sync_verify_blocks=2):
+        self.spreadsheet_name = spreadsheet_name
+        self.max_workers = max_workers
+        self.retry_backoff = retry_backoff
+        self.member_record_ttl = member_record_ttl
+        self.film_cache_ttl = film_cache_ttl
+        # SharedState opsional: kuota harian dihitung bersama oleh semua worker
+        self.shared_state = shared_state
+        self.sync_block_size = sync_block_size
+        self.sync_verify_blocks = sync_verify_blocks
+
+        # Semua panggilan gspread bersifat blocking, jadi dijalankan di thread
+        # pool terbatas agar event loop tetap melayani update lain.
+        self.executor = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix="sheets")
+        # Semua request lewat scheduler supaya burst tidak melampaui kuota per menit
+        self.scheduler = SheetsScheduler(
+            reads_per_minute=reads_per_minute,
+            writes_per_minute=writes_per_minute,
+            user_max_wait=user_max_wait,
+            background_max_wait=background_max_wait
+        )
+        # Saat Sheets down request langsung gagal (dan dilayani dari cache),
+        # pemulihan dicek oleh probe di background
+        self.breaker = CircuitBreaker(
+            "sheets",
+            self._probe,
+            failure_threshold=circuit_failure_threshold,
+            reset_timeout=circuit_reset_timeout
+        )
+        self.member_writes = SheetWriteBuffer(
+            self._write_member_cells,
+            flush_interval=flush_interval,
+            max_pending=flush_max_cells
+        )
+
+        # Index resident telegram_id -> member, supaya lookup user tidak
+        # perlu download seluruh sheet members setiap klik. Record yang lebih
+        # tua dari member_record_ttl dibaca ulang dengan satu range read.
+        self.member_index = MemberTable()
+        self.member_index_loaded = False
+        self.member_index_lock = asyncio.Lock()
+        self.vip_index = VipIndex()  # Dibangun ulang bersama member_index
+        self.user_locks = KeyedLocks()
+        self.next_member_row = 2
+
+        # Sinkronisasi inkremental: jumlah baris + fingerprint per blok sejak
+        # load penuh terakhir, supaya perubahan di sheet terbaca tanpa
+        # get_all_values. Diganti objek baru setiap load penuh.
+        self.member_sync = self._new_sync()
+        self.member_sync_lock = asyncio.Lock()  # Satu sync members sekaligus (job + add_member)
+        self.film_sync = self._new_sync()
+        self.sheets_modified = None  # modifiedTime Drive saat sync_sheets terakhir
+
+        # Katalog film jarang berubah, jadi disimpan per kode dan hanya dimuat
+        # ulang setelah film_cache_ttl habis atau lewat reload_films().
+        self.film_cache = {}  # code (str) -> dict field film yang sudah di-parse
+        self.film_rows = {}  # code -> nomor baris sheet
+        self.film_header = None
+        self.film_cache_loaded_at = None
+        self.film_cache_lock = asyncio.Lock()
+
+        # Client gspread dibuat sekali dan dipakai terus; handle worksheet
+        # memegang client yang sama, jadi token/sesi bisa diganti di tempat.
+        self.service_account_info = service_account_info
+        self.client = None
+        self.spreadsheet_id = None
+        self.worksheet_ids = {}  # judul worksheet -> sheet id
+        self._token_lock = threading.Lock()
+        self._token_session = None
+        self.light_recoveries = 0  # Pemulihan ringan berturut-turut sejak request terakhir yang berhasil
+        self.connect()
+        logger.info("✅ Berhasil terhubung ke Google Sheets")
+
+    # ----- Koneksi -----
+    def connect(self):
+        """Otorisasi lalu buka worksheet members dan film_links (reconnect penuh)"""
+        import gspread
+
+        auth = self._credentials()
+        self.client = gspread.Client(auth=auth, session=self._new_session(auth))
+        if self.spreadsheet_id is None:
+            spreadsheet = self.client.open(self.spreadsheet_name)  # Cari lewat Drive, sekali saja
+            self.spreadsheet_id = spreadsheet.id
+        else:
+            spreadsheet = self.client.open_by_key(self.spreadsheet_id)
+
+        # Satu request metadata untuk semua worksheet, dipilih berdasarkan id
+        worksheets = spreadsheet.worksheets()
+        if not self.worksheet_ids:
+            self.worksheet_ids = {ws.title: ws.id for ws in worksheets}
+        by_id = {ws.id: ws for ws in worksheets}
+        self.sheet_members = by_id[self.worksheet_ids["members"]]
+        self.sheet_films = by_id[self.worksheet_ids["film_links"]]
+
+    def _credentials(self):
+        """Kredensial google-auth dari service account (format yang dipakai gspread)"""
+        from gspread.utils import convert_credentials
+        from oauth2client.service_account import ServiceAccountCredentials
+
+        return convert_credentials(
+            ServiceAccountCredentials.from_json_keyfile_dict(self.service_account_info, SHEETS_SCOPE)
+        )
+
+    def _new_session(self, auth):
+        """AuthorizedSession dengan pool koneksi keep-alive seukuran thread pool"""
+        import requests
+        from google.auth.transport.requests import AuthorizedSession
+
+        session = AuthorizedSession(auth)
+        adapter = requests.adapters.HTTPAdapter(pool_connections=1, pool_maxsize=self.max_workers)
+        session.mount("https://", adapter)
+        return session
+
+    def ensure_token(self):
+        """Perbarui token OAuth sebelum kedaluwarsa, bukan menunggu ditolak 401"""
+        auth = getattr(self.client, "auth", None)
+        if auth is None or not self._token_expiring(auth):
+            return
+        with self._token_lock:
+            if self._token_expiring(auth):
+                import requests
+                from google.auth.transport.requests import Request
+
+                if self._token_session is None:
+                    self._token_session = requests.Session()
+                auth.refresh(Request(self._token_session))
+                logger.info("Token Google Sheets diperbarui")
+
+    @staticmethod
+    def _token_expiring(auth):
+        return not auth.token or auth.expiry is None or auth.expiry - datetime.utcnow() < TOKEN_REFRESH_MARGIN
+
+    def _authorized_call(self, func):
+        self.ensure_token()
+        return func()
+
+    async def run_blocking(self, func, *args):
+        """Jalankan fungsi blocking di thread pool Sheets"""
+        loop = asyncio.get_running_loop()
+        return await loop.run_in_executor(self.executor, partial(func, *args))
+
+    def recover_connection(self, error):
+        """Pulihkan koneksi sesuai jenis error, tanpa membuka ulang spreadsheet.
+
+        Jika pemulihan ringan sebelumnya tidak menolong (error yang sama
+        datang lagi sebelum ada request berhasil) atau gagal sendiri,
+        fallback ke refresh_connection.
+        """
+        if self.client is None or getattr(self.client, "auth", None) is None:
+            return
+        auth_error = _is_auth_error(error)
+        if not auth_error and not _is_transport_error(error):
+            return
+        if self.light_recoveries > 0:
+            self.refresh_connection()
+            return
+        try:
+            if auth_error:
+                # Kredensial baru, dipasang di client yang sama dengan handle worksheet
+                self.client.auth = self._credentials()
+                self.client.session.close()
+                self.client.session = self._new_session(self.client.auth)
+                metrics.SHEETS_RECONNECTS.inc(kind="auth")
+                logger.info("Otorisasi Google Sheets diperbarui")
+            else:
+                self.client.session.close()
+                self.client.session = self._new_session(self.client.auth)
+                metrics.SHEETS_RECONNECTS.inc(kind="session")
+                logger.info("Sesi HTTP Google Sheets dibuat ulang")
+            self.light_recoveries += 1
+        except Exception as e:
+            logger.error(f"Gagal memulihkan sesi Google Sheets: {e}")
+            self.refresh_connection()
+
+    def refresh_connection(self):
+        """Reconnect penuh (client baru + buka spreadsheet berdasarkan id)"""
+        try:
+            self.connect()
+            self.light_recoveries = 0
+            metrics.SHEETS_RECONNECTS.inc(kind="full")
+            logger.info("Koneksi Google Sheets diperbarui")
+            return True
+        except Exception as e:
+            logger.error(f"Gagal refresh koneksi: {e}")
+            return False
+
+    async def safe_sheets_operation(self, func, max_retries=3, kind="read"):
+        """Eksekusi operasi Google Sheets di thread pool dengan retry + backoff.
+
+        kind ("read"/"write") menentukan kuota yang dipakai di scheduler.
+        SheetsOverloaded dari scheduler dan CircuitOpen tidak di-retry.
+        """
+        # Nama method pemanggil ("load_member_index.<locals>.operation" -> "load_member_index")
+        name = func.__qualname__.split(".<locals>")[0].rsplit(".", 1)[-1]
+        for attempt in range(max_retries):
+            self.breaker.check()
+            await self.scheduler.acquire(kind)
+            metrics.count_sheets_call()
+            started = time.perf_counter()
+            try:
+                result = await self.run_blocking(self._authorized_call, func)
+                metrics.SHEETS_CALLS.inc(operation=name, result="ok")
+                self.breaker.record_success()
+                self.light_recoveries = 0
+                return result
+            except Exception as e:
+                metrics.SHEETS_CALLS.inc(operation=name, result="error")
+                logger.warning(f"Percobaan {attempt+1} gagal: {e}")
+                error = e
+                rate_limited = _is_rate_limited(e)
+                if not rate_limited:
+                    self.breaker.record_failure()  # 429 = kuota, bukan outage
+                if attempt == max_retries - 1 or self.breaker.is_open:
+                    raise
+                metrics.SHEETS_RETRIES.inc(operation=name)
+            finally:
+                metrics.SHEETS_LATENCY.observe(time.perf_counter() - started, operation=name)
+            if rate_limited:
+                # Jeda ditanggung scheduler untuk semua request, bukan sleep per request
+                self.scheduler.penalize(kind, self.retry_backoff * 2 ** attempt)
+                continue
+            await asyncio.sleep(self.retry_backoff * 2 ** attempt)
+            # Error lain (5xx dsb.) cukup di-retry dengan koneksi yang sama
+            await self.run_blocking(self.recover_connection, error)
+
+    async def _probe(self):
+        """Request paling ringan untuk mengecek apakah Sheets sudah pulih"""
+        def operation():
+            return self.sheet_films.row_values(1)
+
+        await self.scheduler.acquire("read", PRIORITY_BACKGROUND)
+        try:
+            await self.run_blocking(self._authorized_call, operation)
+        except Exception as e:
+            await self.run_blocking(self.recover_connection, e)
+            raise
+        self.light_recoveries = 0
+
+    async def start(self):
+        self.member_writes.start()
+
+    async def stop(self):
+        await self.member_writes.stop()
+        await self.breaker.stop()
+
+    async def flush(self):
+        # Semua yang diantrekan sebelum panggilan ini sudah ditulis oleh flush
+        # sebelumnya atau ikut batch ini; antrian baru dari user lain tidak dicek
+        await self.member_writes.flush(raise_errors=True)
+
+    async def keep_alive(self):
+        """Cukup pastikan token masih berlaku; sesi dan handle worksheet dipakai ulang"""
+        await self.run_blocking(self.ensure_token)
+
+    async def _write_member_cells(self, data):
+        def operation():
+            self.sheet_members.batch_update(data, value_input_option="USER_ENTERED")
+        await self.safe_sheets_operation(operation, kind="write")
+
+    # ----- Member -----
+    async def load_member_index(self):
+        """Memuat ulang index member dari sheet (satu kali baca seluruh sheet)"""
+        def operation():
+            return self.sheet_members.get_all_values()
+
+        with self.member_writes.tracking() as written:
+            values = (await self.safe_sheets_operation(operation))[1:]  # Lewati baris header
+        # Sama seperti scan lama: baris pertama per telegram_id yang menang
+        index = MemberTable.from_sheet(values, first_row=2)
+        for row in written.keys() | self.member_writes.unflushed_rows():
+            user_id = index.id_at_row(row)
+            if user_id is not None:
+                record = index.get(user_id)
+                self._overlay_local(record, written)
+                index.put(record)
+
+        self.member_index = index
+        self.vip_index.rebuild(index.vip_records())
+        self.next_member_row = len(values) + 2
+        self.member_sync = self._new_sync()
+        self.member_sync.reset(values)
+        self.member_index_loaded = True
+        logger.info(f"Index member dimuat: {len(index)} user")
+
+    async def ensure_member_index(self):
+        """Muat index member jika belum pernah dimuat"""
+        if self.member_index_loaded:
+            return
+        async with self.member_index_lock:
+            if not self.member_index_loaded:
+                await self.load_member_index()
+
+    async def fetch_member_record(self, record):
+        """Baca ulang satu baris member dengan satu range read"""
+        row = record.row
+
+        def operation():
+            return self.sheet_members.get(f"A{row}:F{row}")
+
+        with self.member_writes.tracking() as written:
+            values = await self.safe_sheets_operation(operation)
+        fresh = MemberRecord.from_values(row, values[0] if values else [])
+        if fresh.telegram_id != record.telegram_id:
+            # Baris bergeser (misal ada baris dihapus), index harus dibangun ulang
+            logger.warning(f"Baris {row} bukan milik user {record.telegram_id}, memuat ulang index")
+            await self.load_member_index()
+            return self.member_index.get(record.telegram_id)
+
+        self._store_member(fresh, written)
+        return fresh
+
+    def _overlay_local(self, record, written):
+        """Timpa hasil baca dengan tulisan lokal yang lebih baru.
+
+        written = tulisan yang selesai selama pembacaan (hasil baca bisa
+        diambil sebelum tulisan itu masuk), ditambah yang masih dikirim/antre.
+        """
+        cols = dict(written.get(record.row, {}))
+        cols.update(self.member_writes.unflushed(record.row))
+        for col, value in cols.items():
+            setattr(record, MEMBER_COLUMNS[col], int(value) if col == 6 else value)
+
+    def _store_member(self, record, written):
+        """Simpan record yang baru dibaca dari sheet ke index + VipIndex"""
+        self._overlay_local(record, written)
+        self.member_index.put(record)
+        self.vip_index.update(record)
+
+    async def get_member(self, user_id):
+        """Mendapatkan MemberRecord user (maksimal satu request ke Sheets)"""
+        await self.ensure_member_index()
+        record = self.member_index.get(str(user_id))
+        if (record is not None and self.member_record_ttl
+                and time.monotonic() - record.fetched_at > self.member_record_ttl):
+            metrics.CACHE_REQUESTS.inc(cache="member", result="stale")
+            try:
+                record = await self.fetch_member_record(record)
+            except Exception as e:
+                # Sheets tidak tersedia: pakai data terakhir yang diketahui
+                logger.warning(f"Member {user_id} dilayani dari cache lama: {e}")
+                metrics.CACHE_REQUESTS.inc(cache="member", result="fallback")
+                return replace(record, stale=True)
+        else:
+            metrics.CACHE_REQUESTS.inc(cache="member", result="hit")
+        return record
+
+    async def add_member(self, user_id, username):
+        await self.ensure_member_index()
+        if self.shared_state is None:
+            return await self._append_member(user_id, username)
+        # Worker lain bisa sudah menambahkan user ini sementara index lokal
+        # belum tahu; baris kedua akan kalah dari baris pertama saat index
+        # dimuat ulang, beserta semua kuota/VIP yang ditulis ke sana
+        async with self.shared_state.lock(f"member:{user_id}"):
+            await self.sync_member_index()  # Baris yang di-append worker lain ada di tail
+            record = self.member_index.get(str(user_id))
+            if record is not None:
+                return record
+            return await self._append_member(user_id, username)
+
+    async def _append_member(self, user_id, username):
+        record = MemberRecord(
+            telegram_id=str(user_id),
+            username=username,
+            last_updated=datetime.now().strftime("%Y-%m-%d %H:%M:%S"),
+            quota=5  # Kuota awal
+        )
+
+        def operation():
+            return self.sheet_members.append_row(record.to_values())
+
+        response = await self.safe_sheets_operation(operation, kind="write")
+        record.row = _row_from_updated_range(response) or self.next_member_row
+        self.next_member_row = max(self.next_member_row, record.row + 1)
+        self.member_index.put(record)
+        return record
+
+    async def update_member(self, user_id, **values):
+        """Update index lalu antrekan penulisan ke sheet (di-flush oleh member_writes)"""
+        await self.ensure_member_index()
+        record = self.member_index.get(str(user_id))
+        if record is None:
+            raise KeyError(f"User {user_id} not found in sheet")
+        for name, value in values.items():
+            setattr(record, name, value)
+        self.member_index.put(record)
+        if VIP_FIELDS & values.keys():
+            self.vip_index.update(record)
+        self.member_writes.queue(record.row, {MEMBER_FIELDS[name]: value for name, value in values.items()})
+
+    async def refresh_member(self, user_id):
+        """Satu range read untuk baris user ini (user yang belum ada di index dilewati)"""
+        record = self.member_index.get(str(user_id))
+        if record is not None:
+            await self.fetch_member_record(record)
+
+    async def member_snapshot(self):
+        """Flush tulisan tertunda lalu baca ulang seluruh sheet member (satu get_all_values)"""
+        await self.flush()
+        await self.load_member_index()
+        return dict(self.member_index.items())
+
+    async def update_members(self, updates):
+        """Semua perubahan dikirim dalam satu batch_update"""
+        await self.ensure_member_index()
+        items = []
+        for user_id, values in updates.items():
+            record = self.member_index.get(str(user_id))
+            if record is None:
+                raise KeyError(f"User {user_id} not found in sheet")
+            for name, value in values.items():
+                setattr(record, name, value)
+            self.member_index.put(record)
+            if VIP_FIELDS & values.keys():
+                self.vip_index.update(record)
+            items.append((record.row, {MEMBER_FIELDS[name]: value for name, value in values.items()}))
+        self.member_writes.queue_many(items)
+        await self.flush()
+
+    async def consume_quota(self, user_id, now):
+        """Baca-ubah-tulis kuota di bawah lock per user (tanpa lock global)"""
+        async with self.user_locks.hold(str(user_id)):
+            record = await self.get_member(user_id)
+            if record is None:
+                raise KeyError(f"User {user_id} not found in sheet")
+            quota = record.quota_today(now.date())
+            if self.shared_state is not None:
+                # Index lokal tiap worker bisa tertinggal, sisa kuota diambil dari state bersama
+                remaining = await self.shared_state.take_quota(user_id, now.date().isoformat(), quota)
+            else:
+                remaining = quota - 1 if quota > 0 else None
+            if remaining is None:
+                return None
+            values = {'quota': remaining}
+            if record.quota_stale(now.date()):
+                values['last_updated'] = now.strftime("%Y-%m-%d %H:%M:%S")
+            await self.update_member(user_id, **values)
+            return remaining
+
+    async def reset_daily_quotas(self, now):
+        """Reset massal: semua baris basi dikirim dalam satu batch_update"""
+        await self.ensure_member_index()
+        timestamp = now.strftime("%Y-%m-%d %H:%M:%S")
+        rows = self.member_index.reset_stale_quotas(now, DAILY_QUOTA)
+        self.member_writes.queue_many([(row, {5: timestamp, 6: DAILY_QUOTA}) for row in rows])
+        await self.member_writes.flush()
+        return len(rows)
+
+    async def export_members(self, records):
+        """Tulis record dari backend lain ke sheet: update baris lama, append sisanya"""
+        await self.ensure_member_index()
+        new_records = []
+        for record in records:
+            existing = self.member_index.get(record.telegram_id)
+            if existing is None:
+                new_records.append(replace(record))
+                continue
+            self.member_writes.queue(existing.row, dict(zip(range(2, 7), record.to_values()[1:])))
+            for name in ("username", "status", "vip_expiry", "last_updated", "quota"):
+                setattr(existing, name, getattr(record, name))
+            self.member_index.put(existing)
+            self.vip_index.update(existing)
+
+        if new_records:
+            def operation():
+                return self.sheet_members.append_rows(
+                    [record.to_values() for record in new_records],
+                    value_input_option="USER_ENTERED"
+                )
+
+            response = await self.safe_sheets_operation(operation, kind="write")
+            first_row = _row_from_updated_range(response) or self.next_member_row
+            for offset, record in enumerate(new_records):
+                record.row = first_row + offset
+                self.member_index.put(record)
+                self.vip_index.update(record)
+            self.next_member_row = max(self.next_member_row, first_row + len(new_records))
+
+        await self.member_writes.flush()
+
+    async def all_members(self):
+        """Semua record member dari index"""
+        await self.ensure_member_index()
+        return list(self.member_index.values())
+
+    async def get_vip_index(self):
+        await self.ensure_member_index()
+        return self.vip_index
+
+    async def iter_members(self, batch_size=500):
+        """Member urut baris sheet dari index (tanpa request tambahan jika index sudah ada)"""
+        await self.ensure_member_index()
+        # Slot tabel sudah urut baris; record dibuat per batch, bukan sekaligus
+        batch = []
+        for record in self.member_index.values():
+            batch.append(record)
+            if len(batch) >= batch_size:
+                yield batch
+                batch = []
+        if batch:
+            yield batch
+
+    # ----- Sinkronisasi inkremental -----
+    def _new_sync(self):
+        return SheetSync(block_size=self.sync_block_size, verify_blocks=self.sync_verify_blocks)
+
+    async def _modified_time(self):
+        """modifiedTime spreadsheet dari Drive, None jika tidak bisa dibaca"""
+        def operation():
+            return self.sheet_members.spreadsheet.get_lastUpdateTime()
+
+        try:
+            return await self.safe_sheets_operation(operation, max_retries=1)
+        except Exception as e:
+            logger.warning(f"Gagal membaca modifiedTime spreadsheet: {e}")
+            return None
+
+    async def sync_sheets(self):
+        """Cek modifiedTime Drive dulu; hanya jika berubah, sync members + film_links"""
+        modified = await self._modified_time()
+        if modified is not None and modified == self.sheets_modified:
+            metrics.SHEET_SYNCS.inc(sheet="spreadsheet", result="unchanged")
+            return []
+        changed = await self.sync_member_index()
+        async with self.film_cache_lock:
+            await self.sync_film_cache()
+        self.sheets_modified = modified
+        return changed
+
+    async def sync_member_index(self):
+        """Terapkan baris baru/berubah di sheet members ke index (satu batch_get).
+
+        Return telegram_id yang berubah, None jika index dimuat ulang penuh.
+        """
+        if not self.member_index_loaded:
+            return []
+        async with self.member_sync_lock:
+            return await self._sync_member_index()
+
+    async def _sync_member_index(self):
+        # Tulisan sendiri di-flush dulu supaya tidak terbaca sebagai perubahan lama
+        await self.member_writes.flush()
+        sync = self.member_sync
+        ranges = sync.ranges("F")
+
+        def operation():
+            return self.sheet_members.batch_get(ranges)
+
+        with self.member_writes.tracking() as written:
+            results = await self.safe_sheets_operation(operation)
+        if sync is not self.member_sync:
+            return None  # Index dimuat ulang penuh selama request berjalan
+        changes = sync.apply(results)
+        changed = None if changes is None else self._apply_member_rows(changes, written)
+        if changed is None:
+            logger.info("Baris sheet members bergeser, memuat ulang index")
+            metrics.SHEET_SYNCS.inc(sheet="members", result="reload")
+            await self.load_member_index()
+            return None
+        self.next_member_row = max(self.next_member_row, sync.first_row + sync.row_count)
+        metrics.SHEET_SYNCS.inc(sheet="members", result="incremental")
+        return changed
+
+    def _apply_member_rows(self, changes, written):
+        """telegram_id yang diterapkan, None jika perubahan tidak bisa diterapkan per baris"""
+        index = self.member_index
+        changed = []
+        for first_row, rows in changes:
+            for row, values in enumerate(rows, start=first_row):
+                record = MemberRecord.from_values(row, values) if values else None
+                key = record.telegram_id if record else ""
+                owner = index.id_at_row(row)
+                action = classify_row(row, key, owner, index.row_of(key) if key else None)
+                if action == RELOAD:
+                    return None
+                if action == PUT:
+                    self._store_member(record, written)
+                    changed.append(key)
+        metrics.SHEET_SYNC_ROWS.inc(len(changed), sheet="members")
+        return changed
+
+    async def sync_film_cache(self):
+        """Terapkan baris baru/berubah di sheet film_links ke katalog (satu batch_get)"""
+        if self.film_header is None:
+            return
+        sync = self.film_sync
+        ranges = ["1:1"] + sync.ranges(_column_letter(len(self.film_header)))
+
+        def operation():
+            return self.sheet_films.batch_get(ranges)
+
+        results = await self.safe_sheets_operation(operation)
+        if sync is not self.film_sync:
+            return
+        header = [str(value) for value in results[0][0]] if results[0] else []
+        changes = sync.apply(results[1:]) if header == self.film_header else None
+        if changes is None or not self._apply_film_rows(changes):
+            logger.info("Struktur sheet film_links berubah, memuat ulang katalog")
+            metrics.SHEET_SYNCS.inc(sheet="film_links", result="reload")
+            await self.load_film_cache()
+            return
+        self.film_cache_loaded_at = time.monotonic()
+        metrics.SHEET_SYNCS.inc(sheet="film_links", result="incremental")
+
+    def _apply_film_rows(self, changes):
+        owners = {row: code for code, row in self.film_rows.items()}
+        applied = 0
+        for first_row, rows in changes:
+            for row, values in enumerate(rows, start=first_row):
+                entry = film_entry(_film_record(self.film_header, values)) if values else None
+                code = entry['code'] if entry else ""
+                action = classify_row(row, code, owners.get(row), self.film_rows.get(code) if code else None)
+                if action == RELOAD:
+                    return False
+                if action == PUT:
+                    self.film_cache[code] = entry
+                    self.film_rows[code] = row
+                    applied += 1
+        metrics.SHEET_SYNC_ROWS.inc(applied, sheet="film_links")
+        return True
+
+    # ----- Film -----
+    async def load_film_cache(self):
+        """Memuat ulang seluruh katalog film dari sheet (satu get_all_values)"""
+        def operation():
+            return self.sheet_films.get_all_values()
+
+        values = await self.safe_sheets_operation(operation)
+        header = [str(value) for value in values[0]] if values else []
+        while header and header[-1] == "":
+            header.pop()
+        cache = {}
+        rows = {}
+        for row, row_values in enumerate(values[1:], start=2):
+            entry = film_entry(_film_record(header, row_values))
+            if entry['code'] and entry['code'] not in cache:
+                cache[entry['code']] = entry
+                rows[entry['code']] = row
+
+        self.film_cache = cache
+        self.film_rows = rows
+        self.film_header = header
+        self.film_sync = self._new_sync()
+        self.film_sync.reset(values[1:])
+        self.film_cache_loaded_at = time.monotonic()
+        logger.info(f"Katalog film dimuat: {len(cache)} film")
+        return len(cache)
+
+    def _film_cache_expired(self):
+        """Cek apakah cache katalog film perlu dimuat ulang"""
+        return (self.film_cache_loaded_at is None
+                or time.monotonic() - self.film_cache_loaded_at > self.film_cache_ttl)
+
+    async def get_film(self, film_code):
+        """Mendapatkan data film dari cache (muat ulang jika TTL habis)"""
+        if self._film_cache_expired():
+            async with self.film_cache_lock:
+                if self._film_cache_expired():
+                    metrics.CACHE_REQUESTS.inc(cache="film", result="miss")
+                    try:
+                        if self.film_header is None:
+                            await self.load_film_cache()
+                        else:
+                            await self.sync_film_cache()
+                    except Exception as e:
+                        if self.film_cache_loaded_at is None:
+                            raise
+                        # Katalog lama tetap dipakai supaya deep link tetap bisa diputar
+                        logger.warning(f"Katalog film dilayani dari cache lama: {e}")
+                        metrics.CACHE_REQUESTS.inc(cache="film", result="fallback")
+                        film = self.film_cache.get(str(film_code))
+                        return dict(film, stale=True) if film else None
+                    return self.film_cache.get(str(film_code))
+        metrics.CACHE_REQUESTS.inc(cache="film", result="hit")
+        return self.film_cache.get(str(film_code))
+
+    async def reload_films(self):
+        return await self.load_film_cache()
+
+# ===== SQLITE =====
+SQLITE_SCHEMA = """
+CREATE TABLE IF NOT EXISTS members (
+    telegram_id TEXT PRIMARY KEY,
+    username TEXT NOT NULL DEFAULT '',
+    status TEXT NOT NULL DEFAULT 'non-vip',
+    vip_expiry TEXT NOT NULL DEFAULT '',
+    last_updated TEXT NOT NULL DEFAULT '',
+    quota INTEGER NOT NULL DEFAULT 0,
+    rev INTEGER NOT NULL DEFAULT 1,
+    exported_rev INTEGER NOT NULL DEFAULT 0
+);
+CREATE INDEX IF NOT EXISTS idx_members_vip ON members (status, vip_expiry);
+CREATE INDEX IF NOT EXISTS idx_members_export ON members (rev, exported_rev);
+CREATE TABLE IF NOT EXISTS films (
+    code TEXT PRIMARY KEY,
+    title TEXT NOT NULL DEFAULT '',
+    free_msg_id INTEGER,
+    vip_msg_id INTEGER,
+    is_part2_vip INTEGER NOT NULL DEFAULT 1,
+    free_link TEXT,
+    vip_link TEXT
+);
+"""
+
+MEMBER_SELECT = "SELECT telegram_id, username, status, vip_expiry, last_updated, quota FROM members"
+FILM_SELECT = "SELECT code, title, free_msg_id, vip_msg_id, is_part2_vip, free_link, vip_link FROM films"
+
+def _member_from_row(row):
+    return MemberRecord(
+        telegram_id=row[0],
+        username=row[1],
+        status=row[2],
+        vip_expiry=row[3],
+        last_updated=row[4],
+        quota=row[5]
+    )
+
+def _film_from_row(row):
+    return {
+        'code': row[0],
+        'title': row[1],
+        'free_msg_id': row[2],
+        'vip_msg_id': row[3],
+        'is_part2_vip': bool(row[4]),
+        'free_link': row[5],
+        'vip_link': row[6],
+    }
+
+class SQLiteStorage(Storage):
+    """Backend SQLite lokal, opsional mengekspor member ke sheet untuk tim ops"""
+
+    def __init__(self, path, sheets=None, export_interval=300, films_csv=None):
+        self.path = path
+        self.sheets = sheets  # SheetsStorage untuk ekspor member & sumber katalog film
+        self.films_csv = films_csv  # Sumber katalog film tanpa Sheets (mode offline)
+        self.export_interval = export_interval
+        self._export_task = None
+        self.vip_index = VipIndex()
+        self.vip_index_loaded = False
+
+        # Satu thread agar semua akses ke koneksi SQLite berurutan
+        self.executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix="sqlite")
+        self.conn = sqlite3.connect(path, check_same_thread=False, isolation_level=None)
+        self.conn.execute("PRAGMA journal_mode=WAL")
+        self.conn.execute("PRAGMA synchronous=NORMAL")
+        self.conn.executescript(SQLITE_SCHEMA)
+        logger.info(f"✅ Storage SQLite dibuka: {path}")
+
+    async def run(self, func, *args):
+        """Jalankan operasi SQLite di thread khusus"""
+        loop = asyncio.get_running_loop()
+        return await loop.run_in_executor(self.executor, partial(func, *args))
+
+    def _execute(self, sql, params=()):
+        return self.conn.execute(sql, params).fetchall()
+
+    def _executemany(self, statements):
+        """Jalankan beberapa (sql, params) dalam satu transaksi"""
+        with self.conn:
+            self.conn.execute("BEGIN")
+            for sql, params in statements:
+                self.conn.execute(sql, params)
+
+    async def start(self):
+        if self.sheets is None:
+            films = (await self.run(self._execute, "SELECT COUNT(*) FROM films"))[0][0]
+            if films == 0 and self.films_csv:
+                logger.info(f"Import katalog film dari {self.films_csv}: {await self.reload_films()} film")
+            return
+        await self.sheets.start()
+        count = (await self.run(self._execute, "SELECT COUNT(*) FROM members"))[0][0]
+        if count == 0:
+            await self.import_from_sheets()
+        self._export_task = asyncio.get_running_loop().create_task(self._export_loop())
+
+    async def stop(self):
+        if self._export_task is not None:
+            self._export_task.cancel()
+            try:
+                await self._export_task
+            except asyncio.CancelledError:
+                pass
+            self._export_task = None
+        if self.sheets is not None:
+            await self.export_to_sheets()
+            await self.sheets.stop()
+
+    async def flush(self):
+        if self.sheets is not None:
+            await self.export_to_sheets()
+
+    # ----- Member -----
+    async def get_member(self, user_id):
+        rows = await self.run(self._execute, f"{MEMBER_SELECT} WHERE telegram_id = ?", (str(user_id),))
+        return _member_from_row(rows[0]) if rows else None
+
+    async def add_member(self, user_id, username):
+        record = MemberRecord(
+            telegram_id=str(user_id),
+            username=username,
+            last_updated=datetime.now().strftime("%Y-%m-%d %H:%M:%S"),
+            quota=5  # Kuota awal
+        )
+        await self.run(
+            self._execute,
+            "INSERT OR IGNORE INTO members (telegram_id, username, status, vip_expiry, last_updated, quota) "
+            "VALUES (?, ?, ?, ?, ?, ?)",
+            tuple(record.to_values())
+        )
+        return record
+
+    @staticmethod
+    def _member_update(user_id, values):
+        """(sql, params) untuk update field satu member"""
+        for name in values:
+            if name not in MEMBER_FIELDS or name == "telegram_id":
+                raise ValueError(f"Field member tidak dikenal: {name}")
+        assignments = ", ".join(f"{name} = ?" for name in values)
+        return (
+            f"UPDATE members SET {assignments}, rev = rev + 1 WHERE telegram_id = ?",
+            (*values.values(), str(user_id))
+        )
+
+    async def update_member(self, user_id, **values):
+        await self.run(self._execute, *self._member_update(user_id, values))
+        if VIP_FIELDS & values.keys():
+            await self._refresh_vip_index([user_id])
+
+    async def refresh_member(self, user_id):
+        # Baris SQLite selalu dibaca langsung, hanya VipIndex yang perlu diperbarui
+        await self._refresh_vip_index([user_id])
+
+    async def member_snapshot(self):
+        rows = await self.run(self._execute, MEMBER_SELECT)
+        return {row[0]: _member_from_row(row) for row in rows}
+
+    async def update_members(self, updates):
+        """Semua update dalam satu transaksi"""
+        statements = [self._member_update(user_id, values) for user_id, values in updates.items()]
+        await self.run(self._executemany, statements)
+        await self._refresh_vip_index([user_id for user_id, values in updates.items() if VIP_FIELDS & values.keys()])
+
+    async def get_vip_index(self):
+        """Dimuat dari member berstatus vip saat pertama dipakai"""
+        if not self.vip_index_loaded:
+            rows = await self.run(self._execute, f"{MEMBER_SELECT} WHERE status = 'vip'")
+            self.vip_index.rebuild(_member_from_row(row) for row in rows)
+            self.vip_index_loaded = True
+        return self.vip_index
+
+    async def _refresh_vip_index(self, user_ids):
+        """Baca ulang status/expiry member yang berubah ke VipIndex"""
+        if not self.vip_index_loaded or not user_ids:
+            return
+        user_ids = [str(user_id) for user_id in user_ids]
+        rows = await self.run(
+            self._execute,
+            f"{MEMBER_SELECT} WHERE telegram_id IN ({', '.join('?' * len(user_ids))})",
+            tuple(user_ids)
+        )
+        found = {row[0]: _member_from_row(row) for row in rows}
+        for user_id in user_ids:
+            record = found.get(user_id)
+            if record is None:
+                self.vip_index.set(user_id, None)
+            else:
+                self.vip_index.update(record)
+
+    async def iter_members(self, batch_size=500):
+        """Keyset pagination per telegram_id, jadi tabel besar tidak dibaca sekaligus"""
+        last_id = ""
+        while True:
+            rows = await self.run(
+                self._execute,
+                f"{MEMBER_SELECT} WHERE telegram_id > ? ORDER BY telegram_id LIMIT ?",
+                (last_id, batch_size)
+            )
+            if not rows:
+                return
+            yield [_member_from_row(row) for row in rows]
+            last_id = rows[-1][0]
+
+    async def consume_quota(self, user_id, now):
+        """Satu UPDATE ... RETURNING, jadi atomik tanpa lock di sisi Python"""
+        timestamp = now.strftime("%Y-%m-%d %H:%M:%S")
+        params = {'id': str(user_id), 'today': timestamp[:10], 'now': timestamp, 'daily': DAILY_QUOTA}
+        stale = "(last_updated != '' AND last_updated < :today)"
+        rows = await self.run(
+            self._execute,
+            f"UPDATE members SET "
+            f"quota = CASE WHEN {stale} THEN :daily ELSE quota END - 1, "
+            f"last_updated = CASE WHEN {stale} THEN :now ELSE last_updated END, "
+            f"rev = rev + 1 "
+            f"WHERE telegram_id = :id AND CASE WHEN {stale} THEN :daily ELSE quota END > 0 "
+            f"RETURNING quota",
+            params
+        )
+        return rows[0][0] if rows else None
+
+    async def reset_daily_quotas(self, now):
+        timestamp = now.strftime("%Y-%m-%d %H:%M:%S")
+        rows = await self.run(
+            self._execute,
+            "UPDATE members SET quota = ?, last_updated = ?, rev = rev + 1 "
+            "WHERE last_updated != '' AND last_updated < ? RETURNING telegram_id",
+            (DAILY_QUOTA, timestamp, timestamp[:10])
+        )
+        return len(rows)
+
+    # ----- Film -----
+    async def get_film(self, film_code):
+        rows = await self.run(self._execute, f"{FILM_SELECT} WHERE code = ?", (str(film_code),))
+        return _film_from_row(rows[0]) if rows else None
+
+    async def reload_films(self):
+        """Salin katalog dari sheet, atau dari films_csv tanpa sheet, lalu kembalikan jumlah film"""
+        if self.sheets is not None:
+            await self.sheets.load_film_cache()
+            await self.replace_films(self.sheets.film_cache.values())
+        elif self.films_csv:
+            await self.replace_films(await asyncio.to_thread(read_films_csv, self.films_csv))
+        return (await self.run(self._execute, "SELECT COUNT(*) FROM films"))[0][0]
+
+    async def replace_films(self, films):
+        """Ganti seluruh katalog film dalam satu transaksi"""
+        statements = [("DELETE FROM films", ())]
+        for film in films:
+            statements.append((
+                "INSERT OR REPLACE INTO films VALUES (?, ?, ?, ?, ?, ?, ?)",
+                (film['code'], film['title'], film['free_msg_id'], film['vip_msg_id'],
+                 int(film['is_part2_vip']), film['free_link'], film['vip_link'])
+            ))
+        await self.run(self._executemany, statements)
+
+    # ----- Sinkronisasi dengan sheet -----
+    async def import_from_sheets(self):
+        """Isi database kosong dari sheet members & film_links"""
+        records = await self.sheets.all_members()
+        statements = [(
+            "INSERT OR IGNORE INTO members (telegram_id, username, status, vip_expiry, last_updated, quota, rev, exported_rev) "
+            "VALUES (?, ?, ?, ?, ?, ?, 1, 1)",
+            tuple(record.to_values())
+        ) for record in records]
+        await self.run(self._executemany, statements)
+        films = await self.reload_films()
+        logger.info(f"Import dari Sheets: {len(records)} member, {films} film")
+
+    async def export_to_sheets(self):
+        """Ekspor member yang berubah sejak ekspor terakhir ke sheet"""
+        rows = await self.run(
+            self._execute,
+            "SELECT telegram_id, username, status, vip_expiry, last_updated, quota, rev "
+            "FROM members WHERE rev > exported_rev"
+        )
+        if not rows:
+            return 0
+        await self.sheets.export_members([_member_from_row(row) for row in rows])
+        # Baris yang berubah lagi selama ekspor tetap punya rev > exported_rev
+        await self.run(self._executemany, [
+            ("UPDATE members SET exported_rev = ? WHERE telegram_id = ?", (row[6], row[0]))
+            for row in rows
+        ])
+        logger.info(f"Ekspor {len(rows)} member ke Sheets")
+        return len(rows)
+
+    async def _export_loop(self):
+        with sheets_priority(PRIORITY_BACKGROUND):
+            await self._export_forever()
+
+    async def _export_forever(self):
+        while True:
+            await asyncio.sleep(self.export_interval)
+            try:
+                await self.export_to_sheets()
+            except Exception as e:
+                logger.error(f"Gagal ekspor member ke Sheets: {e}")
@@ -0,0 +1,132 @@
+import logging
+import asyncio
+from collections import OrderedDict, deque
+
+logger = logging.getLogger(__name__)
+
+UPDATE_TYPES = ("message", "edited_message", "callback_query", "channel_post", "my_chat_member")
+
+def chat_key(data):
+    """Kunci urutan untuk satu update mentah: id chat, atau id user sebagai cadangan"""
+    for update_type in UPDATE_TYPES:
+        payload = data.get(update_type)
+        if not isinstance(payload, dict):
+            continue
+        chat = payload.get("chat") or (payload.get("message") or {}).get("chat")
+        if chat and "id" in chat:
+            return chat["id"]
+        sender = payload.get("from")
+        if sender and "id" in sender:
+            return sender["id"]
+    return ("update", data.get("update_id"))
+
+class UpdateDispatcher:
+    """Antrian update terbatas yang dikuras oleh pool worker async.
+
+    Webhook cukup memanggil submit() lalu langsung membalas 200. Update dari
+    chat yang sama diproses berurutan oleh satu worker; chat lain paralel.
+    """
+
+    def __init__(self, process, workers=8, maxsize=1000, dedupe_size=10000, enqueue_timeout=5, claim=None):
+        self.process = process  # coroutine(data) untuk satu update mentah
+        self.claim = claim  # coroutine(update_id) -> False jika proses lain sudah menerima update ini
+        self.workers = max(1, workers)
+        self.maxsize = maxsize
+        self.dedupe_size = dedupe_size
+        self.enqueue_timeout = enqueue_timeout
+        self.capacity = asyncio.Semaphore(maxsize)
+        self.ready = asyncio.Queue()  # kunci chat yang punya update menunggu
+        self.chats = {}  # kunci chat -> deque update mentah (chat yang sedang aktif)
+        self.seen = OrderedDict()  # update_id yang sudah diterima (dedupe)
+        self.size = 0
+        self._tasks = []
+        self._accepting = True
+
+    def is_duplicate(self, update_id):
+        return update_id in self.seen
+
+    def _remember(self, update_id):
+        self.seen[update_id] = True
+        while len(self.seen) > self.dedupe_size:
+            self.seen.popitem(last=False)
+
+    async def submit(self, data):
+        """Masukkan update ke antrian.
+
+        Return "queued", "duplicate", atau "full" jika antrian tetap penuh
+        setelah enqueue_timeout (Telegram akan mengirim ulang nanti).
+        """
+        update_id = data.get("update_id")
+        if self.is_duplicate(update_id):
+            return "duplicate"
+        if not self._accepting:
+            return "full"
+
+        try:
+            await asyncio.wait_for(self.capacity.acquire(), timeout=self.enqueue_timeout)
+        except asyncio.TimeoutError:
+            logger.warning(f"Antrian update penuh ({self.maxsize}), update {update_id} ditolak")
+            return "full"
+
+        # Bisa saja update yang sama masuk selama menunggu kapasitas
+        if self.is_duplicate(update_id):
+            self.capacity.release()
+            return "duplicate"
+        self._remember(update_id)
+
+        # Klaim lintas worker baru setelah dapat slot: update yang ditolak karena
+        # antrian penuh harus tetap bisa diterima saat Telegram mengirim ulang
+        if self.claim is not None:
+            try:
+                claimed = await self.claim(update_id)
+            except Exception as e:
+                logger.warning(f"Klaim update {update_id} gagal, tetap diproses: {e}")
+                claimed = True
+            if not claimed:
+                self.capacity.release()
+                return "duplicate"
+
+        key = chat_key(data)
+        self.size += 1
+        if key in self.chats:
+            self.chats[key].append(data)
+        else:
+            self.chats[key] = deque([data])
+            self.ready.put_nowait(key)
+        return "queued"
+
+    async def _worker(self):
+        while True:
+            key = await self.ready.get()
+            pending = self.chats[key]
+            while pending:
+                data = pending.popleft()
+                try:
+                    await self.process(data)
+                except Exception as e:
+                    logger.error(f"Error processing update {data.get('update_id')}: {e}")
+                finally:
+                    self.size -= 1
+                    self.capacity.release()
+            del self.chats[key]
+            self.ready.task_done()
+
+    def start(self):
+        """Jalankan pool worker di event loop yang sedang berjalan"""
+        if self._tasks:
+            return
+        self._accepting = True
+        loop = asyncio.get_running_loop()
+        self._tasks = [loop.create_task(self._worker()) for _ in range(self.workers)]
+
+    async def stop(self, timeout=10):
+        """Berhenti menerima update, tunggu antrian habis, lalu matikan worker"""
+        self._accepting = False
+        try:
+            await asyncio.wait_for(self.ready.join(), timeout=timeout)
+        except asyncio.TimeoutError:
+            logger.warning(f"{self.size} update belum diproses saat shutdown")
+        for task in self._tasks:
+            task.cancel()
+        await asyncio.gather(*self._tasks, return_exceptions=True)
+        self._tasks = []
@@ -1,12 +1,77 @@
 from flask import Flask, request, jsonify
+import asyncio
 import hmac
 import hashlib
+import json
 import os
-from datetime import datetime, timedelta
-from main import logger, TRAKTEER_PACKAGE_MAPPING, update_vip_status
+import logging
+from threading import Thread
+# Tanpa import main: bot Telegram, FastAPI dan handler tidak ikut dimuat di proses Flask
+from payments import PaymentLedger, TRAKTEER_PACKAGE_MAPPING, payment_txn_id, apply_payment
+from storage import SheetsStorage, SQLiteStorage, KeyedLocks
+from shared_state import SharedState
+
+logging.basicConfig(
+    format='%(asctime)s - %(name)s - %(levelname)s - %(message)s',
+    level=logging.INFO
+)
+logger = logging.getLogger(__name__)
+
+# Nama env sama dengan main.py supaya ledger, storage dan state bersama sama dengan bot
+PAYMENTS_DB = os.getenv('PAYMENTS_DB', "payments.db")
+PAYMENT_MAX_ATTEMPTS = int(os.getenv('PAYMENT_MAX_ATTEMPTS', 10))
+SHARED_STATE_DB = os.getenv('SHARED_STATE_DB', "")
+STORAGE_BACKEND = os.getenv('STORAGE_BACKEND', "sheets")
+SQLITE_PATH = os.getenv('SQLITE_PATH', "cdrama.db")
 
 app = Flask(__name__)
 
+# Satu event loop di thread sendiri untuk semua coroutine storage, supaya
+# lock/antrian storage tidak berpindah-pindah loop antar request Flask.
+loop = asyncio.new_event_loop()
+Thread(target=loop.run_forever, daemon=True).start()
+
+ledger = PaymentLedger(PAYMENTS_DB)
+shared_state = SharedState(SHARED_STATE_DB) if SHARED_STATE_DB else None
+local_locks = KeyedLocks()
+storage = None
+
+async def get_storage():
+    """Storage dibuat saat pembayaran pertama, bukan saat import"""
+    global storage
+    if storage is None:
+        if STORAGE_BACKEND == "sqlite":
+            instance = SQLiteStorage(SQLITE_PATH)
+        else:
+            instance = await asyncio.to_thread(
+                SheetsStorage, json.loads(os.getenv('GOOGLE_SERVICE_ACCOUNT')), shared_state=shared_state
+            )
+        await instance.start()
+        storage = instance
+    return storage
+
+def member_lock(key):
+    """Lock yang sama dengan bot jika SHARED_STATE_DB diisi"""
+    return shared_state.lock(key) if shared_state is not None else local_locks.hold(key)
+
+async def invalidate_member(user_id):
+    if shared_state is not None:
+        await shared_state.publish_invalidation(user_id)
+
+async def apply_vip_payment(txn_id, user_id, package_id, data):
+    """Catat di ledger lalu terapkan seperti /trakteer_webhook di main.py.
+
+    Return status ledger ("applied", "pending", "failed") atau "duplicate"
+    jika transaksi ini sudah pernah diterima (retry Trakteer).
+    """
+    if not await ledger.record(txn_id, user_id, package_id, data):
+        return "duplicate"
+    await apply_payment(
+        await get_storage(), ledger, txn_id, TRAKTEER_PACKAGE_MAPPING, PAYMENT_MAX_ATTEMPTS,
+        lock=member_lock, on_applied=invalidate_member
+    )
+    return (await ledger.get(txn_id)).status
+
 @app.route('/trakteer_webhook', methods=['POST'])
 def handle_webhook():
     try:
@@ -29,9 +94,18 @@ def handle_webhook():
                 user_id = email.split("@")[0]
                 
                 if package_id in TRAKTEER_PACKAGE_MAPPING:
-                    if update_vip_status(user_id, package_id):
+                    txn_id = payment_txn_id(data)
+                    status = asyncio.run_coroutine_threadsafe(
+                        apply_vip_payment(txn_id, user_id, package_id, data), loop
+                    ).result()
+                    if status == "duplicate":
+                        logger.info(f"Duplicate payment {txn_id} ignored")
+                        return jsonify({"status": "duplicate"})
+                    if status == "applied":
                         logger.info(f"VIP updated for user {user_id} with package {package_id}")
                         return jsonify({"status": "success"})
+                    # Pending: dicoba lagi oleh retry_pending_payments
+                    return jsonify({"status": "accepted"})
         
         return jsonify({"status": "ignored"})
         